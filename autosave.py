@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import project
+import project_container
+
+
+class _Entry:
+    """Snapshot of one session plus its serialized forms, computed once by the writer"""
+
+    __slots__ = ("snapshot", "_data", "_text")
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._data = None
+        self._text = None
+
+    def data(self):
+        if self._data is None:
+            self._data = project.snapshot_to_dict(self.snapshot)
+        return self._data
+
+    def text(self):
+        if self._text is None:
+            self._text = project.dumps_entry(self.data())
+        return self._text
+
+
+class ProjectAutosaver:
+    """Writes project files on a background thread.
+
+    `save()` runs on the UI thread and only snapshots the sessions marked dirty;
+    the other sessions reuse the snapshot (and serialized JSON) of an earlier
+    save. Serialization and the atomic write happen on a single worker thread,
+    and saves requested while one is running collapse into one.
+
+    With `journal=True`, a save that only changes existing sessions appends
+    those entries to `<project>.journal` (see project.apply_journal) instead of
+    rewriting the whole file. The journal is folded back into the project after
+    JOURNAL_MAX_RECORDS records or when images are added, removed or reordered.
+
+    Binary containers (.labx) are always rewritten in full; their selections
+    are stored as compressed bitmaps, so this stays cheap, and selections not
+    read since the project was opened are copied as their compressed chunks.
+    """
+
+    JOURNAL_MAX_RECORDS = 200
+
+    def __init__(self, journal=False):
+        self.journal = journal
+        self.last_error = None
+        self._entries = {}  # session -> latest _Entry (UI thread only)
+        self._lock = threading.Lock()
+        self._pending = {}  # path -> latest requested save of that project
+        self._idle = threading.Event()
+        self._idle.set()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+        # State of the file on disk (writer thread only)
+        self._written_path = None
+        self._written = []
+        self._written_header = None
+        self._journal_records = 0
+
+    @property
+    def busy(self):
+        return not self._idle.is_set()
+
+    def save(self, path, sessions, active_index, export_format, dirty=(), checkpoint=False):
+        """Snapshot changed sessions and queue a background write of the project.
+
+        `checkpoint` forces a full rewrite of the project file (e.g. for Save As).
+        """
+        entries = {}
+        for session in sessions:
+            entry = self._entries.get(session)
+            if entry is None or session in dirty:
+                entry = _Entry(project.session_snapshot(session))
+            entries[session] = entry
+        self._entries = entries
+
+        with self._lock:
+            running = self.busy
+            previous = self._pending.get(path)
+            # A pending checkpoint stays one even if the newer save would have journaled
+            checkpoint = checkpoint or (previous is not None and previous[4])
+            self._pending[path] = (path, list(entries.values()), active_index, export_format, checkpoint)
+            self._idle.clear()
+        if not running:
+            self._executor.submit(self._drain)
+
+    def wait(self, timeout=None):
+        """Block until every requested save has been written; False on timeout"""
+        return self._idle.wait(timeout)
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._idle.set()
+                    return
+                request = self._pending.pop(next(iter(self._pending)))
+            try:
+                self._write(*request)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self._written_path = None
+
+    def _write(self, path, entries, active_index, export_format, checkpoint):
+        header = {"active_index": active_index, "export_format": export_format}
+        if (self.journal and not checkpoint and path == self._written_path
+                and self._journal_records < self.JOURNAL_MAX_RECORDS
+                and os.path.exists(project.journal_path(path))
+                and [e.snapshot["path"] for e in entries] == [e.snapshot["path"] for e in self._written]):
+            self._append_journal(path, entries, header)
+            return
+
+        full_header = project.project_header(active_index, export_format)
+        container = project_container.is_container_path(path)
+        if container:
+            images = [entry.snapshot for entry in entries]
+            project.atomic_write(path, project_container.pack(dict(full_header, images=images)))
+        else:
+            text = project.dumps_project(full_header, [entry.text() for entry in entries])
+            project.atomic_write(path, text)
+        project.remove_journal(path)
+        if self.journal and not container:
+            self._start_journal(path, full_header["save_id"])
+        self._written_path = path
+        self._written = entries
+        self._written_header = header
+        self._journal_records = 0
+
+    def _start_journal(self, path, save_id):
+        with open(project.journal_path(path), 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"save_id": save_id}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _append_journal(self, path, entries, header):
+        records = [{"index": i, "entry": entry.data()}
+                   for i, (entry, old) in enumerate(zip(entries, self._written)) if entry is not old]
+        if header != self._written_header:
+            records.append(header)
+        if records:
+            with open(project.journal_path(path), 'a', encoding='utf-8') as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+                f.flush()
+                os.fsync(f.fileno())
+        self._written = entries
+        self._written_header = header
+        self._journal_records += len(records)
@@ -0,0 +1,187 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from exporter import format_duration
+from sources import is_loaded
+
+# Bytes Pillow keeps per pixel in memory (multi-band modes are padded to 4)
+_PIXEL_BYTES = {"1": 1, "L": 1, "P": 1, "I;16": 2, "I;16B": 2, "I;16L": 2}
+
+
+def pixel_bytes(mode):
+    return _PIXEL_BYTES.get(mode, 4)
+
+
+def export_memory(job):
+    """Estimated peak bytes an ExportJob holds while it runs.
+
+    Streaming sources only hold `bands_in_flight` grid-row bands; compressed
+    single-stream sources are decoded in full first (unless already decoded).
+    """
+    session = job.session
+    bpp = pixel_bytes(session.image_mode)
+    bands = job.bands_in_flight * session.real_width * min(job.grid_h, session.real_height) * bpp
+    if is_loaded(session.original_image):
+        return bands
+    with session.region_reader() as reader:
+        if reader.streaming:
+            return bands
+    return session.real_width * session.real_height * bpp + bands
+
+
+class BatchExport:
+    """Runs many ExportJobs (one per image) on one shared encoder pool.
+
+    Jobs are started in order while the sum of their export_memory() estimates
+    stays within `memory_budget` bytes and fewer than `max_images` are running;
+    a job that does not fit waits, and later smaller ones may start ahead of it.
+    A job bigger than the whole budget runs once nothing else is running. So
+    small images export side by side while giant ones are throttled, and every
+    tile goes through the same pool, keeping all cores busy.
+
+    Jobs share `pool`, or a pool of `workers` threads created for the run.
+    Like ExportJob it owns no Tk state: poll `done`, `total`, `status_text()`
+    and `finished`. Sources decoded only for the export are released afterwards.
+
+    `prepare(job)`, if given, runs in the job's slot right before it starts,
+    so per-image work that decodes the source (tile statistics, a raw store
+    conversion) is throttled by the same budget; an exception there becomes
+    the job's error.
+    """
+
+    def __init__(self, jobs, memory_budget, max_images=4, pool=None, workers=None, on_job_done=None,
+                 prepare=None):
+        self.jobs = list(jobs)
+        self.memory_budget = memory_budget
+        self.max_images = max(1, max_images)
+        self.pool = pool
+        self.workers = workers
+        self.on_job_done = on_job_done  # called from a driver thread with each finished job
+        self.prepare = prepare
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self.reserved = 0  # bytes estimated for the running jobs
+        self.peak_reserved = 0
+        self._running = 0
+        self._cond = threading.Condition()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def total(self):
+        return sum(job.total for job in self.jobs)
+
+    @property
+    def done(self):
+        return sum(job.done for job in self.jobs)
+
+    @property
+    def saved(self):
+        return sum(job.saved for job in self.jobs)
+
+    @property
+    def errors(self):
+        return [f"{job.session.name}: {e}" for job in self.jobs for e in ([job.error] if job.error else job.errors)]
+
+    @property
+    def images_done(self):
+        return sum(1 for job in self.jobs if job.finished)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+        for job in self.jobs:
+            job.cancel()
+
+    def wait(self):
+        if self._thread:
+            self._thread.join()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def status_text(self):
+        done, total = self.done, self.total
+        pct = int(done * 100 / total) if total else 100
+        text = (f"Exporting {len(self.jobs)} images: {self.images_done} done, {self._running} running | "
+                f"{done}/{total} tiles ({pct}%)")
+        elapsed = self.elapsed()
+        if done and elapsed > 0:
+            text += f" | {done / elapsed:.0f} tiles/s"
+            text += f" | ETA {format_duration(elapsed / done * (total - done))}"
+        return text
+
+    def run(self):
+        self.started_at = time.monotonic()
+        own_pool = self.pool is None
+        if own_pool:
+            self.pool = ThreadPoolExecutor(max_workers=self.workers)
+            for job in self.jobs:
+                job.pool = self.pool
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_images) as drivers:
+                waiting = [(job, export_memory(job)) for job in self.jobs]
+                while waiting and not self._cancel.is_set():
+                    with self._cond:
+                        picked = self._pick(waiting)
+                        if picked is None:
+                            self._cond.wait(0.5)
+                            continue
+                        job, need = waiting.pop(picked)
+                        self._running += 1
+                        self.reserved += need
+                        self.peak_reserved = max(self.peak_reserved, self.reserved)
+                    drivers.submit(self._drive, job, need)
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            if own_pool:
+                self.pool.shutdown()
+            self.finished_at = time.monotonic()
+
+    def _pick(self, waiting):
+        """Index of the first waiting job that fits the budget now, or None"""
+        if self._running >= self.max_images:
+            return None
+        if self._running == 0:
+            return 0
+        for i, (_, need) in enumerate(waiting):
+            if self.reserved + need <= self.memory_budget:
+                return i
+        return None
+
+    def _drive(self, job, need):
+        was_loaded = is_loaded(job.session.original_image)
+        try:
+            try:
+                if self.prepare and not job.cancelled:
+                    self.prepare(job)
+            except Exception as e:
+                job.error = str(e)
+                job.started_at = job.finished_at = time.monotonic()  # it never runs
+            else:
+                job.run()
+        finally:
+            if not was_loaded:
+                job.session.release_source()
+            with self._cond:
+                self._running -= 1
+                self.reserved -= need
+                self._cond.notify_all()
+            if self.on_job_done:
+                self.on_job_done(job)
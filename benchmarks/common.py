@@ -0,0 +1,129 @@
+"""Helpers shared by the benchmark scripts: synthetic images, memory probes and reports."""
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+
+import PIL
+from PIL import Image
+
+MODES = ("RGB", "RGBA", "L", "I;16")
+
+
+def synthetic_image(width, height, mode="RGB", seed=0):
+    """Deterministic test card: smooth gradients plus tiled seeded noise.
+
+    The mix gives encoders a realistic amount of entropy (pure gradients
+    compress unrealistically well, pure noise unrealistically badly) and the
+    same seed always produces the same pixels.
+    """
+    rng = random.Random(seed)
+    block = Image.frombytes("L", (256, 256), bytes(rng.getrandbits(8) for _ in range(256 * 256)))
+    noise = Image.new("L", (width, height))
+    for y in range(0, height, 256):
+        for x in range(0, width, 256):
+            noise.paste(block, (x, y))
+
+    ramp_x = Image.linear_gradient("L").rotate(90).resize((width, height), Image.Resampling.BILINEAR)
+    ramp_y = Image.linear_gradient("L").resize((width, height), Image.Resampling.BILINEAR)
+    luma = Image.blend(ramp_x, noise, 0.25)
+    if mode == "L":
+        return luma
+    if mode == "I;16":
+        return luma.convert("I").point(lambda v: v * 257).convert("I;16")
+    rgb = Image.merge("RGB", (luma, Image.blend(ramp_y, noise, 0.25), ramp_x))
+    if mode == "RGB":
+        return rgb
+    alpha = Image.radial_gradient("L").resize((width, height), Image.Resampling.BILINEAR)
+    rgba = rgb.convert("RGBA")
+    rgba.putalpha(alpha.point(lambda v: 255 - v))
+    return rgba
+
+
+def source_file(directory, width, height, mode, seed=0):
+    """Path of an uncompressed TIFF holding the synthetic image, generated once per directory"""
+    name = f"synthetic_{width}x{height}_{mode.replace(';', '')}_{seed}.tiff"
+    path = os.path.join(directory, name)
+    if not os.path.exists(path):
+        os.makedirs(directory, exist_ok=True)
+        synthetic_image(width, height, mode, seed).save(path + ".tmp", format="TIFF")
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def peak_rss_bytes():
+    """Peak resident set size of this process so far, or None where it cannot be read"""
+    # ru_maxrss survives exec on Linux (a child inherits its parent's peak); VmHWM does not
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a non-empty list"""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_report(path, report):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=4)
+
+
+def compare(report, baseline, metrics, tolerance):
+    """Regressions of `report` against `baseline`.
+
+    `metrics` maps a case field to +1 when higher is better (throughput) or -1
+    when lower is better (time, memory). A case regresses when a metric is
+    worse than the baseline by more than `tolerance` (a fraction).
+    Returns a list of (case id, metric, baseline value, current value).
+    """
+    base_cases = {case["id"]: case for case in baseline.get("cases", [])}
+    regressions = []
+    for case in report["cases"]:
+        base = base_cases.get(case["id"])
+        if not base:
+            continue
+        for metric, direction in metrics.items():
+            old, new = base.get(metric), case.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old * direction
+            if change < -tolerance:
+                regressions.append((case["id"], metric, old, new))
+    return regressions
+
+
+def print_regressions(regressions, tolerance):
+    if not regressions:
+        print(f"No regressions beyond {tolerance:.0%}", file=sys.stderr)
+        return
+    print(f"{len(regressions)} regressions beyond {tolerance:.0%}:", file=sys.stderr)
+    for case_id, metric, old, new in regressions:
+        print(f"  {case_id}: {metric} {old:.4g} -> {new:.4g}", file=sys.stderr)
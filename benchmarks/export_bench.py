@@ -0,0 +1,152 @@
+"""Export throughput benchmark.
+
+    python benchmarks/export_bench.py -o report.json
+    python benchmarks/export_bench.py --quick --baseline baseline.json
+
+Slices synthetic images (see common.synthetic_image) with ExportJob for every
+combination of size, mode, export format and grid, and records tiles/s, MB/s
+written and peak RSS. Each case runs in a fresh interpreter so peak RSS is
+per case. With --baseline, cases slower or bigger than the baseline by more
+than --tolerance are listed and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.common import (MODES, compare, environment, peak_rss_bytes, print_regressions,
+                               source_file, write_report)
+from cli import parse_format, parse_grid
+from exporter import DEFAULT_PROFILE, ENCODER_PROFILES, EXPORT_FORMATS, ExportJob
+from session import ImageSession
+
+DEFAULT_SIZES = ("2048x2048", "8192x8192")
+QUICK_SIZES = ("1024x1024",)
+DEFAULT_GRIDS = ("256", "1000")
+# Higher tile counts, tiles/s and MB/s are better, lower peak RSS is better
+METRICS = {"tiles": 1, "tiles_per_s": 1, "mb_per_s": 1, "peak_rss_mb": -1}
+
+
+def run_case(source, mode, export_format, grid, workers, repeat, profile=DEFAULT_PROFILE):
+    """Slice one source image `repeat` times and keep the fastest run"""
+    session = ImageSession(source)
+    session.grid_w, session.grid_h = grid
+    best = None
+    for _ in range(repeat):
+        out = tempfile.mkdtemp(prefix="slicer_bench_")
+        try:
+            job = ExportJob(session, out, export_format, workers=workers, profile=profile)
+            started = time.perf_counter()
+            job.run()
+            seconds = time.perf_counter() - started
+            written = sum(entry.stat().st_size for entry in os.scandir(out))
+        finally:
+            shutil.rmtree(out, ignore_errors=True)
+        if best is None or seconds < best[0]:
+            best = (seconds, written, job)
+        if job.error or job.saved == 0:
+            break
+
+    seconds, written, job = best
+    peak = peak_rss_bytes()
+    return {
+        "tiles": job.saved,
+        "errors": len(job.errors) + (1 if job.error else 0),
+        "first_error": job.error or (job.errors[0] if job.errors else None),
+        "seconds": round(seconds, 4),
+        "bytes_written": written,
+        "tiles_per_s": round(job.saved / seconds, 2) if seconds else None,
+        "mb_per_s": round(written / seconds / 1e6, 2) if seconds else None,
+        "peak_rss_mb": round(peak / 1e6, 1) if peak else None,
+        # Busy seconds of each pipeline stage; encode is summed over workers
+        "stage_seconds": {stage: round(stats[0], 4) for stage, stats in job.stage_stats.items()},
+    }
+
+
+def spawn_case(case, args):
+    """Run a case in a child interpreter and return its measurements"""
+    command = [sys.executable, os.path.abspath(__file__), "--run-case", json.dumps(case),
+               "--workers", str(args.workers), "--repeat", str(args.repeat), "--profile", args.profile]
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines()
+        return {"tiles": 0, "errors": 1, "first_error": lines[-1] if lines else "crashed"}
+    return json.loads(result.stdout)
+
+
+def build_cases(args, workdir):
+    sizes = [parse_grid(s) for s in (QUICK_SIZES if args.quick and not args.sizes else args.sizes or DEFAULT_SIZES)]
+    grids = [parse_grid(g) for g in (args.grids or DEFAULT_GRIDS)]
+    formats = [parse_format(f) for f in args.formats] if args.formats else [ext for _, ext in EXPORT_FORMATS]
+    modes = args.modes or list(MODES)
+    cases = []
+    for width, height in sizes:
+        for mode in modes:
+            source = source_file(workdir, width, height, mode)
+            for export_format in formats:
+                for grid in grids:
+                    case_id = f"{width}x{height}/{mode}/{export_format[1:]}/{grid[0]}x{grid[1]}"
+                    cases.append({"id": case_id, "source": source, "size": [width, height], "mode": mode,
+                                  "format": export_format, "grid": list(grid)})
+    return cases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark tile export across formats, modes and grids")
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.10,
+                        help="allowed relative slowdown / growth before a case is flagged (default 0.10)")
+    parser.add_argument("--sizes", nargs="+", help=f"image sizes as WxH (default {' '.join(DEFAULT_SIZES)})")
+    parser.add_argument("--grids", nargs="+", help=f"grid cell sizes as WxH (default {' '.join(DEFAULT_GRIDS)})")
+    parser.add_argument("--modes", nargs="+", choices=MODES, help="image modes (default: all)")
+    parser.add_argument("--formats", nargs="+", help="export formats (default: all)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="encoder threads per export")
+    parser.add_argument("--profile", choices=list(ENCODER_PROFILES), default=DEFAULT_PROFILE,
+                        help=f"encoder profile (default {DEFAULT_PROFILE})")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is kept (default 3)")
+    parser.add_argument("--quick", action="store_true", help="small images only, for a smoke run")
+    parser.add_argument("--workdir", help="where synthetic sources are generated and reused")
+    parser.add_argument("--run-case", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_case:
+        case = json.loads(args.run_case)
+        result = run_case(case["source"], case["mode"], case["format"], tuple(case["grid"]), args.workers, args.repeat,
+                          args.profile)
+        print(json.dumps(result))
+        return 0
+
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "slicer_bench_sources")
+    cases = build_cases(args, workdir)
+    for case in cases:
+        case.update(spawn_case(case, args))
+        del case["source"]
+        if case["tiles"]:
+            print(f"{case['id']:<36} {case['tiles_per_s']:>9.1f} tiles/s {case['mb_per_s']:>8.1f} MB/s "
+                  f"{case['peak_rss_mb'] or 0:>8.1f} MB peak", file=sys.stderr)
+        else:
+            print(f"{case['id']:<36} unsupported: {case['first_error']}", file=sys.stderr)
+
+    report = {"benchmark": "export", "environment": environment(),
+              "settings": {"workers": args.workers, "repeat": args.repeat, "profile": args.profile}, "cases": cases}
+    if args.output:
+        write_report(args.output, report)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, METRICS, args.tolerance)
+        print_regressions(regressions, args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
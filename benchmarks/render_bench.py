@@ -0,0 +1,198 @@
+"""Headless viewport benchmark.
+
+    python benchmarks/render_bench.py -o render.json
+    python benchmarks/render_bench.py --size 32768x32768 --baseline render.json
+
+Replays scripted pan/zoom traces through ViewportRenderer (the same path
+SlicerLabApp.redraw uses, minus the Tk PhotoImage hand-off) on a synthetic
+image and reports p50/p95/p99 frame times plus Pillow image allocations per
+frame. Every pyramid level is built before the traces start, so the numbers
+measure rendering rather than decoding; each trace starts with an empty tile
+cache, as after switching images in the GUI. With --prefetch the viewport
+prefetcher runs between frames, as if the GUI were idle until the next one.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor, wait
+
+if __package__ in (None, ""):
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+
+from benchmarks.common import compare, environment, percentile, print_regressions, source_file, write_report
+from cli import parse_grid
+from prefetch import ViewportPrefetcher
+from render import GRID_MAX_COLUMNS, TileCache, ViewportRenderer, choose_level
+from session import ImageSession
+
+DEFAULT_SIZE = "8192x8192"
+QUICK_SIZE = "2048x2048"
+DEFAULT_VIEWPORT = "1600x900"
+# Lower is better for every reported metric
+METRICS = {"p50_ms": -1, "p95_ms": -1, "p99_ms": -1, "images_per_frame": -1}
+
+
+# Each trace takes (session, width, height, frames), prepares the session and
+# yields ("pan", dx, dy) or ("zoom", factor, x, y) steps, one per frame.
+
+def trace_zoomed_out(session, width, height, frames):
+    """Whole image in view, slow drag"""
+    session.zoom_to_fit(width, height)
+    for i in range(frames):
+        yield ("pan", 12, 0) if (i // 30) % 2 == 0 else ("pan", 0, 12)
+
+
+def trace_deep_zoom(session, width, height, frames):
+    """4x magnification in the middle of the image, fast drag"""
+    session.zoom_level = 4.0
+    session.camera_x = session.real_width / 2
+    session.camera_y = session.real_height / 2
+    for i in range(frames):
+        yield ("pan", -24, -8) if (i // 40) % 2 == 0 else ("pan", 24, -8)
+
+
+def trace_preview_threshold(session, width, height, frames):
+    """Zoom in from fit-to-window to 2x and back, crossing every pyramid level"""
+    session.zoom_to_fit(width, height)
+    half = max(1, frames // 2)
+    factor = (2.0 / session.zoom_level) ** (1.0 / half)
+    for i in range(frames):
+        yield ("zoom", factor if i < half else 1 / factor, width // 2, height // 2)
+
+
+def trace_dense_grid(session, width, height, frames):
+    """Just under GRID_MAX_COLUMNS grid lines across the viewport"""
+    session.zoom_to_fit(width, height)
+    session.grid_w = session.grid_h = max(1, int(width / session.zoom_level / (GRID_MAX_COLUMNS - 10)) + 1)
+    for i in range(frames):
+        yield ("pan", 10, 6)
+
+
+def trace_many_selected(session, width, height, frames):
+    """A checkerboard of selected cells (millions on large images), zoomed so overlays are drawn"""
+    session.grid_w = session.grid_h = 16
+    cols, rows = -(-session.real_width // 16), -(-session.real_height // 16)
+    session.selected_cells.update((c, r) for r in range(rows) for c in range(r % 2, cols, 2))
+    # About three quarters of GRID_MAX_COLUMNS cells across the viewport
+    session.zoom_level = width / (GRID_MAX_COLUMNS * 0.75 * 16)
+    session.camera_x = session.real_width / 4
+    session.camera_y = session.real_height / 4
+    for i in range(frames):
+        yield ("pan", 16, 16) if (i // 30) % 2 == 0 else ("pan", -16, 16)
+
+
+TRACES = {
+    "zoomed_out": trace_zoomed_out,
+    "deep_zoom": trace_deep_zoom,
+    "preview_threshold": trace_preview_threshold,
+    "dense_grid": trace_dense_grid,
+    "many_selected": trace_many_selected,
+}
+
+
+def replay(source, name, width, height, frames, track_python, prefetch=False):
+    session = ImageSession(source)
+    for level in range(len(session.pyramid)):
+        session.get_level(level)
+    renderer = ViewportRenderer(TileCache())
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    prefetcher = ViewportPrefetcher(renderer, pool) if prefetch else None
+
+    times, images, python_bytes = [], [], []
+    for step in TRACES[name](session, width, height, frames):
+        if step[0] == "pan":
+            session.pan(step[1], step[2])
+        else:
+            session.zoom_at(*step[1:])
+        before = Image.core.get_stats()["new_count"]
+        if track_python:
+            tracemalloc.reset_peak()
+        started = time.perf_counter()
+        _, level = choose_level(session)
+        renderer.render(session, width, height, level)
+        times.append((time.perf_counter() - started) * 1000)
+        images.append(Image.core.get_stats()["new_count"] - before)
+        if track_python:
+            python_bytes.append(tracemalloc.get_traced_memory()[1])
+        if prefetcher:
+            prefetcher.observe(session, width, height, now=len(times) / 60)
+            wait(list(prefetcher._pending.values()))
+            prefetcher.collect()
+    if pool:
+        pool.shutdown()
+
+    cache = renderer.cache
+    result = {
+        "id": name,
+        "frames": len(times),
+        "p50_ms": round(percentile(times, 50), 3),
+        "p95_ms": round(percentile(times, 95), 3),
+        "p99_ms": round(percentile(times, 99), 3),
+        "max_ms": round(max(times), 3),
+        "mean_ms": round(sum(times) / len(times), 3),
+        "images_per_frame": round(sum(images) / len(images), 2),
+        "tile_hit_rate": round(cache.hits / max(1, cache.hits + cache.misses), 3),
+    }
+    if track_python:
+        result["python_peak_kb_per_frame"] = round(sum(python_bytes) / len(python_bytes) / 1024, 1)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay pan/zoom traces through the viewport renderer")
+    parser.add_argument("-o", "--output", help="write the JSON report here")
+    parser.add_argument("--baseline", help="JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative slowdown before a trace is flagged (default 0.15)")
+    parser.add_argument("--size", help=f"synthetic image size as WxH (default {DEFAULT_SIZE})")
+    parser.add_argument("--viewport", default=DEFAULT_VIEWPORT, help=f"canvas size (default {DEFAULT_VIEWPORT})")
+    parser.add_argument("--frames", type=int, default=240, help="frames per trace (default 240)")
+    parser.add_argument("--traces", nargs="+", choices=sorted(TRACES), help="traces to run (default: all)")
+    parser.add_argument("--python-allocations", action="store_true",
+                        help="also trace Python heap peaks per frame (slows every frame down; "
+                             "do not compare such runs against a baseline taken without it)")
+    parser.add_argument("--prefetch", action="store_true",
+                        help="warm the tile cache with the viewport prefetcher between frames")
+    parser.add_argument("--quick", action="store_true", help=f"{QUICK_SIZE} image and 60 frames")
+    parser.add_argument("--workdir", help="where the synthetic source is generated and reused")
+    args = parser.parse_args(argv)
+
+    width, height = parse_grid(args.viewport)
+    image_w, image_h = parse_grid(args.size or (QUICK_SIZE if args.quick else DEFAULT_SIZE))
+    frames = 60 if args.quick and args.frames == parser.get_default("frames") else args.frames
+    workdir = args.workdir or os.path.join(tempfile.gettempdir(), "slicer_bench_sources")
+    source = source_file(workdir, image_w, image_h, "RGB")
+
+    if args.python_allocations:
+        tracemalloc.start()
+    cases = []
+    for name in args.traces or list(TRACES):
+        case = replay(source, name, width, height, frames, args.python_allocations, args.prefetch)
+        cases.append(case)
+        print(f"{name:<18} p50 {case['p50_ms']:>7.2f} ms  p95 {case['p95_ms']:>7.2f} ms  "
+              f"p99 {case['p99_ms']:>7.2f} ms  {case['images_per_frame']:>6.1f} images/frame  "
+              f"hit rate {case['tile_hit_rate']:.0%}", file=sys.stderr)
+
+    report = {"benchmark": "render", "environment": environment(),
+              "settings": {"image": [image_w, image_h], "viewport": [width, height], "frames": frames,
+                           "prefetch": args.prefetch},
+              "cases": cases}
+    if args.output:
+        write_report(args.output, report)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, METRICS, args.tolerance)
+        print_regressions(regressions, args.tolerance)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,252 @@
+"""Headless batch slicing.
+
+    python cli.py slice --grid 512x512 --format webp --jobs 16 in/*.tif -o out/
+    python cli.py slice project.lab -o out/
+    python cli.py slice --skip-empty slide.tif -o out/
+    python cli.py slice --dedup hardlink scan.tif -o out/
+    python cli.py slice --container mbtiles "in/*.tif" -o out/
+    python cli.py slice --format npy --grid 256 --stride 128 scan.tif -o out/
+    python cli.py convert project.lab project.labx
+
+Images are sliced with the same tile names and encoder rules as the GUI.
+Re-running into the same folder only writes tiles that are missing or changed.
+A .lab project applies each image's saved grid and exports its selected cells
+(or every cell when nothing is selected). This module never imports tkinter.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import project
+from batch import BatchExport
+from dataset import DATASET_FORMATS, DatasetExport
+from exporter import DEDUP_MODES, DEFAULT_PROFILE, ENCODER_PROFILES, EXPORT_FORMATS, ExportJob, format_duration
+from sinks import CONTAINER_FORMATS
+from session import ImageSession
+from tile_stats import MIN_COVERAGE
+
+FORMAT_ALIASES = {"jpeg": ".jpg", "tif": ".tiff"}
+
+
+def parse_grid(text):
+    """Parse "512x256" (or "512" for square cells) into (grid_w, grid_h)"""
+    try:
+        parts = [int(p) for p in text.lower().split("x")]
+    except ValueError:
+        parts = []
+    if len(parts) == 1:
+        parts *= 2
+    if len(parts) != 2 or min(parts) < 1:
+        raise argparse.ArgumentTypeError(f"invalid grid '{text}', expected WxH")
+    return tuple(parts)
+
+
+def parse_format(text):
+    ext = text.lower().lstrip(".")
+    ext = FORMAT_ALIASES.get(ext, "." + ext)
+    if ext not in [e for _, e in EXPORT_FORMATS + DATASET_FORMATS]:
+        names = ", ".join([name.lower() for name, _ in EXPORT_FORMATS] + [e[1:] for _, e in DATASET_FORMATS])
+        raise argparse.ArgumentTypeError(f"unsupported format '{text}' (choose from {names})")
+    return ext
+
+
+def parse_container(text):
+    ext = "." + text.lower().lstrip(".")
+    if ext not in [e for _, e in CONTAINER_FORMATS]:
+        names = ", ".join(name.lower() for name, _ in CONTAINER_FORMATS)
+        raise argparse.ArgumentTypeError(f"unsupported container '{text}' (choose from {names})")
+    return ext
+
+
+def expand_inputs(inputs):
+    """Expand glob patterns ourselves, since not every shell does it"""
+    paths = []
+    for item in inputs:
+        matches = sorted(glob.glob(item)) if glob.has_magic(item) else [item]
+        if not matches:
+            print(f"warning: no files match {item}", file=sys.stderr)
+        paths.extend(matches)
+    return paths
+
+
+def skip_empty(session, cells, min_coverage):
+    """Drop cells whose tile statistics say they hold only background"""
+    non_empty = session.get_tile_stats().non_empty_cells(min_coverage)
+    if cells is None:
+        return non_empty
+    keep = set(non_empty)
+    return [cell for cell in cells if cell in keep]
+
+
+def prepare_job(args, job):
+    """Per-image work that reads the whole source; BatchExport runs it within the image's memory slot"""
+    if args.raw_store:
+        job.session.open_raw_store(build=True)
+    if args.skip_empty:
+        job.keep_cells(skip_empty(job.session, job.cells, args.min_coverage))
+
+
+def check_slice_args(parser, args):
+    """Reject options that the chosen output format would silently ignore"""
+    if args.format in dict(DATASET_FORMATS).values():
+        given = [flag for flag, value in (("--dedup", args.dedup), ("--container", args.container),
+                                          ("--profile", args.profile), ("--bands", args.bands)) if value is not None]
+        if given:
+            parser.error(f"{', '.join(given)} cannot be used with --format npy")
+    elif args.stride is not None:
+        parser.error("--stride only applies to --format npy")
+
+
+def make_job(args, session, cells, pool):
+    if args.format in dict(DATASET_FORMATS).values():
+        return DatasetExport(session, args.output, cells=cells, stride=args.stride, pool=pool)
+    return ExportJob(session, args.output, args.format, cells=cells, bands_in_flight=args.bands or 2, pool=pool,
+                     dedup=args.dedup, incremental=not args.force, container=args.container,
+                     profile=args.profile or DEFAULT_PROFILE)
+
+
+def collect_jobs(args, pool):
+    jobs = []
+    for path in expand_inputs(args.inputs):
+        if path.lower().endswith((".lab", ".labx")):
+            data = project.read_project(path)
+            for img_data in project.image_entries(data):
+                image_path = project.resolve_image_path(img_data, path)
+                if not image_path:
+                    print(f"warning: image not found: {img_data.get('path', img_data.get('caminho'))}", file=sys.stderr)
+                    continue
+                session = ImageSession(image_path)
+                project.apply_session_data(session, img_data)
+                cells = session.selected_cells or None
+                if args.grid:
+                    # Saved selections refer to the saved grid, so an override exports everything
+                    session.grid_w, session.grid_h = args.grid
+                    cells = None
+                if args.all:
+                    cells = None
+                jobs.append(make_job(args, session, cells, pool))
+        elif os.path.isfile(path):
+            session = ImageSession(path)
+            session.grid_w, session.grid_h = args.grid or (1000, 1000)
+            jobs.append(make_job(args, session, None, pool))
+        else:
+            print(f"warning: not a file: {path}", file=sys.stderr)
+    return jobs
+
+
+def report_job(job, stats=False):
+    status = f"error: {job.error}" if job.error else f"{job.saved}/{job.total} tiles"
+    if job.duplicates:
+        status += f" ({job.duplicates} duplicates)"
+    if job.up_to_date:
+        status += f", {job.up_to_date} up to date"
+    print(f"{job.session.name}: {status} in {format_duration(job.elapsed())}", file=sys.stderr)
+    if stats and job.stage_text():
+        print(f"  {job.stage_text()}", file=sys.stderr)
+
+
+def cmd_slice(args):
+    os.makedirs(args.output, exist_ok=True)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        jobs = collect_jobs(args, pool)
+        if not jobs:
+            print("error: nothing to slice", file=sys.stderr)
+            return 1
+
+        # Images run side by side within the memory budget; all tiles share the encoder pool
+        batch = BatchExport(jobs, args.memory_mb * 1024 * 1024, max_images=args.images, pool=pool,
+                            on_job_done=None if args.quiet else lambda job: report_job(job, args.stats),
+                            prepare=lambda job: prepare_job(args, job))
+        batch.start()
+        try:
+            batch.wait()
+        except KeyboardInterrupt:
+            batch.cancel()
+            print("cancelled", file=sys.stderr)
+            return 130
+
+    failed = [job for job in jobs if job.error or job.errors]
+    for job in failed:
+        for error in ([job.error] if job.error else job.errors):
+            print(f"error: {job.session.name}: {error}", file=sys.stderr)
+    if not args.quiet:
+        total = sum(job.saved for job in jobs)
+        print(f"{total} tiles from {len(jobs)} images in {format_duration(time.monotonic() - started)}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def cmd_convert(args):
+    """Convert between JSON .lab and binary .labx projects"""
+    try:
+        project.convert_project(args.source, args.target)
+    except (OSError, ValueError) as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Slicer Lab Pro batch tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    slice_cmd = commands.add_parser("slice", help="slice images or .lab projects into grid tiles")
+    slice_cmd.add_argument("inputs", nargs="+", help="image files, glob patterns or .lab projects")
+    slice_cmd.add_argument("-o", "--output", required=True, help="output folder")
+    slice_cmd.add_argument("--grid", type=parse_grid,
+                           help="cell size as WxH (default 1000x1000; overrides the grid saved in .lab files)")
+    slice_cmd.add_argument("--format", type=parse_format, default=".png",
+                           help="png, jpeg, tiff, bmp, webp, or npy for one array per image (default png)")
+    slice_cmd.add_argument("--stride", type=parse_grid,
+                           help="with --format npy: window step as WxH; smaller than the grid overlaps (default: grid)")
+    slice_cmd.add_argument("--profile", choices=list(ENCODER_PROFILES),
+                           help=f"encoder settings: fast, balanced or small output (default {DEFAULT_PROFILE})")
+    slice_cmd.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                           help="encoder threads shared by all images (default: CPU count)")
+    slice_cmd.add_argument("--images", type=int, default=4,
+                           help="most images exported concurrently (default 4)")
+    slice_cmd.add_argument("--memory-mb", type=int, default=4096,
+                           help="memory budget for decoded sources; bigger images wait for room (default 4096)")
+    slice_cmd.add_argument("--bands", type=int,
+                           help="grid-row bands kept in memory per image (default 2)")
+    slice_cmd.add_argument("--all", action="store_true",
+                           help="export every cell of .lab images, ignoring saved selections")
+    slice_cmd.add_argument("--skip-empty", action="store_true",
+                           help="skip tiles that contain only background")
+    slice_cmd.add_argument("--min-coverage", type=float, default=MIN_COVERAGE,
+                           help=f"non-background fraction below which a tile is empty (default {MIN_COVERAGE})")
+    slice_cmd.add_argument("--dedup", choices=DEDUP_MODES,
+                           help="encode identical tiles once: hardlink the copies, or only list them "
+                                "in <image>_manifest.json")
+    slice_cmd.add_argument("--container", type=parse_container,
+                           help="write each image's tiles into one <image>.zip, .tar or .mbtiles file")
+    slice_cmd.add_argument("--force", action="store_true",
+                           help="re-export every tile, even those an earlier export left up to date")
+    slice_cmd.add_argument("--raw-store", action="store_true",
+                           help="convert each source once into a memory-mapped raw store in the cache folder "
+                                "and crop from it; later runs and other processes reuse it")
+    slice_cmd.add_argument("--stats", action="store_true",
+                           help="print read/encode/write throughput per image")
+    slice_cmd.add_argument("-q", "--quiet", action="store_true", help="only report errors")
+    slice_cmd.set_defaults(func=cmd_slice)
+
+    convert_cmd = commands.add_parser("convert", help="convert a project between JSON (.lab) and binary (.labx)")
+    convert_cmd.add_argument("source", help="project to read (.lab or .labx)")
+    convert_cmd.add_argument("target", help="project to write; the format follows the extension")
+    convert_cmd.set_defaults(func=cmd_convert)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "slice":
+        check_slice_args(parser, args)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
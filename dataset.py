@@ -0,0 +1,254 @@
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+
+from export_manifest import source_identity
+from exporter import format_duration, grid_size
+from project import atomic_write
+
+# Array exports offered next to EXPORT_FORMATS
+DATASET_FORMATS = [("NumPy", ".npy")]
+
+_ENDIAN = "<" if sys.byteorder == "little" else ">"
+# Pillow mode -> (mode the pixels are stored as, numpy dtype descr)
+_ARRAY_MODES = {
+    "I;16": ("I;16", "<u2"),
+    "I;16L": ("I;16", "<u2"),
+    "I;16B": ("I;16B", ">u2"),
+    "I": ("I", _ENDIAN + "i4"),
+    "F": ("F", _ENDIAN + "f4"),
+    "1": ("L", "|u1"),
+    "P": ("RGBA", "|u1"),
+    "PA": ("RGBA", "|u1"),
+}
+
+
+def array_layout(mode):
+    """(stored mode, dtype descr, channels, bytes per pixel) for tiles of a Pillow mode"""
+    stored, descr = _ARRAY_MODES.get(mode, (mode, "|u1"))
+    if stored in ("I;16", "I;16B", "I", "F"):
+        channels = 1
+    else:
+        channels = len(stored)  # one character per band: L, LA, RGB, RGBA, CMYK, ...
+        if stored in ("YCbCr", "LAB", "HSV"):
+            channels = 3
+    itemsize = int(descr[-1])
+    return stored, descr, channels, channels * itemsize
+
+
+def npy_header(descr, shape):
+    """A version 1.0 .npy header for a C-ordered array; the data follows it directly"""
+    text = repr({"descr": descr, "fortran_order": False, "shape": tuple(shape)})
+    # Magic (6) + version (2) + length (2) + text + newline, padded to a multiple of 64
+    pad = 64 - (10 + len(text) + 1) % 64
+    text = text + " " * (pad % 64) + "\n"
+    return b"\x93NUMPY\x01\x00" + struct.pack("<H", len(text)) + text.encode("latin1")
+
+
+def window_count(length, size, step):
+    """Windows of `size` every `step` pixels needed to cover `length` pixels (or that start inside it, for gaps)"""
+    if length <= size:
+        return 1
+    return min(math.ceil((length - size) / step) + 1, math.ceil(length / step))
+
+
+class DatasetExport:
+    """Writes grid tiles into one preallocated .npy array for training pipelines.
+
+    The array has shape (N, grid_h, grid_w, C) and is memory-mapped while it
+    is filled; <image>_index.npy holds the (row, col) of each of the N slots
+    and <image>_dataset.json describes the export. Windows start every
+    `stride` pixels (the grid size by default; smaller strides overlap) and
+    edge windows are zero-padded. Bands are decoded once; a window that spans
+    the whole band is copied into the map as is, any other is gathered and
+    padded by one crop, so no Python loop runs per pixel row. The result loads with numpy.load(path, mmap_mode="r").
+
+    Selected cells are only honoured when the stride equals the grid;
+    overlapping windows always cover the whole image. The job has the polling
+    interface of ExportJob (done, total, finished, status_text(), ...).
+    """
+
+    bands_in_flight = 1
+    dedup = None
+    duplicates = 0
+    up_to_date = 0
+    export_format = ".npy"
+
+    def __init__(self, session, out_dir, cells=None, stride=None, pool=None):
+        self.session = session
+        self.out_dir = out_dir
+        self.pool = pool  # unused; jobs share BatchExport's interface
+        self.grid_w = session.grid_w
+        self.grid_h = session.grid_h
+        self.stride = tuple(stride) if stride else (self.grid_w, self.grid_h)
+        sx, sy = self.stride
+        if sx < 1 or sy < 1:
+            raise ValueError("stride must be positive")
+
+        width, height = session.real_width, session.real_height
+        if self.stride == (self.grid_w, self.grid_h) and cells is not None:
+            cols, rows = grid_size(width, height, self.grid_w, self.grid_h)
+            cells = sorted(((c, r) for c, r in cells if c < cols and r < rows), key=lambda cell: (cell[1], cell[0]))
+        else:
+            cols, rows = window_count(width, self.grid_w, sx), window_count(height, self.grid_h, sy)
+            cells = [(c, r) for r in range(rows) for c in range(cols)]
+        self.cells = cells
+        self.total = len(cells)
+
+        stem = os.path.splitext(session.name)[0]
+        self.path = os.path.join(out_dir, stem + ".npy")
+        self.index_path = os.path.join(out_dir, stem + "_index.npy")
+        self.meta_path = os.path.join(out_dir, stem + "_dataset.json")
+
+        self.done = 0
+        self.errors = []
+        self.error = None
+        self.bytes_copied = 0
+        self.started_at = None
+        self.finished_at = None
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    @property
+    def saved(self):
+        return self.done
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self):
+        if self._thread:
+            self._thread.join()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def status_text(self):
+        pct = int(self.done * 100 / self.total) if self.total else 100
+        text = f"Writing array: {self.done}/{self.total} tiles ({pct}%)"
+        elapsed = self.elapsed()
+        if self.done and elapsed > 0:
+            text += f" | {self.bytes_copied / elapsed / 1e6:.0f} MB/s"
+            text += f" | ETA {format_duration(elapsed / self.done * (self.total - self.done))}"
+        return text
+
+    def stage_text(self):
+        elapsed = self.elapsed()
+        return f"copy {self.bytes_copied / elapsed / 1e6:.1f} MB/s" if elapsed > 0 else ""
+
+    def keep_cells(self, cells):
+        """Narrow the windows to the grid cells in `cells`; overlapping windows always cover the whole image"""
+        if self.stride == (self.grid_w, self.grid_h):
+            keep = set(cells)
+            self.cells = [cell for cell in self.cells if cell in keep]
+            self.total = len(self.cells)
+
+    def run(self):
+        self.started_at = time.monotonic()
+        part = self.path + ".part"
+        try:
+            stored, descr, channels, pixel = array_layout(self.session.image_mode)
+            shape = (self.total, self.grid_h, self.grid_w, channels)
+            header = npy_header(descr, shape)
+            with open(part, "w+b") as f:
+                # Preallocate: the unwritten (padding) bytes read back as zeros
+                f.truncate(len(header) + self.total * self.grid_h * self.grid_w * pixel)
+                f.write(header)
+                if self.total:
+                    with mmap.mmap(f.fileno(), 0) as array:
+                        with self.session.region_reader() as reader:
+                            self._fill(array, len(header), reader, stored, pixel)
+                        array.flush()
+            if self._cancel.is_set():
+                os.remove(part)
+                return
+            os.replace(part, self.path)
+            self._write_index()
+        except Exception as e:
+            self.error = str(e)
+            try:
+                os.remove(part)
+            except OSError:
+                pass
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _fill(self, array, offset, reader, stored, pixel):
+        width, height = self.session.real_width, self.session.real_height
+        gw, gh = self.grid_w, self.grid_h
+        sx, sy = self.stride
+        tile_bytes = gw * gh * pixel
+        slot = 0
+        for row, cols in self._bands():
+            if self._cancel.is_set():
+                return
+            top = row * sy
+            bottom = min(top + gh, height)
+            left = cols[0] * sx
+            right = min(cols[-1] * sx + gw, width)
+            band = reader.read((left, top, right, bottom))
+            if band.mode != stored:
+                band = band.convert(stored)
+            rows = bottom - top
+            for c in cols:
+                x = c * sx
+                run = (min(x + gw, width) - x) * pixel
+                dst = offset + slot * tile_bytes
+                if band.width == gw and x == left:
+                    # The window is the whole band, already laid out as in the slot
+                    window = band.tobytes()
+                else:
+                    # crop() gathers the window's rows in C and zero-pads them past the right edge
+                    window = band.crop((x - left, 0, x - left + gw, rows)).tobytes()
+                array[dst:dst + len(window)] = window
+                slot += 1
+                self.bytes_copied += run * rows
+                self.done += 1
+
+    def _bands(self):
+        """Group the windows by window row: yields (row, [cols])"""
+        row, cols = None, []
+        for c, r in self.cells:
+            if r != row and cols:
+                yield row, cols
+                cols = []
+            row = r
+            cols.append(c)
+        if cols:
+            yield row, cols
+
+    def _write_index(self):
+        data = b"".join(struct.pack("<ii", r, c) for c, r in self.cells)
+        atomic_write(self.index_path, npy_header("<i4", (self.total, 2)) + data)
+        stored, descr, channels, _ = array_layout(self.session.image_mode)
+        atomic_write(self.meta_path, json.dumps({
+            "image": self.session.name,
+            "source": source_identity(self.session.path),
+            "array": os.path.basename(self.path),
+            "index": os.path.basename(self.index_path),
+            "mode": stored,
+            "dtype": descr,
+            "shape": [self.total, self.grid_h, self.grid_w, channels],
+            "grid": [self.grid_w, self.grid_h],
+            "stride": list(self.stride),
+            "padding": 0,
+        }, indent=4))
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import threading
+import uuid
+
+from project import JOURNAL_SUFFIX, atomic_write
+
+MANIFEST_VERSION = 2
+MANIFEST_SUFFIX = "_manifest.json"
+
+
+def manifest_path(out_dir, base_name):
+    """<out_dir>/<image stem>_manifest.json, next to the tiles it describes"""
+    return os.path.join(out_dir, os.path.splitext(base_name)[0] + MANIFEST_SUFFIX)
+
+
+def tile_digest(tile):
+    """Hash of a tile's pixels; equal digests mean the encoded files would be identical"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{tile.mode} {tile.width}x{tile.height}\n".encode("ascii"))
+    h.update(tile.tobytes())
+    return h.hexdigest()
+
+
+def source_identity(path):
+    """[absolute path, size, mtime_ns] of a source image, or None if it cannot be read"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [os.path.abspath(path), st.st_size, st.st_mtime_ns]
+
+
+class ExportManifest:
+    """What an export wrote into a folder for one image.
+
+    `tiles` maps each written filename to the digest of its pixels and the size
+    and mtime of the file, so a later export into the same folder can tell
+    which files are still intact. `duplicates` maps the filename of every tile
+    that was not written because its pixels equal an earlier tile to that
+    tile's filename.
+
+    While an export runs, records are appended to <manifest>.journal as tiles
+    complete; the journal is folded back in on load, so a killed export can be
+    resumed. It is only applied when its run_id matches the manifest's.
+    """
+
+    def __init__(self, image, export_format, grid, source=None, container=None, profile=None):
+        self.image = image
+        self.export_format = export_format
+        self.grid = tuple(grid)
+        self.source = source
+        self.container = container
+        self.profile = profile
+        self.run_id = None
+        self.tiles = {}
+        self.duplicates = {}
+        self._journal = None
+        self._lock = threading.Lock()
+
+    def same_layout(self, other):
+        """True when tile filenames mean the same cells encoded the same way"""
+        return (other.export_format == self.export_format and other.grid == self.grid
+                and other.container == self.container and other.profile == self.profile)
+
+    def intact(self, out_dir, filename):
+        """True if the file recorded for `filename` (or its original, for duplicates) is unchanged on disk"""
+        filename = self.duplicates.get(filename, filename)
+        return filename in self.tiles and self._intact_record(out_dir, filename)
+
+    def drop_stale(self, out_dir):
+        """Forget files that are no longer as recorded, and the duplicates listed against them.
+
+        Returns the dropped filenames; a later export writes them again.
+        """
+        with self._lock:
+            stale = [name for name in self.tiles if not self._intact_record(out_dir, name)]
+            for name in stale:
+                del self.tiles[name]
+            stale += [name for name, original in self.duplicates.items() if original in stale]
+            for name in stale:
+                self.duplicates.pop(name, None)
+        return sorted(stale)
+
+    def _intact_record(self, out_dir, filename):
+        record = self.tiles[filename]
+        try:
+            st = os.stat(os.path.join(out_dir, filename))
+        except OSError:
+            return False
+        return st.st_size == record["bytes"] and st.st_mtime_ns == record.get("mtime_ns")
+
+    def add_tile(self, filename, digest, path=None, size=None):
+        """Record a tile written to `path`, or of `size` bytes inside a container"""
+        if path is None:
+            self.keep_tile(filename, {"hash": digest, "bytes": size})
+            return
+        st = os.stat(path)
+        self.keep_tile(filename, {"hash": digest, "bytes": st.st_size, "mtime_ns": st.st_mtime_ns})
+
+    def keep_tile(self, filename, record):
+        """Record a file that an earlier export wrote and that is still up to date"""
+        self._add("tiles", filename, record)
+
+    def add_duplicate(self, filename, original):
+        self._add("duplicates", filename, original)
+
+    def _add(self, kind, filename, value):
+        with self._lock:
+            # A tile is either a file or a listed duplicate, whichever the latest export made it
+            (self.duplicates if kind == "tiles" else self.tiles).pop(filename, None)
+            getattr(self, kind)[filename] = value
+            if self._journal:
+                self._journal.write(json.dumps({kind: {filename: value}}) + "\n")
+                self._journal.flush()
+
+    def to_dict(self):
+        return {
+            "version": MANIFEST_VERSION,
+            "run_id": self.run_id,
+            "image": self.image,
+            "source": self.source,
+            "format": self.export_format,
+            "container": self.container,
+            "profile": self.profile,
+            "grid": list(self.grid),
+            "tiles": dict(sorted(self.tiles.items())),
+            "duplicates": dict(sorted(self.duplicates.items())),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        manifest = cls(data["image"], data["format"], data["grid"], data.get("source"), data.get("container"),
+                       data.get("profile", "balanced"))
+        manifest.run_id = data.get("run_id")
+        manifest.tiles = dict(data.get("tiles", {}))
+        manifest.duplicates = dict(data.get("duplicates", {}))
+        return manifest
+
+    @classmethod
+    def load(cls, path):
+        """The manifest at `path` with its journal applied, or None if there is no readable one"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = cls.from_dict(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        manifest._apply_journal(path + JOURNAL_SUFFIX)
+        return manifest
+
+    def _apply_journal(self, path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                lines = f.read().split("\n")
+        except OSError:
+            return
+        try:
+            start = json.loads(lines[0])
+        except ValueError:
+            return
+        if not self.run_id or start.get("run_id") != self.run_id:
+            return
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break  # an export killed mid-append; everything before it is complete
+            for filename, value in record.get("tiles", {}).items():
+                self.duplicates.pop(filename, None)
+                self.tiles[filename] = value
+            for filename, value in record.get("duplicates", {}).items():
+                self.tiles.pop(filename, None)
+                self.duplicates[filename] = value
+
+    def begin(self, path):
+        """Save under a new run_id and journal every record added until finish()"""
+        self.run_id = uuid.uuid4().hex
+        self.save(path)
+        self._journal = open(path + JOURNAL_SUFFIX, 'w', encoding='utf-8')
+        self._journal.write(json.dumps({"run_id": self.run_id}) + "\n")
+        self._journal.flush()
+
+    def finish(self, path):
+        """Write the complete manifest and drop the journal"""
+        with self._lock:
+            journal, self._journal = self._journal, None
+        if journal:
+            journal.close()
+        self.save(path)
+        try:
+            os.remove(path + JOURNAL_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def save(self, path):
+        with self._lock:
+            text = json.dumps(self.to_dict(), indent=4)
+        atomic_write(path, text)
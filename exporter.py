@@ -0,0 +1,556 @@
+import io
+import os
+import queue
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from export_manifest import ExportManifest, manifest_path, source_identity, tile_digest
+from sinks import CONTAINER_FORMATS, container_path, open_sink
+
+
+# Supported export formats
+EXPORT_FORMATS = [
+    ("PNG", ".png"),
+    ("JPEG", ".jpg"),
+    ("TIFF", ".tiff"),
+    ("BMP", ".bmp"),
+    ("WebP", ".webp")
+]
+
+# Encoder settings per export format, from fastest to smallest output. "balanced"
+# is the default and matches the settings tiles have always been written with.
+ENCODER_PROFILES = {
+    "fast": {
+        ".png": {"compress_level": 1},
+        ".jpg": {"quality": 95},
+        ".tiff": {"compression": "raw"},
+        ".webp": {"quality": 95, "method": 0},
+    },
+    "balanced": {
+        ".jpg": {"quality": 95},
+        ".webp": {"quality": 95},
+    },
+    "small": {
+        ".png": {"compress_level": 9, "optimize": True},
+        ".jpg": {"quality": 95, "optimize": True},
+        ".tiff": {"compression": "tiff_adobe_deflate"},
+        ".webp": {"quality": 95, "method": 6},
+    },
+}
+DEFAULT_PROFILE = "balanced"
+
+# How ExportJob handles tiles whose pixels equal an earlier tile: link the file
+# already written, or write nothing and list the duplicate in the export manifest
+DEDUP_MODES = ("hardlink", "manifest")
+
+
+def get_export_filename(base_name, row, col, export_format):
+    """Generate export filename with correct extension"""
+    name_without_ext = os.path.splitext(base_name)[0]
+    return f"{name_without_ext}_R{row:03d}_C{col:03d}{export_format}"
+
+
+def save_image_tile(image, path, export_format, profile=DEFAULT_PROFILE):
+    """Save image tile with the options of an encoder profile (`path` may also be a file object)"""
+    pil_format = dict((ext, name) for name, ext in EXPORT_FORMATS)[export_format]
+    if export_format == ".jpg":
+        # Convert to RGB for JPEG (no alpha channel)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGB')
+    image.save(path, pil_format, **ENCODER_PROFILES[profile].get(export_format, {}))
+
+
+def encode_tile(image, export_format, profile=DEFAULT_PROFILE):
+    """Encoded bytes of a tile, as save_image_tile would write them"""
+    buffer = io.BytesIO()
+    save_image_tile(image, buffer, export_format, profile)
+    return buffer.getvalue()
+
+
+def write_tile_file(path, data):
+    """Write encoded tile bytes as a new file that replaces `path`.
+
+    The old file may be a hardlink shared with duplicate tiles (see
+    link_tile); writing through it would change every copy, so the bytes go
+    to a temporary file that is renamed over the old name instead.
+    """
+    tmp = os.path.join(os.path.dirname(path), ".~" + os.path.basename(path) + ".tmp")
+    try:
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def link_tile(source, target):
+    """Make `target` a hardlink to `source`, copying on filesystems without hardlinks"""
+    try:
+        os.remove(target)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def grid_size(width, height, grid_w, grid_h):
+    """Number of (cols, rows) needed to cover an image with the grid"""
+    return (width + grid_w - 1) // grid_w, (height + grid_h - 1) // grid_h
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class ExportJob:
+    """Crops and encodes grid tiles of a session on a background worker pool.
+
+    Export is a three-stage pipeline: the job thread reads grid-row bands, the
+    pool crops and encodes tiles in memory, and a dedicated writer thread puts
+    the encoded bytes on disk. The stages are connected by bounded queues (the
+    band semaphore and a write queue of WRITE_QUEUE_PER_WORKER x workers
+    tiles), so encoding overlaps disk I/O without buffering the whole image.
+    Pillow releases the GIL while cropping and encoding, so a thread pool keeps
+    every core busy without re-decoding the source in each worker. The job owns
+    no Tk state: the caller polls `done`, `eta()` and `finished` from the UI thread.
+    `stage_text()` reports the throughput of each stage.
+
+    The source is read one grid-row band at a time and at most `bands_in_flight`
+    bands are alive at once, so when the file layout allows partial decoding
+    (see RegionReader) peak memory stays near width x grid_h x bands_in_flight.
+
+    Several jobs can share one executor through `pool` (e.g. to slice many
+    images at once); otherwise the job creates its own with `workers` threads.
+
+    Every export records what it wrote in <image>_manifest.json (see
+    ExportManifest). With `incremental`, a later export of the same image into
+    the same folder skips tiles that are still intact: without reading them if
+    the source file is unchanged, otherwise by comparing pixel hashes. An
+    interrupted export therefore resumes where it stopped.
+
+    With `dedup` (see DEDUP_MODES) a tile identical to one already written is
+    linked or only recorded in the manifest, so large uniform backgrounds are
+    encoded once.
+
+    With `container` (see CONTAINER_FORMATS) all tiles are streamed into one
+    <image>.zip/.tar/.mbtiles instead of one file each, under the same
+    _R###_C### names. Containers are always written whole, not incrementally.
+
+    `profile` picks the encoder settings (see ENCODER_PROFILES).
+    """
+
+    STAGES = ("read", "encode", "write")
+    WRITE_QUEUE_PER_WORKER = 4
+
+    def __init__(self, session, out_dir, export_format, cells=None, workers=None, bands_in_flight=2, pool=None,
+                 dedup=None, incremental=True, container=None, profile=DEFAULT_PROFILE):
+        if profile not in ENCODER_PROFILES:
+            raise ValueError(f"unknown encoder profile '{profile}'")
+        if dedup is not None and dedup not in DEDUP_MODES:
+            raise ValueError(f"unknown dedup mode '{dedup}'")
+        if container is not None and container not in [ext for _, ext in CONTAINER_FORMATS]:
+            raise ValueError(f"unknown container '{container}'")
+        self.session = session
+        self.out_dir = out_dir
+        self.export_format = export_format
+        self.workers = workers or os.cpu_count() or 1
+        self.bands_in_flight = max(1, bands_in_flight)
+        self.pool = pool
+        self.dedup = dedup
+        self.incremental = incremental and container is None
+        self.container = container
+        self.profile = profile
+        self.sink = None
+
+        # Snapshot the grid so edits made during the export do not affect it
+        self.grid_w = session.grid_w
+        self.grid_h = session.grid_h
+        if cells is None:
+            cols, rows = grid_size(session.real_width, session.real_height, self.grid_w, self.grid_h)
+            cells = [(c, r) for r in range(rows) for c in range(cols)]
+        else:
+            cells = sorted(cells, key=lambda cell: (cell[1], cell[0]))
+        self.cells = cells
+        self.total = len(cells)
+
+        self.done = 0  # tiles processed, including failed ones
+        self.errors = []
+        self.error = None  # fatal error that stopped the whole job
+        self.manifest = ExportManifest(session.name, export_format, (self.grid_w, self.grid_h),
+                                       source_identity(session.path), container, profile)
+        self._previous = None  # manifest of an earlier export of a since modified source
+        self._originals = {}  # tile digest -> _Original
+        self._skipped = 0  # tiles found up to date before the run
+        self._unchanged = 0  # tiles found up to date by their pixel hash during the run
+        self._linked = 0  # duplicates stored as links to an identical tile
+        # Busy seconds, items and bytes per pipeline stage (encode time is summed over workers)
+        self.stage_stats = {stage: [0.0, 0, 0] for stage in self.STAGES}
+        self._writes = queue.Queue(maxsize=self.workers * self.WRITE_QUEUE_PER_WORKER)
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = None
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, daemon=True)
+        self._thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self):
+        if self._thread:
+            self._thread.join()
+
+    def elapsed(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.finished_at or time.monotonic()) - self.started_at
+
+    def eta(self):
+        """Estimated seconds left, or None before the first tile completes"""
+        if not self.done:
+            return None
+        return self.elapsed() / self.done * (self.total - self.done)
+
+    @property
+    def saved(self):
+        return self.done - len(self.errors) - self._unchanged
+
+    @property
+    def up_to_date(self):
+        return self._skipped + self._unchanged
+
+    @property
+    def duplicates(self):
+        return self._linked + len(self.manifest.duplicates)
+
+    def status_text(self):
+        pct = int(self.done * 100 / self.total) if self.total else 100
+        text = f"Exporting: {self.done}/{self.total} tiles ({pct}%)"
+        if self.duplicates:
+            text += f" | {self.duplicates} duplicates"
+        if self.up_to_date:
+            text += f" | {self.up_to_date} up to date"
+        elapsed = self.elapsed()
+        if self.done and elapsed > 0:
+            text += f" | {self.done / elapsed:.0f} tiles/s"
+        eta = self.eta()
+        if eta is not None:
+            text += f" | ETA {format_duration(eta)}"
+        return text
+
+    def _add_stage(self, stage, seconds, nbytes):
+        with self._lock:
+            stats = self.stage_stats[stage]
+            stats[0] += seconds
+            stats[1] += 1
+            stats[2] += nbytes
+
+    def stage_text(self):
+        """Throughput of each pipeline stage while it was busy, e.g. for a log line"""
+        parts = []
+        for stage in self.STAGES:
+            seconds, items, nbytes = self.stage_stats[stage]
+            if not items or seconds <= 0:
+                continue
+            per = " per worker" if stage == "encode" else ""
+            parts.append(f"{stage} {items / seconds:.0f} {'bands' if stage == 'read' else 'tiles'}/s, "
+                         f"{nbytes / seconds / 1e6:.1f} MB/s{per}")
+        return " | ".join(parts)
+
+    def keep_cells(self, cells):
+        """Narrow the cells to export to those in `cells` (before the job runs)"""
+        keep = set(cells)
+        self.cells = [cell for cell in self.cells if cell in keep]
+        self.total = len(self.cells)
+
+    def _bands(self):
+        """Group the cells by grid row: yields (row, [cols])"""
+        row, cols = None, []
+        for c, r in self.cells:
+            if r != row and cols:
+                yield row, cols
+                cols = []
+            row = r
+            cols.append(c)
+        if cols:
+            yield row, cols
+
+    def run(self):
+        self.started_at = time.monotonic()
+        path = manifest_path(self.out_dir, self.session.name)
+        try:
+            if self.incremental:
+                self._skip_up_to_date(ExportManifest.load(path))
+            previous = ExportManifest.load(path) if self.container else None
+            self.manifest.begin(path)
+            completed = False
+            try:
+                if self.container:
+                    self.sink = open_sink(container_path(self.out_dir, self.session.name, self.container),
+                                          self.container, self._container_metadata())
+                if self.cells:
+                    writer = threading.Thread(target=self._write_loop, daemon=True)
+                    writer.start()
+                    try:
+                        with self.session.region_reader() as reader:
+                            self._run_bands(reader)
+                    finally:
+                        self._writes.put(None)
+                        writer.join()
+                if self.sink is None:
+                    # Only record what is really on disk, so the next run rewrites anything that is not
+                    for filename in self.manifest.drop_stale(self.out_dir):
+                        self.errors.append(f"{filename}: changed on disk during the export")
+                completed = not self._cancel.is_set()
+            finally:
+                self.manifest.finish(path)
+                if self.container and not completed:
+                    # A cancelled or failed export leaves the previous container, and its manifest, as they were
+                    if self.sink:
+                        self.sink.discard()
+                    if previous is not None:
+                        previous.save(path)
+                    else:
+                        os.remove(path)
+                elif self.sink:
+                    self.sink.close()
+        except Exception as e:
+            self.error = str(e)
+        finally:
+            self.finished_at = time.monotonic()
+
+    def _container_metadata(self):
+        cols, rows = grid_size(self.session.real_width, self.session.real_height, self.grid_w, self.grid_h)
+        return {
+            "name": os.path.splitext(self.session.name)[0],
+            "format": self.export_format.lstrip("."),
+            "type": "overlay",
+            "version": "1",
+            "description": f"{self.session.name} sliced into {self.grid_w}x{self.grid_h} cells",
+            "image_width": self.session.real_width,
+            "image_height": self.session.real_height,
+            "grid_width": self.grid_w,
+            "grid_height": self.grid_h,
+            "columns": cols,
+            "rows": rows,
+        }
+
+    def _skip_up_to_date(self, previous):
+        """Drop the cells whose files an earlier export left intact"""
+        if previous is None or not previous.same_layout(self.manifest):
+            return
+        if previous.source is None or previous.source != self.manifest.source:
+            # Tiles may have changed; _export_cell compares their pixel hashes
+            self._previous = previous
+            return
+
+        manifest = self.manifest
+        for filename, record in previous.tiles.items():
+            if previous.intact(self.out_dir, filename):
+                manifest.tiles[filename] = record
+                self._originals.setdefault(record["hash"], _Original(filename, written=True))
+        if self.dedup == "manifest":
+            # Listed duplicates only count while their original is intact
+            manifest.duplicates = {name: original for name, original in previous.duplicates.items()
+                                   if original in manifest.tiles}
+
+        remaining = []
+        for c, r in self.cells:
+            filename = get_export_filename(self.session.name, r, c, self.export_format)
+            if filename not in manifest.tiles and filename not in manifest.duplicates:
+                remaining.append((c, r))
+        self._skipped = len(self.cells) - len(remaining)
+        self.cells = remaining
+        self.total = len(remaining)
+
+    def _run_bands(self, reader):
+        if self.pool is not None:
+            self._submit_bands(reader, self.pool)
+            return
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            self._submit_bands(reader, pool)
+
+    def _submit_bands(self, reader, pool):
+        free_bands = threading.Semaphore(self.bands_in_flight)
+        try:
+            for row, cols in self._bands():
+                if self._cancel.is_set():
+                    break
+                free_bands.acquire()
+                left = cols[0] * self.grid_w
+                top = row * self.grid_h
+                right = min((cols[-1] + 1) * self.grid_w, self.session.real_width)
+                bottom = min(top + self.grid_h, self.session.real_height)
+                started = time.perf_counter()
+                try:
+                    band = reader.read((left, top, right, bottom))
+                except Exception:
+                    free_bands.release()
+                    raise
+                self._add_stage("read", time.perf_counter() - started,
+                                (right - left) * (bottom - top) * len(band.getbands()))
+
+                # The band is released once the last of its tiles is encoded
+                pending = [len(cols)]
+                def tile_done(future, pending=pending):
+                    with self._lock:
+                        pending[0] -= 1
+                        last = pending[0] == 0
+                    if last:
+                        free_bands.release()
+
+                for c in cols:
+                    future = pool.submit(self._export_cell, band, left, top, (c, row))
+                    future.add_done_callback(tile_done)
+                del band
+        finally:
+            # Wait until every band has been encoded, so nothing is queued after the writer stops
+            for _ in range(self.bands_in_flight):
+                free_bands.acquire()
+
+    def _export_cell(self, band, left, top, cell):
+        if self._cancel.is_set():
+            return
+        c, r = cell
+        x1 = c * self.grid_w
+        y1 = r * self.grid_h
+        x2 = min(x1 + self.grid_w, self.session.real_width)
+        y2 = min(y1 + self.grid_h, self.session.real_height)
+
+        filename = get_export_filename(self.session.name, r, c, self.export_format)
+        try:
+            tile = band.crop((x1 - left, y1 - top, x2 - left, y2 - top))
+            digest = tile_digest(tile)
+            if self._is_unchanged(filename, digest):
+                with self._lock:
+                    self._unchanged += 1
+            elif self.dedup:
+                self._export_deduplicated(tile, digest, filename, cell)
+            else:
+                self._write_tile(tile, digest, filename, cell)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"{filename}: {e}")
+        with self._lock:
+            self.done += 1
+
+    def _is_unchanged(self, filename, digest):
+        """True if an earlier export wrote these exact pixels to a file that is still intact"""
+        previous = self._previous
+        if previous is None:
+            return False
+        record = previous.tiles.get(filename)
+        if record is None or record["hash"] != digest or not previous.intact(self.out_dir, filename):
+            return False
+        self.manifest.keep_tile(filename, record)
+        with self._lock:
+            self._originals.setdefault(digest, _Original(filename, written=True))
+        return True
+
+    def _write_tile(self, tile, digest, filename, cell):
+        """Encode a tile and queue it for the writer"""
+        started = time.perf_counter()
+        data = encode_tile(tile, self.export_format, self.profile)
+        self._add_stage("encode", time.perf_counter() - started, len(data))
+        self._writes.put((self._store, filename, cell, digest, data))
+
+    def _write_loop(self):
+        """Writer thread: performs queued writes and links in the order they were queued"""
+        while True:
+            item = self._writes.get()
+            if item is None:
+                return
+            store, filename, *args = item
+            started = time.perf_counter()
+            try:
+                nbytes = store(filename, *args)
+            except Exception as e:
+                with self._lock:
+                    self.errors.append(f"{filename}: {e}")
+                continue
+            self._add_stage("write", time.perf_counter() - started, nbytes)
+
+    def _store(self, filename, cell, digest, data):
+        if self.sink is None:
+            full_path = os.path.join(self.out_dir, filename)
+            write_tile_file(full_path, data)
+            self.manifest.add_tile(filename, digest, full_path)
+        else:
+            self.sink.add(filename, cell, data)
+            self.manifest.add_tile(filename, digest, size=len(data))
+        return len(data)
+
+    def _store_link(self, filename, cell, digest, original):
+        """Store a duplicate as a link to its original, or list it where the target has no links"""
+        if self.sink is None:
+            full_path = os.path.join(self.out_dir, filename)
+            link_tile(os.path.join(self.out_dir, original), full_path)
+            self.manifest.add_tile(filename, digest, full_path)
+        elif self.sink.link(filename, cell, original):
+            self.manifest.add_tile(filename, digest, size=0)
+        else:
+            # The container cannot reference another member
+            self.manifest.add_duplicate(filename, original)
+            return 0
+        with self._lock:
+            self._linked += 1
+        return 0
+
+    def _export_deduplicated(self, tile, digest, filename, cell):
+        with self._lock:
+            original = self._originals.get(digest)
+            if original is None:
+                original = self._originals[digest] = _Original(filename)
+        if original.filename == filename:
+            try:
+                self._write_tile(tile, digest, filename, cell)
+                original.ok = True
+            finally:
+                original.queued.set()
+            return
+
+        # The first tile with these pixels is being encoded by a running worker. Once it
+        # is queued, a link queued after it is written after it.
+        original.queued.wait()
+        if not original.ok:
+            self._write_tile(tile, digest, filename, cell)
+        elif self.dedup == "hardlink":
+            self._writes.put((self._store_link, filename, cell, digest, original.filename))
+        else:
+            self.manifest.add_duplicate(filename, original.filename)
+
+
+class _Original:
+    """The first tile seen with a given digest, and whether it was encoded and queued for writing"""
+    __slots__ = ("filename", "queued", "ok")
+
+    def __init__(self, filename, written=False):
+        self.filename = filename
+        self.queued = threading.Event()
+        self.ok = written
+        if written:
+            self.queued.set()
@@ -0,0 +1,166 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+
+def default_trace_path():
+    return os.environ.get("SLICER_TRACE_FILE") or os.path.join(tempfile.gettempdir(), "slicer_lab_trace.json")
+
+
+class _Stage:
+    __slots__ = ("profiler", "name", "args", "started")
+
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, self.started, time.perf_counter(), self.args)
+        return False
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Profiler:
+    """Per-frame stage timings, counters and a rolling Chrome trace.
+
+    Code under measurement wraps its stages in `with profiler.stage("name"):`.
+    When the profiler is disabled that is a shared no-op context, so the hooks
+    can stay in the hot path. Frames are delimited by begin_frame()/end_frame();
+    the last TRACE_EVENTS events are kept in memory and written (off the
+    calling thread) as Chrome trace JSON, which chrome://tracing and Perfetto open.
+    """
+
+    TRACE_EVENTS = 50000
+    # Seconds between automatic trace flushes while enabled
+    FLUSH_INTERVAL = 5.0
+    # Frames averaged for the readout
+    WINDOW = 60
+
+    def __init__(self, enabled=False, trace_path=None):
+        self.enabled = enabled
+        self.trace_path = trace_path or default_trace_path()
+        self.errors = 0
+        self.last_error = None
+        self._origin = time.perf_counter()
+        self._events = deque(maxlen=self.TRACE_EVENTS)
+        self._frame_stages = {}
+        self._frame_started = None
+        self._frames = deque(maxlen=self.WINDOW)  # (end time, duration, stages, counters)
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def set_enabled(self, enabled):
+        if self.enabled and not enabled:
+            self.flush()
+        self.enabled = enabled
+
+    def stage(self, name, **args):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name, args)
+
+    def _record(self, name, started, ended, args):
+        duration = ended - started
+        self._frame_stages[name] = self._frame_stages.get(name, 0.0) + duration
+        event = {"name": name, "ph": "X", "ts": self._us(started), "dur": round(duration * 1e6, 1),
+                 "pid": os.getpid(), "tid": threading.get_ident()}
+        if args:
+            event["args"] = args
+        self._events.append(event)
+
+    def _us(self, t):
+        return round((t - self._origin) * 1e6, 1)
+
+    def begin_frame(self):
+        if self.enabled:
+            self._frame_stages = {}
+            self._frame_started = time.perf_counter()
+
+    def end_frame(self, **counters):
+        """Close the current frame; counters (e.g. canvas items) go to the trace and readout"""
+        if not self.enabled or self._frame_started is None:
+            return
+        ended = time.perf_counter()
+        self._record("frame", self._frame_started, ended, {})
+        self._frame_stages.pop("frame")
+        if counters:
+            self._events.append({"name": "counters", "ph": "C", "ts": self._us(ended),
+                                 "pid": os.getpid(), "args": counters})
+        self._frames.append((ended, ended - self._frame_started, self._frame_stages, counters))
+        self._frame_started = None
+        if time.monotonic() - self._last_flush > self.FLUSH_INTERVAL:
+            self.flush(background=True)
+
+    def error(self, exc):
+        """Count a failure in the measured code and mark it in the trace"""
+        self.errors += 1
+        self.last_error = f"{type(exc).__name__}: {exc}"
+        if self.enabled:
+            self._events.append({"name": "error", "ph": "i", "s": "g", "ts": self._us(time.perf_counter()),
+                                 "pid": os.getpid(), "tid": threading.get_ident(),
+                                 "args": {"message": self.last_error}})
+
+    def fps(self):
+        """Frames rendered during the last second"""
+        if not self._frames:
+            return 0.0
+        now = time.perf_counter()
+        return float(sum(1 for end, _, _, _ in self._frames if now - end <= 1.0))
+
+    def summary(self):
+        """One-line readout averaged over the last WINDOW frames"""
+        frames = list(self._frames)
+        if not frames:
+            return "Profiling: no frames yet"
+        n = len(frames)
+        frame_ms = sum(duration for _, duration, _, _ in frames) / n * 1000
+        totals = {}
+        for _, _, stages, _ in frames:
+            for name, seconds in stages.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+        top = sorted(totals.items(), key=lambda item: -item[1])[:4]
+        parts = [f"{frame_ms:.1f} ms/frame", f"{self.fps():.0f} fps"]
+        parts += [f"{name} {seconds / n * 1000:.1f} ms" for name, seconds in top]
+        parts += [f"{key} {value}" for key, value in frames[-1][3].items()]
+        if self.errors:
+            parts.append(f"{self.errors} errors")
+        return " | ".join(parts)
+
+    def flush(self, background=False):
+        """Write the rolling trace to trace_path"""
+        self._last_flush = time.monotonic()
+        events = list(self._events)
+        if background:
+            threading.Thread(target=self._write, args=(events,), daemon=True).start()
+        else:
+            self._write(events)
+
+    def _write(self, events):
+        with self._lock:
+            tmp = self.trace_path + ".tmp"
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+                os.replace(tmp, self.trace_path)
+            except OSError:
+                pass
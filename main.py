@@ -2,9 +2,25 @@ import tkinter as tk
 from tkinter import filedialog, messagebox, colorchooser, ttk
 from PIL import Image, ImageTk, ImageDraw
 import os
-import json
 import platform
 import subprocess
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from exporter import DEFAULT_PROFILE, ENCODER_PROFILES, EXPORT_FORMATS, ExportJob, format_duration, grid_size
+import project
+from autosave import ProjectAutosaver
+from batch import BatchExport
+from dataset import DATASET_FORMATS, DatasetExport
+from sinks import CONTAINER_FORMATS
+from instrumentation import Profiler
+from prefetch import ViewportPrefetcher
+from preview_cache import PreviewCache
+from render import TileCache, ViewportRenderer, choose_level, viewport_origin
+from session import ImageSession
+from sources import is_loaded
+from tile_stats import MIN_COVERAGE
 
 Image.MAX_IMAGE_PIXELS = None 
 
@@ -21,54 +37,42 @@ def detect_dark_mode_mac():
     except:
         return False 
 
-# --- DATA MODEL (SESSION) ---
-class ImageSession:
-    def __init__(self, path):
-        self.path = path
-        self.name = os.path.basename(path)
-        
-        self.original_image = Image.open(path)
-        self.real_width, self.real_height = self.original_image.size
-        
-        self.preview_image = None
-        self.preview_scale = 1.0
-        self._generate_cache()
-        
-        self.zoom_level = 1.0
-        self.camera_x = 0
-        self.camera_y = 0
-        
-        self.grid_w = 1000
-        self.grid_h = 1000
-        self.grid_color = "#FFFF00"
-        self.selected_cells = set()
-
-    def _generate_cache(self):
-        try:
-            max_size = 2048
-            if self.real_width > max_size or self.real_height > max_size:
-                ratio = min(max_size / self.real_width, max_size / self.real_height)
-                new_w = int(self.real_width * ratio)
-                new_h = int(self.real_height * ratio)
-                self.preview_image = self.original_image.resize((new_w, new_h), Image.Resampling.LANCZOS)
-                self.preview_scale = self.real_width / new_w
-            else:
-                self.preview_image = self.original_image.copy()
-                self.preview_scale = 1.0
-        except:
-            self.preview_image = self.original_image.copy()
-            self.preview_scale = 1.0
-
 # --- MAIN APPLICATION ---
 class SlicerLabApp:
     # Supported export formats
-    EXPORT_FORMATS = [
-        ("PNG", ".png"),
-        ("JPEG", ".jpg"),
-        ("TIFF", ".tiff"),
-        ("BMP", ".bmp"),
-        ("WebP", ".webp")
-    ]
+    EXPORT_FORMATS = EXPORT_FORMATS
+    # Array outputs for training pipelines, offered after the image formats
+    DATASET_FORMATS = DATASET_FORMATS
+
+    # Memory budget for rendered viewport tiles
+    TILE_CACHE_MB = 256
+    # Upper bound on viewport renders per second
+    MAX_FPS = 60
+    # Disk budget for persisted previews (see preview_cache.py)
+    PREVIEW_CACHE_MB = 1024
+    # Threads decoding pyramid levels for the visible image / prefetching previews
+    LOADER_WORKERS = 2
+    PREFETCH_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+    # Screen tiles rendered ahead of a pan or zoom at once (see prefetch.py)
+    VIEW_PREFETCH_IN_FLIGHT = 8
+    # Decoded-source budget for Slice All Images; bigger images wait for room
+    EXPORT_MEMORY_MB = 2048
+    # Images exported side by side by Slice All Images
+    EXPORT_MAX_IMAGES = 4
+    # Append changed sessions to <project>.lab.journal instead of rewriting the project on autosave
+    AUTOSAVE_JOURNAL = False
+    # How Deduplicate Identical Tiles exports repeated tiles (see exporter.DEDUP_MODES)
+    EXPORT_DEDUP_MODE = "hardlink"
+    # Render profiling (F12 toggles it); SLICER_PROFILE=1 turns it on at startup
+    PROFILE = os.environ.get("SLICER_PROFILE") == "1"
+    # Refreshes per second of the profiling readout
+    PROFILE_READOUT_HZ = 4
+    # Convert opened images into memory-mapped raw stores (see raw_store.py); SLICER_RAW_STORE=1 at startup
+    RAW_STORE = os.environ.get("SLICER_RAW_STORE") == "1"
+    # Disk budget for raw stores; the least recently used are deleted beyond it
+    RAW_STORE_GB = 64
+    # Raw stores converted at once; each may decode its whole source while converting
+    RAW_STORE_WORKERS = 1
 
     def __init__(self, root):
         self.root = root
@@ -83,9 +87,32 @@ class SlicerLabApp:
         self.current_session = None
         self.current_project_path = None
         self.autosave_timer = None
+        self.autosaver = ProjectAutosaver(journal=self.AUTOSAVE_JOURNAL)
+        self.dirty_sessions = set()
         self.export_format = ".png"  # Default export format
+        self.export_container = None  # one file per tile, or a CONTAINER_FORMATS extension
+        self.export_job = None
+        self.export_releases = None  # session whose source only the running export decoded
         
         self.tk_image = None
+        self.redraw_pending = None
+        self.last_frame_time = 0.0
+        self.profiler = Profiler(enabled=self.PROFILE)
+        self.renderer = ViewportRenderer(TileCache(self.TILE_CACHE_MB * 1024 * 1024), profiler=self.profiler)
+        self.last_render_error = None
+        self.last_readout_time = 0.0
+        self.loader = ThreadPoolExecutor(max_workers=self.LOADER_WORKERS)
+        self.prefetcher = ThreadPoolExecutor(max_workers=self.PREFETCH_WORKERS)
+        self.preview_prefetches = []
+        self.pending_levels = {}
+        self.failed_levels = set()
+        self.view_prefetch = ViewportPrefetcher(self.renderer, ThreadPoolExecutor(max_workers=1),
+                                                self.VIEW_PREFETCH_IN_FLIGHT, load_level=self._load_level_async)
+        self.view_prefetch_polling = False
+        self.preview_cache = PreviewCache(max_bytes=self.PREVIEW_CACHE_MB * 1024 * 1024)
+        self.pending_stores = {}
+        self.store_builder = ThreadPoolExecutor(max_workers=self.RAW_STORE_WORKERS)
+        self.stores_to_close = []  # unmapped once the running export no longer reads them
         self.last_mouse_x = 0
         self.last_mouse_y = 0
 
@@ -232,6 +259,7 @@ class SlicerLabApp:
         # Slice Buttons
         self._add_toolbar_btn("✂️ Slice", self.save_selected_cells, bg="#27ae60", tooltip="Slice Selected Cells")
         self._add_toolbar_btn("🔲 All", self.slice_all, bg="#27ae60", tooltip="Slice All Grid")
+        self._setup_selection_menu()
         
         # Status label on the right
         self.save_status_label = tk.Label(self.toolbar, text="", bg=self.colors["toolbar"], fg="#aaa", font=("Segoe UI", 8, "italic"))
@@ -245,6 +273,9 @@ class SlicerLabApp:
         
         self.status_bar = tk.Label(content, text="Ready. Add an image to start.", bg=self.colors["accent"], fg="white", anchor="w", font=("Segoe UI", 8))
         self.status_bar.pack(fill=tk.X)
+        self.profile_label = tk.Label(content, text="", bg="#111", fg="#8fd18f", anchor="w", font=("Menlo" if self.is_mac else "Consolas", 8))
+        if self.profiler.enabled:
+            self.profile_label.pack(fill=tk.X)
 
         self._setup_binds()
 
@@ -297,6 +328,48 @@ class SlicerLabApp:
         self.project_menu.add_command(label="📂 Open Project...", command=self.open_project)
         self.project_menu.add_separator()
         self.project_menu.add_command(label="💾 Save As...", command=self.save_project_as)
+        self.project_menu.add_separator()
+        self.project_menu.add_command(label="🔲 Slice All Images...", command=self.slice_all_sessions)
+        self.project_menu.add_separator()
+        self.raw_store_var = tk.BooleanVar(value=self.RAW_STORE)
+        self.project_menu.add_checkbutton(label="Use Raw Pixel Store", variable=self.raw_store_var,
+                                          command=self.toggle_raw_store)
+
+    def _setup_selection_menu(self):
+        """Create content-aware selection dropdown menu"""
+        f = tk.Frame(self.toolbar, bg=self.colors["toolbar"])
+        f.pack(side=tk.LEFT, padx=5)
+        
+        self.selection_menubutton = tk.Menubutton(f, text="🔍 Select ▾", 
+                                                   bg="#444", fg="white", 
+                                                   relief="flat", 
+                                                   font=("Segoe UI", 10),
+                                                   activebackground="#555",
+                                                   activeforeground="white",
+                                                   padx=10, pady=5)
+        self.selection_menubutton.pack(side=tk.LEFT)
+        
+        self.selection_menu = tk.Menu(self.selection_menubutton, tearoff=0,
+                                      bg="#333", fg="white",
+                                      activebackground="#007acc",
+                                      activeforeground="white",
+                                      font=("Segoe UI", 10))
+        self.selection_menubutton["menu"] = self.selection_menu
+        
+        self.skip_empty_var = tk.BooleanVar(value=False)
+        self.selection_menu.add_command(label="Select Non-empty Cells", command=self.select_non_empty)
+        self.selection_menu.add_command(label="Deselect Empty Cells", command=self.deselect_empty)
+        self.selection_menu.add_command(label="Clear Selection (C)", command=self.clear_selection)
+        self.selection_menu.add_separator()
+        self.selection_menu.add_checkbutton(label="Skip Empty Tiles in Slice All", variable=self.skip_empty_var)
+        self.dedup_var = tk.BooleanVar(value=False)
+        self.selection_menu.add_checkbutton(label="Deduplicate Identical Tiles", variable=self.dedup_var)
+        self.profile_var = tk.StringVar(value=DEFAULT_PROFILE)
+        profile_menu = tk.Menu(self.selection_menu, tearoff=0, bg="#333", fg="white",
+                               activebackground="#007acc", activeforeground="white", font=("Segoe UI", 10))
+        for profile in ENCODER_PROFILES:
+            profile_menu.add_radiobutton(label=profile.capitalize(), value=profile, variable=self.profile_var)
+        self.selection_menu.add_cascade(label="Encoder Profile", menu=profile_menu)
 
     def _setup_zoom_controls(self):
         """Create visual zoom controls: + / - buttons and percentage label"""
@@ -319,21 +392,32 @@ class SlicerLabApp:
         f.pack(side=tk.LEFT, padx=3)
         
         self.format_var = tk.StringVar(value="PNG")
-        format_names = [fmt[0] for fmt in self.EXPORT_FORMATS]
+        format_names = [fmt[0] for fmt in self.EXPORT_FORMATS + self.DATASET_FORMATS]
         
         self.format_dropdown = ttk.Combobox(f, textvariable=self.format_var, values=format_names, 
                                             state="readonly", width=5, font=("Segoe UI", 9))
         self.format_dropdown.pack(side=tk.LEFT, padx=2)
         self.format_dropdown.bind("<<ComboboxSelected>>", self._on_format_change)
 
+        # Where tiles go: separate files, or one container file per image
+        self.container_var = tk.StringVar(value="Files")
+        self.container_dropdown = ttk.Combobox(f, textvariable=self.container_var,
+                                               values=["Files"] + [name for name, _ in CONTAINER_FORMATS],
+                                               state="readonly", width=8, font=("Segoe UI", 9))
+        self.container_dropdown.pack(side=tk.LEFT, padx=2)
+        self.container_dropdown.bind("<<ComboboxSelected>>", self._on_container_change)
+
     def _on_format_change(self, event=None):
         """Handle format dropdown selection change"""
         selected = self.format_var.get()
-        for name, ext in self.EXPORT_FORMATS:
+        for name, ext in self.EXPORT_FORMATS + self.DATASET_FORMATS:
             if name == selected:
                 self.export_format = ext
                 break
 
+    def _on_container_change(self, event=None):
+        self.export_container = dict(CONTAINER_FORMATS).get(self.container_var.get())
+
     def zoom_in_btn(self):
         """Zoom in via button"""
         if self.current_session:
@@ -355,10 +439,7 @@ class SlicerLabApp:
             w_can = self.canvas.winfo_width()
             h_can = self.canvas.winfo_height()
             if w_can > 10 and h_can > 10:
-                ratio = min(w_can / s.real_width, h_can / s.real_height)
-                s.zoom_level = ratio * 0.9
-                s.camera_x = 0
-                s.camera_y = 0
+                s.zoom_to_fit(w_can, h_can)
                 self.redraw()
 
     def _update_zoom_label(self):
@@ -386,6 +467,8 @@ class SlicerLabApp:
         
         c.bind("<Configure>", self.on_resize)
         self.root.bind("<c>", self.clear_selection)
+        self.root.bind("<Escape>", self.cancel_export)
+        self.root.bind("<F12>", self.toggle_profiling)
 
     def _get_scroll_delta(self, event):
         """Normalize scroll speed between systems"""
@@ -395,6 +478,8 @@ class SlicerLabApp:
             return (event.delta / 120) * 30
 
     def trigger_modification(self, event=None):
+        if self.current_session:
+            self.dirty_sessions.add(self.current_session)
         if not self.current_project_path:
             self.save_status_label.config(text="* Unsaved")
             return
@@ -405,44 +490,38 @@ class SlicerLabApp:
         self.autosave_timer = self.root.after(2000, self._execute_autosave)
 
     def _execute_autosave(self):
+        self.autosave_timer = None
         if self.current_project_path:
-            try:
-                self._write_project_file(self.current_project_path)
-                self.save_status_label.config(text="Auto-saved")
-            except Exception as e:
-                self.save_status_label.config(text="AutoSave Error")
-                print(f"AutoSave Error: {e}")
-
-    def _write_project_file(self, path):
+            self._write_project_file(self.current_project_path)
+            self.save_status_label.config(text="Saving...")
+            self.root.after(100, self._poll_autosave)
+
+    def _poll_autosave(self):
+        if self.autosaver.busy:
+            self.root.after(100, self._poll_autosave)
+        elif self.autosaver.last_error:
+            self.save_status_label.config(text="AutoSave Error")
+            print(f"AutoSave Error: {self.autosaver.last_error}")
+        elif not self.autosave_timer:
+            self.save_status_label.config(text="Auto-saved")
+
+    def _write_project_file(self, path, wait=False):
+        """Queue a background save of the project; `wait` blocks until it is on disk"""
         if self.current_session:
             try:
                 self.current_session.grid_w = int(self.entry_w.get())
                 self.current_session.grid_h = int(self.entry_h.get())
             except: pass
 
-        project_data = {
-            "version": "2.2",
-            "platform": platform.system(),
-            "active_index": self.sessions.index(self.current_session) if self.current_session in self.sessions else 0,
-            "export_format": self.export_format,
-            "images": []
-        }
-
-        for session in self.sessions:
-            session_data = {
-                "path": session.path,
-                "grid_w": session.grid_w,
-                "grid_h": session.grid_h,
-                "grid_color": session.grid_color,
-                "zoom_level": session.zoom_level,
-                "camera_x": session.camera_x,
-                "camera_y": session.camera_y,
-                "selection": list(session.selected_cells)
-            }
-            project_data["images"].append(session_data)
-
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(project_data, f, indent=4)
+        active = self.sessions.index(self.current_session) if self.current_session in self.sessions else 0
+        # The active session may have changed without a modification event (pan, zoom)
+        dirty = self.dirty_sessions | {self.current_session}
+        self.dirty_sessions = set()
+        self.autosaver.save(path, self.sessions, active, self.export_format, dirty, checkpoint=wait)
+        if wait:
+            self.autosaver.wait()
+            if self.autosaver.last_error:
+                raise OSError(self.autosaver.last_error)
 
     def new_project(self):
         """Create a new empty project"""
@@ -451,7 +530,13 @@ class SlicerLabApp:
                 return
         
         # Clear everything
+        self._cancel_prefetches()
+        self.failed_levels.clear()
+        for session in self.sessions:
+            self._close_raw_store(session)
         self.sessions.clear()
+        self.dirty_sessions.clear()
+        self.renderer.cache.clear()
         self.file_list.delete(0, tk.END)
         self.current_session = None
         self.current_project_path = None
@@ -475,22 +560,31 @@ class SlicerLabApp:
             messagebox.showwarning("Warning", "No images to save.")
             return
             
-        f = filedialog.asksaveasfilename(defaultextension=".lab", filetypes=[("Lab Project", "*.lab")])
+        f = filedialog.asksaveasfilename(defaultextension=".lab", filetypes=[("Lab Project", "*.lab"), ("Lab Project (binary)", "*.labx")])
         if f:
+            try:
+                self._write_project_file(f, wait=True)
+            except OSError as e:
+                messagebox.showerror("Error", f"Error saving project: {e}")
+                return
             self.current_project_path = f
-            self._write_project_file(f)
             self.root.title(f"Slicer Lab Pro - {os.path.basename(f)}")
             messagebox.showinfo("Success", "Project saved! AutoSave enabled.")
 
     def open_project(self):
-        f = filedialog.askopenfilename(filetypes=[("Lab Project", "*.lab")])
+        f = filedialog.askopenfilename(filetypes=[("Lab Project", "*.lab;*.labx")])
         if not f: return
         
         try:
-            with open(f, 'r', encoding='utf-8') as file:
-                data = json.load(file)
+            data = project.read_project(f)
 
+            self._cancel_prefetches()
+            self.failed_levels.clear()
+            for session in self.sessions:
+                self._close_raw_store(session)
             self.sessions.clear()
+            self.dirty_sessions.clear()
+            self.renderer.cache.clear()
             self.file_list.delete(0, tk.END)
             self.current_session = None
             self.canvas.delete("all")
@@ -499,43 +593,23 @@ class SlicerLabApp:
             self.entry_h.delete(0, tk.END)
 
             # Load export format
-            saved_format = data.get("export_format", ".png")
+            saved_format = project.export_format(data)
             self.export_format = saved_format
-            for name, ext in self.EXPORT_FORMATS:
+            for name, ext in self.EXPORT_FORMATS + self.DATASET_FORMATS:
                 if ext == saved_format:
                     self.format_var.set(name)
                     break
 
-            image_list = data.get("images", data.get("imagens", []))
-            if isinstance(data, list): image_list = data
-
-            for img_data in image_list:
-                path = img_data.get("path", img_data.get("caminho"))
-                
-                if not os.path.exists(path):
-                    filename = os.path.basename(path)
-                    project_folder = os.path.dirname(f)
-                    alternative = os.path.join(project_folder, filename)
-                    if os.path.exists(alternative):
-                        path = alternative
-                
-                if path and os.path.exists(path):
-                    new_session = ImageSession(path)
-                    
-                    new_session.grid_w = img_data.get("grid_w", img_data.get("gw", 1000))
-                    new_session.grid_h = img_data.get("grid_h", img_data.get("gh", 1000))
-                    new_session.grid_color = img_data.get("grid_color", img_data.get("color", "#FFFF00"))
-                    new_session.zoom_level = img_data.get("zoom_level", 1.0)
-                    new_session.camera_x = img_data.get("camera_x", 0)
-                    new_session.camera_y = img_data.get("camera_y", 0)
-                    
-                    sel_raw = img_data.get("selection", img_data.get("selecao", img_data.get("sel", [])))
-                    new_session.selected_cells = set(tuple(x) for x in sel_raw)
+            for img_data in project.image_entries(data):
+                path = project.resolve_image_path(img_data, f)
+                if path:
+                    new_session = ImageSession(path, self.preview_cache)
+                    project.apply_session_data(new_session, img_data)
                     
                     self.sessions.append(new_session)
                     self.file_list.insert(tk.END, f" {new_session.name}")
 
-            active_idx = data.get("active_index", data.get("indice_ativo", 0))
+            active_idx = project.active_index(data)
             
             if not self.sessions:
                 messagebox.showwarning("Warning", "Images not found. Place the images in the same folder as the .lab file.")
@@ -546,6 +620,9 @@ class SlicerLabApp:
             self.file_list.selection_clear(0, tk.END)
             self.file_list.selection_set(active_idx)
             self._activate_session(self.sessions[active_idx])
+            self._prefetch_previews(self.sessions[active_idx + 1:] + self.sessions[:active_idx])
+            if self.raw_store_var.get():
+                self._open_raw_stores(self.sessions)
             
             self.current_project_path = f
             self.root.title(f"Slicer Lab Pro - {os.path.basename(f)}")
@@ -569,12 +646,14 @@ class SlicerLabApp:
             except: pass
 
         try:
-            new_session = ImageSession(path)
+            new_session = ImageSession(path, self.preview_cache)
             self.sessions.append(new_session)
             self.file_list.insert(tk.END, f" {new_session.name}")
             self.file_list.selection_clear(0, tk.END)
             self.file_list.selection_set(tk.END)
             self._activate_session(new_session)
+            if self.raw_store_var.get():
+                self._open_raw_stores([new_session])
         except Exception as e:
             messagebox.showerror("Error", str(e))
 
@@ -592,7 +671,12 @@ class SlicerLabApp:
             self._activate_session(self.sessions[idx])
 
     def _activate_session(self, session):
+        if self.current_session is not None:
+            # Keep the camera of the session we leave in the next autosave
+            self.dirty_sessions.add(self.current_session)
         self.current_session = session
+        # Levels that failed to load are retried once the image is shown again
+        self.failed_levels = {key for key in self.failed_levels if key[0] is not session}
         
         self.entry_w.delete(0, tk.END)
         self.entry_w.insert(0, str(session.grid_w))
@@ -609,34 +693,98 @@ class SlicerLabApp:
         self.redraw()
         self._update_zoom_label()
 
-    def on_resize(self, event):
-        if self.current_session: self.redraw()
+    def _prefetch_previews(self, sessions):
+        """Build whole-image previews of inactive sessions in the background"""
+        self.preview_prefetches = [self.prefetcher.submit(self._prefetch_preview, session) for session in sessions]
+
+    def _prefetch_preview(self, session):
+        level = session.load_preview()
+        # Decided after the build: the user may have switched to this image while it ran
+        if session is not self.current_session:
+            session.release_levels(level)
+
+    def _cancel_prefetches(self):
+        """Drop the preview and raw store builds of the previous project that have not started yet"""
+        for future in self.preview_prefetches:
+            future.cancel()
+        self.preview_prefetches = []
+        for session, future in list(self.pending_stores.items()):
+            if future.cancel():
+                del self.pending_stores[session]
+
+    def toggle_raw_store(self):
+        if self.raw_store_var.get():
+            self._open_raw_stores(self.sessions)
+        else:
+            # Crops go back to the decoded source; the stores stay on disk for next time
+            for session in self.sessions:
+                self._close_raw_store(session)
+            for session, future in list(self.pending_stores.items()):
+                if future.cancel():
+                    del self.pending_stores[session]
+            self.request_redraw()
+
+    def _open_raw_stores(self, sessions):
+        """Convert sources into raw stores in the background (or reopen existing ones)"""
+        polling = bool(self.pending_stores)
+        for session in sessions:
+            if session not in self.pending_stores and session.raw_store is None:
+                self.pending_stores[session] = self.store_builder.submit(
+                    session.open_raw_store, build=True, max_bytes=self.RAW_STORE_GB * 1024 ** 3)
+        if self.pending_stores:
+            self.status_bar.config(text=f"Building raw pixel store for {len(self.pending_stores)} image(s)...")
+            if not polling:
+                self.root.after(200, self._poll_raw_stores)
+
+    def _poll_raw_stores(self):
+        done = [session for session, future in self.pending_stores.items() if future.done()]
+        for session in done:
+            error = self.pending_stores.pop(session).exception()
+            if not self.raw_store_var.get() or session not in self.sessions:
+                self._close_raw_store(session)  # switched off or closed while it was being built
+            elif error:
+                self.status_bar.config(text=f"Raw store for {session.name} failed: {error}")
+            elif session.raw_store is None:
+                self.status_bar.config(text=f"{session.name}: {session.image_mode} images cannot use the raw store")
+            elif session is self.current_session:
+                self.status_bar.config(text=f"Raw pixel store ready: {session.raw_store.path}")
+                self.request_redraw()
+        if self.pending_stores:
+            self.root.after(200, self._poll_raw_stores)
+
+    def _close_raw_store(self, session):
+        """Stop cropping from a session's raw store and unmap it, after the running export if any"""
+        store, session.raw_store = session.raw_store, None
+        if store is None:
+            return
+        if self.export_job and not self.export_job.finished:
+            self.stores_to_close.append(store)
+        else:
+            store.close()
 
-    def _draw_selection_overlay(self, x1, y1, x2, y2):
-        """Draw a semi-transparent selection overlay that works on all platforms"""
-        # Create multiple thin lines to simulate transparency effect
-        # Cyan color with visual transparency simulation
-        
-        # Draw filled area with alternating lines pattern (simulates 50% transparency)
-        line_spacing = 2
-        
-        # Horizontal lines
-        y = y1
-        while y < y2:
-            self.canvas.create_line(x1, y, x2, y, fill="#00FFFF", width=1)
-            y += line_spacing * 2
-        
-        # Vertical lines for crosshatch effect (more visible)
-        x = x1
-        while x < x2:
-            self.canvas.create_line(x, y1, x, y2, fill="#00FFFF", width=1)
-            x += line_spacing * 2
-        
-        # Strong border
-        self.canvas.create_rectangle(x1, y1, x2, y2, outline="#00FFFF", width=3)
-        
-        # Inner glow effect
-        self.canvas.create_rectangle(x1+2, y1+2, x2-2, y2-2, outline="#FFFFFF", width=1)
+    def _load_level_async(self, session, level):
+        key = (session, level)
+        if key in self.pending_levels or key in self.failed_levels:
+            return
+        self.pending_levels[key] = self.loader.submit(session.get_level, level)
+        if len(self.pending_levels) == 1:
+            self.root.after(50, self._poll_pending_levels)
+
+    def _poll_pending_levels(self):
+        """Redraw once a level requested by redraw() finishes decoding"""
+        done = [key for key, future in self.pending_levels.items() if future.done()]
+        for key in done:
+            error = self.pending_levels.pop(key).exception()
+            if error:
+                self.failed_levels.add(key)
+                self.status_bar.config(text=f"Error loading {key[0].name}: {error}")
+        if any(key[0] is self.current_session for key in done):
+            self.request_redraw()
+        if self.pending_levels:
+            self.root.after(50, self._poll_pending_levels)
+
+    def on_resize(self, event):
+        if self.current_session: self.request_redraw()
 
     def redraw(self):
         s = self.current_session
@@ -649,72 +797,103 @@ class SlicerLabApp:
 
         w_can = self.canvas.winfo_width()
         h_can = self.canvas.winfo_height()
-        
-        l = s.camera_x
-        t = s.camera_y
-        r = l + (w_can / s.zoom_level)
-        b = t + (h_can / s.zoom_level)
 
         self.canvas.delete("all")
 
-        use_preview = (s.zoom_level < 0.5 and s.preview_scale > 1.0)
-        
+        # Draw from the best level already in memory while the ideal one decodes
+        wanted, level = choose_level(s)
+        if level != wanted:
+            self._load_level_async(s, wanted)
+        if level is None:
+            self.canvas.create_text(w_can // 2, h_can // 2, text=f"Loading {s.name}...", fill="#888", font=("Segoe UI", 11))
+            return
+
+        profiler = self.profiler
+        cache = self.renderer.cache
+        hits, misses = cache.hits, cache.misses
+        profiler.begin_frame()
         try:
-            if use_preview:
-                pl = int(l / s.preview_scale)
-                pt = int(t / s.preview_scale)
-                pr = int(r / s.preview_scale)
-                pb = int(b / s.preview_scale)
-                img = s.preview_image.crop((pl, pt, pr, pb))
-                img = img.resize((w_can, h_can), Image.Resampling.NEAREST)
-            else:
-                cl = max(0, int(l))
-                ct = max(0, int(t))
-                cr = min(s.real_width, int(r))
-                cb = min(s.real_height, int(b))
-                if cr > cl and cb > ct:
-                    crop = s.original_image.crop((cl, ct, cr, cb))
-                    img = Image.new("RGB", (w_can, h_can), (20,20,20))
-                    px = int((cl - l) * s.zoom_level)
-                    py = int((ct - t) * s.zoom_level)
-                    pw = int((cr - cl) * s.zoom_level)
-                    ph = int((cb - ct) * s.zoom_level)
-                    if pw>0 and ph>0:
-                        crop = crop.resize((pw, ph), Image.Resampling.NEAREST)
-                        img.paste(crop, (px, py))
-                else: img = Image.new("RGB", (w_can, h_can), (20,20,20))
-
-            self.tk_image = ImageTk.PhotoImage(img)
-            self.canvas.create_image(0, 0, image=self.tk_image, anchor="nw")
-            
-            if (r-l)/s.grid_w < 400: 
-                sc, ec = int(l//s.grid_w), int(r//s.grid_w)+1
-                sr, er = int(t//s.grid_h), int(b//s.grid_h)+1
-                
-                for (c, ro) in s.selected_cells:
-                    if sc <= c <= ec and sr <= ro <= er:
-                        x1 = (c*s.grid_w - l)*s.zoom_level
-                        y1 = (ro*s.grid_h - t)*s.zoom_level
-                        x2 = x1 + (s.grid_w*s.zoom_level)
-                        y2 = y1 + (s.grid_h*s.zoom_level)
-                        
-                        # Semi-transparent selection overlay (works on all platforms)
-                        self._draw_selection_overlay(x1, y1, x2, y2)
-                
-                cx = (sc * s.grid_w)
-                if cx < l: cx += s.grid_w
-                while cx < r:
-                    sx = (cx - l) * s.zoom_level
-                    self.canvas.create_line(sx, 0, sx, h_can, fill=s.grid_color, dash=(2, 4))
-                    cx += s.grid_w
-                cy = (sr * s.grid_h)
-                if cy < t: cy += s.grid_h
-                while cy < b:
-                    sy = (cy - t) * s.zoom_level
-                    self.canvas.create_line(0, sy, w_can, sy, fill=s.grid_color, dash=(2, 4))
-                    cy += s.grid_h
-
-        except Exception as e: pass
+            # Grid and selections are composited into the frame: one canvas item in total
+            img = self.renderer.render(s, w_can, h_can, level)
+            with profiler.stage("photoimage"):
+                self.tk_image = ImageTk.PhotoImage(img)
+            with profiler.stage("canvas"):
+                self.canvas.create_image(0, 0, image=self.tk_image, anchor="nw")
+        except Exception as e:
+            self._report_render_error(e)
+        else:
+            self.last_render_error = None
+            # Start rendering the tiles the current pan or zoom is heading to
+            self.view_prefetch.observe(s, w_can, h_can)
+            if self.view_prefetch.in_flight and not self.view_prefetch_polling:
+                self.view_prefetch_polling = True
+                self.root.after(30, self._poll_view_prefetch)
+        if profiler.enabled:
+            lookups = cache.hits + cache.misses - hits - misses
+            profiler.end_frame(canvas_items=len(self.canvas.find_all()),
+                               tile_hit_rate=round((cache.hits - hits) / lookups, 2) if lookups else 1.0,
+                               cached_tiles=len(cache), prefetching=self.view_prefetch.in_flight)
+            self._update_profile_readout()
+
+    def _poll_view_prefetch(self):
+        """Hand prefetched tiles to the render cache on the Tk thread"""
+        self.view_prefetch.collect()
+        if self.view_prefetch.in_flight:
+            self.root.after(30, self._poll_view_prefetch)
+        else:
+            self.view_prefetch_polling = False
+
+    def _report_render_error(self, error):
+        """Surface a failed frame instead of leaving a blank canvas without explanation"""
+        self.profiler.error(error)
+        message = f"{type(error).__name__}: {error}"
+        # Frames are re-rendered on every pan step; only log each distinct failure once
+        if message != self.last_render_error:
+            self.last_render_error = message
+            traceback.print_exc()
+        self.status_bar.config(text=f"Render error: {message}")
+
+    def toggle_profiling(self, e=None):
+        enabled = not self.profiler.enabled
+        self.profiler.set_enabled(enabled)
+        if enabled:
+            self.profile_label.config(text="Profiling: no frames yet")
+            self.profile_label.pack(fill=tk.X)
+            self.status_bar.config(text=f"Render profiling on | trace: {self.profiler.trace_path}")
+            if self.current_session:
+                self.request_redraw()
+        else:
+            self.profile_label.pack_forget()
+            self.status_bar.config(text=f"Render profiling off | trace written to {self.profiler.trace_path}")
+
+    def _update_profile_readout(self):
+        now = time.monotonic()
+        if now - self.last_readout_time >= 1.0 / self.PROFILE_READOUT_HZ:
+            self.last_readout_time = now
+            self.profile_label.config(text=self.profiler.summary())
+
+    def request_redraw(self):
+        """Mark the view dirty; bursts of events are coalesced into one render per frame"""
+        if self.redraw_pending is not None:
+            return
+        interval = 1.0 / self.MAX_FPS
+        wait = interval - (time.monotonic() - self.last_frame_time)
+        self.redraw_pending = self.root.after(max(0, int(wait * 1000)), self._render_frame)
+
+    def _render_frame(self):
+        self.redraw_pending = None
+        self.last_frame_time = time.monotonic()
+        self.redraw()
+
+    def _pan_view(self, dx, dy):
+        """Pan by a screen-space delta, shifting the current frame until the next render"""
+        s = self.current_session
+        old_x, old_y = viewport_origin(s)
+        s.pan(dx, dy)
+        new_x, new_y = viewport_origin(s)
+        # Fast path: move what is already on the canvas; the exposed strip is filled by the next frame
+        self.canvas.move("all", old_x - new_x, old_y - new_y)
+        self.request_redraw()
 
     def on_pan_start(self, e):
         self.last_mouse_x = e.x
@@ -724,11 +903,9 @@ class SlicerLabApp:
         if self.current_session:
             dx = e.x - self.last_mouse_x
             dy = e.y - self.last_mouse_y
-            self.current_session.camera_x -= dx / self.current_session.zoom_level
-            self.current_session.camera_y -= dy / self.current_session.zoom_level
             self.last_mouse_x = e.x
             self.last_mouse_y = e.y
-            self.redraw()
+            self._pan_view(dx, dy)
 
     def on_right_click(self, e):
         s = self.current_session
@@ -738,23 +915,15 @@ class SlicerLabApp:
         if 0 <= rx <= s.real_width and 0 <= ry <= s.real_height:
             col = int(rx // s.grid_w)
             row = int(ry // s.grid_h)
-            k = (col, row)
-            if k in s.selected_cells: s.selected_cells.remove(k)
-            else: s.selected_cells.add(k)
-            self.redraw()
+            s.selected_cells.toggle((col, row))
+            self.request_redraw()
             self.trigger_modification()
 
     def apply_zoom(self, factor, mx, my):
         s = self.current_session
         if not s: return
-        new_zoom = s.zoom_level * factor
-        if new_zoom < 0.001: return
-        wx = s.camera_x + (mx / s.zoom_level)
-        wy = s.camera_y + (my / s.zoom_level)
-        s.zoom_level = new_zoom
-        s.camera_x = wx - (mx / new_zoom)
-        s.camera_y = wy - (my / new_zoom)
-        self.redraw()
+        if not s.zoom_at(factor, mx, my): return
+        self.request_redraw()
         self._update_zoom_label()
 
     def on_scroll(self, e): 
@@ -776,24 +945,20 @@ class SlicerLabApp:
             elif shift_held:
                 # Horizontal pan with Shift
                 delta = self._get_scroll_delta(e)
-                self.current_session.camera_x -= delta / self.current_session.zoom_level
-                self.redraw()
+                self._pan_view(delta, 0)
             else:
                 # Vertical pan (default)
                 delta = self._get_scroll_delta(e)
-                self.current_session.camera_y -= delta / self.current_session.zoom_level
-                self.redraw()
+                self._pan_view(0, delta)
         else:
             # Windows: simple vertical pan, zoom handled by separate binding
             shift_held = (e.state & 0x1) != 0
             if shift_held:
                 delta = self._get_scroll_delta(e)
-                self.current_session.camera_x -= delta / self.current_session.zoom_level
-                self.redraw()
+                self._pan_view(delta, 0)
             else:
                 delta = self._get_scroll_delta(e)
-                self.current_session.camera_y -= delta / self.current_session.zoom_level
-                self.redraw()
+                self._pan_view(0, delta)
             
     def on_zoom_scroll(self, e):
         if self.is_mac:
@@ -816,48 +981,72 @@ class SlicerLabApp:
             self.redraw()
             self.trigger_modification()
 
-    def _get_export_filename(self, base_name, row, col):
-        """Generate export filename with correct extension"""
-        name_without_ext = os.path.splitext(base_name)[0]
-        return f"{name_without_ext}_R{row:03d}_C{col:03d}{self.export_format}"
-
-    def _save_image_tile(self, image, path):
-        """Save image tile with format-specific options"""
-        if self.export_format == ".jpg":
-            # Convert to RGB for JPEG (no alpha channel)
-            if image.mode in ('RGBA', 'LA', 'P'):
-                image = image.convert('RGB')
-            image.save(path, quality=95)
-        elif self.export_format == ".webp":
-            image.save(path, quality=95)
-        else:
-            image.save(path)
+    def select_non_empty(self):
+        """Add every cell with content (non-background pixels) to the selection"""
+        self._update_selection_from_stats(
+            lambda stats, sel: stats.select_where(sel, lambda c: c.coverage >= MIN_COVERAGE), "added")
+
+    def deselect_empty(self):
+        """Remove background-only cells from the selection"""
+        self._update_selection_from_stats(
+            lambda stats, sel: stats.deselect_where(sel, lambda c: c.coverage < MIN_COVERAGE), "removed")
+
+    def _update_selection_from_stats(self, apply, verb):
+        s = self.current_session
+        if not s:
+            messagebox.showwarning("Warning", "No image loaded.")
+            return
+
+        def done(stats):
+            changed = apply(stats, s.selected_cells)
+            self.status_bar.config(text=f"{changed} cells {verb} | {len(s.selected_cells)} selected")
+            self.dirty_sessions.add(s)
+            if s is self.current_session:
+                self.request_redraw()
+            self.trigger_modification()
+
+        self._with_tile_stats(s, done)
+
+    def _with_tile_stats(self, session, callback):
+        """Call `callback(stats)` once the session's per-cell statistics are ready.
+
+        Computing them decodes a pyramid level, so that part runs on the loader
+        pool and the callback is invoked from the Tk thread.
+        """
+        stats = session.tile_stats
+        if stats is not None and stats.matches(session):
+            callback(stats)
+            return
+
+        self.status_bar.config(text=f"Analyzing tiles of {session.name}...")
+        future = self.loader.submit(session.get_tile_stats)
+
+        def poll():
+            if not future.done():
+                self.root.after(50, poll)
+                return
+            error = future.exception()
+            if error:
+                self.status_bar.config(text=f"Tile analysis failed: {error}")
+                return
+            callback(future.result())
+
+        self.root.after(50, poll)
 
     def save_selected_cells(self):
         s = self.current_session
         if not s or not s.selected_cells: 
             messagebox.showwarning("Warning", "No cells selected.")
             return
+        if self._export_running():
+            return
         
         msg = f"Save {len(s.selected_cells)} slices as {self.export_format.upper()[1:]}?"
         if not messagebox.askyesno("Confirm", msg): return
         
         out = filedialog.askdirectory(title="Select output folder")
         if out:
-            count = 0
-            for (c, r) in s.selected_cells:
-                x1 = c * s.grid_w
-                y1 = r * s.grid_h
-                x2 = min(x1 + s.grid_w, s.real_width)
-                y2 = min(y1 + s.grid_h, s.real_height)
-                
-                filename = self._get_export_filename(s.name, r, c)
-                full_path = os.path.join(out, filename)
-                
-                tile = s.original_image.crop((x1, y1, x2, y2))
-                self._save_image_tile(tile, full_path)
-                count += 1
-            messagebox.showinfo("Done", f"{count} slices saved as {self.export_format.upper()[1:]}.")
+            self._start_export(self._export_job(s, out, cells=s.selected_cells))
 
     def slice_all(self):
         """Slice the entire image into all grid tiles"""
@@ -865,16 +1054,29 @@ class SlicerLabApp:
         if not s: 
             messagebox.showwarning("Warning", "No image loaded.")
             return
+        if self._export_running():
+            return
         
+        if self.skip_empty_var.get():
+            self._with_tile_stats(s, lambda stats: self._confirm_slice_all(s, stats))
+        else:
+            self._confirm_slice_all(s, None)
+
+    def _confirm_slice_all(self, s, stats):
         # Calculate total tiles
-        cols = (s.real_width + s.grid_w - 1) // s.grid_w
-        rows = (s.real_height + s.grid_h - 1) // s.grid_h
+        cols, rows = grid_size(s.real_width, s.real_height, s.grid_w, s.grid_h)
         total = cols * rows
         
         msg = f"Split entire image into {total} tiles ({cols} cols x {rows} rows)?\n\n"
         msg += f"Grid: {s.grid_w}x{s.grid_h}px\n"
         msg += f"Image: {s.real_width}x{s.real_height}px\n"
         msg += f"Format: {self.export_format.upper()[1:]}"
+        if self.export_container:
+            msg += f" in one {self.container_var.get()} file"
+        cells = None
+        if stats is not None:
+            cells = stats.non_empty_cells()
+            msg += f"\n\nSkipping {total - len(cells)} empty tiles"
         
         if not messagebox.askyesno("Confirm Slice All", msg): 
             return
@@ -883,25 +1085,111 @@ class SlicerLabApp:
         if not out:
             return
             
-        count = 0
-        
-        for row in range(rows):
-            for col in range(cols):
-                x1 = col * s.grid_w
-                y1 = row * s.grid_h
-                x2 = min(x1 + s.grid_w, s.real_width)
-                y2 = min(y1 + s.grid_h, s.real_height)
-                
-                filename = self._get_export_filename(s.name, row, col)
-                full_path = os.path.join(out, filename)
-                
-                tile = s.original_image.crop((x1, y1, x2, y2))
-                self._save_image_tile(tile, full_path)
-                count += 1
-        
-        messagebox.showinfo("Done", f"{count} tiles saved to:\n{out}")
+        self._start_export(self._export_job(s, out, cells=cells))
+
+    def slice_all_sessions(self):
+        """Slice every grid cell of every open image in one background run"""
+        if not self.sessions:
+            messagebox.showwarning("Warning", "No image loaded.")
+            return
+        if self._export_running():
+            return
+
+        total = 0
+        for s in self.sessions:
+            cols, rows = grid_size(s.real_width, s.real_height, s.grid_w, s.grid_h)
+            total += cols * rows
+        msg = f"Split all {len(self.sessions)} images into {total} tiles using each image's grid?\n\n"
+        msg += f"Format: {self.export_format.upper()[1:]}"
+        if not messagebox.askyesno("Confirm Slice All Images", msg):
+            return
+        out = filedialog.askdirectory(title="Select output folder")
+        if not out:
+            return
+
+        jobs = [self._export_job(s, out) for s in self.sessions]
+        self._start_export(BatchExport(jobs, self.EXPORT_MEMORY_MB * 1024 * 1024,
+                                       max_images=self.EXPORT_MAX_IMAGES, workers=os.cpu_count() or 1))
+
+    def _export_running(self):
+        if self.export_job and not self.export_job.finished:
+            messagebox.showwarning("Warning", "An export is already running. Press Esc to cancel it.")
+            return True
+        return False
+
+    def _export_job(self, session, out, cells=None):
+        if self.export_format in dict(self.DATASET_FORMATS).values():
+            return DatasetExport(session, out, cells=cells)
+        dedup = self.EXPORT_DEDUP_MODE if self.dedup_var.get() else None
+        return ExportJob(session, out, self.export_format, cells=cells, dedup=dedup, container=self.export_container,
+                         profile=self.profile_var.get())
+
+    def _start_export(self, job):
+        """Run an export job in the background and follow its progress in the status bar"""
+        self.export_job = job
+        # Like BatchExport, release a source that only the export decoded once it finishes
+        single = not isinstance(job, BatchExport)
+        self.export_releases = job.session if single and not is_loaded(job.session.original_image) else None
+        job.start()
+        self._poll_export()
+
+    def _poll_export(self):
+        job = self.export_job
+        if not job:
+            return
+        if not job.finished:
+            self.status_bar.config(text=f"{job.status_text()} | Esc to cancel")
+            self.root.after(250, self._poll_export)
+            return
+
+        self.export_job = None
+        for store in self.stores_to_close:
+            store.close()
+        self.stores_to_close = []
+        if self.export_releases is not None:
+            self.export_releases.release_source()
+            self.export_releases = None
+        if isinstance(job, BatchExport):
+            self._finish_batch_export(job)
+            return
+        fmt = job.export_format.upper()[1:]
+        took = format_duration(job.elapsed())
+        if job.error:
+            self.status_bar.config(text=f"Export failed: {job.error}")
+            messagebox.showerror("Error", f"Export failed: {job.error}")
+            return
+        summary = f"{job.saved} tiles saved as {fmt} in {took}"
+        if job.duplicates:
+            summary += f" ({job.duplicates} duplicates {'linked' if job.dedup == 'hardlink' else 'skipped'})"
+        if job.up_to_date:
+            summary += f", {job.up_to_date} already up to date"
+        self.status_bar.config(text=f"{'Export cancelled: ' if job.cancelled else 'Done: '}{summary} | {job.stage_text()}")
+        if job.errors:
+            messagebox.showwarning("Done", f"{summary}.\n{len(job.errors)} tiles failed, first error:\n{job.errors[0]}")
+        elif not job.cancelled:
+            messagebox.showinfo("Done", f"{summary} to:\n{job.out_dir}")
+
+    def _finish_batch_export(self, batch):
+        summary = f"{batch.saved} tiles from {batch.images_done} images in {format_duration(batch.elapsed())}"
+        if batch.error:
+            self.status_bar.config(text=f"Export failed: {batch.error}")
+            messagebox.showerror("Error", f"Export failed: {batch.error}")
+            return
+        self.status_bar.config(text=f"{'Export cancelled: ' if batch.cancelled else 'Done: '}{summary}")
+        errors = batch.errors
+        if errors:
+            messagebox.showwarning("Done", f"{summary}.\n{len(errors)} errors, first error:\n{errors[0]}")
+        elif not batch.cancelled:
+            messagebox.showinfo("Done", f"{summary} to:\n{batch.jobs[0].out_dir}")
+
+    def cancel_export(self, e=None):
+        if self.export_job and not self.export_job.finished:
+            self.export_job.cancel()
+            self.status_bar.config(text="Cancelling export...")
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = SlicerLabApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
+    if app.profiler.enabled:
+        app.profiler.flush()
\ No newline at end of file
@@ -0,0 +1,185 @@
+import math
+import time
+
+from render import viewport_origin
+
+
+class ViewportPrefetcher:
+    """Warms the render cache for the screen tiles the user is about to see.
+
+    observe() is called after every frame with the session on screen. It
+    follows the viewport origin to estimate the pan velocity (screen pixels
+    per second, smoothed over frames) and the last zoom step, then requests
+    the uncached tiles of the region the view will reach within LOOKAHEAD
+    seconds (at least one tile row or column ahead), plus the whole view at
+    the next zoom step while a zoom gesture continues; a pyramid level that
+    step needs is handed to `load_level`. Tiles are rendered on
+    `pool` at the finest level that is already drawable, exactly as the next
+    frame would render them, and collect() hands finished ones to the cache;
+    the cache is only touched by the caller's thread.
+
+    At most `max_in_flight` tiles are queued or rendering. Queued requests
+    the latest prediction no longer wants (the pan turned around, the zoom
+    reversed, another image was shown) are cancelled before they start.
+    """
+
+    # Seconds of movement predicted ahead
+    LOOKAHEAD = 0.3
+    # Slower pans (screen pixels per second) are treated as standing still
+    MIN_SPEED = 60.0
+    # A pause longer than this starts a new gesture
+    IDLE = 0.25
+    # Weight of the newest frame in the velocity estimate
+    SMOOTHING = 0.5
+
+    def __init__(self, renderer, pool, max_in_flight=8, load_level=None):
+        self.renderer = renderer
+        self.pool = pool
+        self.max_in_flight = max_in_flight
+        # Called with (session, level) for a pyramid level the zoom is heading to that is not built yet
+        self.load_level = load_level
+        self.enabled = True
+        self.requested = 0
+        self.cancelled = 0
+        self.warmed = 0
+        self._pending = {}  # tile key -> future
+        self._session = None
+        self._last = None  # (time, origin x, origin y, zoom, camera x, camera y)
+        self._velocity = (0.0, 0.0)
+        self._zoom_step = None  # (factor, world anchor) of the last zoom
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    def observe(self, session, width, height, now=None):
+        """Update the motion estimate from the frame just drawn and queue the tiles it predicts"""
+        if not self.enabled:
+            return
+        now = time.monotonic() if now is None else now
+        ox, oy = viewport_origin(session)
+        z = session.zoom_level
+        if session is not self._session:
+            self._session = session
+            self._last = None
+        if self._last is not None:
+            self._track(now, ox, oy, z, session)
+        self._last = (now, ox, oy, z, session.camera_x, session.camera_y)
+
+        wanted = self._predict(session, width, height, ox, oy, z)
+        self._cancel_stale(wanted)
+        for key in wanted:
+            if len(self._pending) >= self.max_in_flight:
+                break
+            if key in self._pending or key in self.renderer.cache:
+                continue
+            _, level, zoom, tx, ty = key
+            self._pending[key] = self.pool.submit(self.renderer.render_tile, session, level, tx, ty, zoom)
+            self.requested += 1
+
+    def collect(self):
+        """Move finished tiles into the render cache; returns how many were added"""
+        added = 0
+        for key, future in list(self._pending.items()):
+            if not future.done():
+                continue
+            del self._pending[key]
+            if future.cancelled() or future.exception() is not None:
+                continue
+            tile = future.result()
+            if tile is not None and key[0] is self._session and key not in self.renderer.cache:
+                self.renderer.cache.put(key, tile)
+                added += 1
+        self.warmed += added
+        return added
+
+    def cancel(self):
+        """Drop every queued request (e.g. when the image is closed)"""
+        self._cancel_stale(())
+        self._session = None
+        self._last = None
+
+    def _track(self, now, ox, oy, z, session):
+        last_time, last_x, last_y, last_z, cam_x, cam_y = self._last
+        dt = now - last_time
+        if dt <= 0:
+            return
+        if z != last_z:
+            factor = z / last_z
+            # zoom_at keeps the world point under the anchor fixed; recover it from the camera shift
+            anchor = None
+            if abs(1 / last_z - 1 / z) > 1e-12:
+                sx = (session.camera_x - cam_x) / (1 / last_z - 1 / z)
+                sy = (session.camera_y - cam_y) / (1 / last_z - 1 / z)
+                anchor = (cam_x + sx / last_z, cam_y + sy / last_z)
+            # Wheel and button zooms repeat a short decimal factor (1.05, 0.8, ...); rounding
+            # recovers it exactly, so the predicted zoom equals the one the next step computes
+            if abs(round(factor, 6) - factor) < 1e-9:
+                factor = round(factor, 6)
+            self._zoom_step = (factor, anchor)
+            self._velocity = (0.0, 0.0)
+            return
+        self._zoom_step = None
+        if dt > self.IDLE:
+            self._velocity = (0.0, 0.0)
+            return
+        vx, vy = (ox - last_x) / dt, (oy - last_y) / dt
+        px, py = self._velocity
+        if vx * px + vy * py < 0:
+            px, py = vx, vy  # turned around: forget the old direction at once
+        a = self.SMOOTHING
+        self._velocity = (a * vx + (1 - a) * px, a * vy + (1 - a) * py)
+
+    def _predict(self, session, width, height, ox, oy, z):
+        """Tile keys to warm, most urgent first"""
+        ts = self.renderer.tile_size
+        wanted = []
+        vx, vy = self._velocity
+        if math.hypot(vx, vy) >= self.MIN_SPEED:
+            level = session.ready_level(session.level_for_zoom(z))
+            if level is not None:
+                # The strip the pan will expose, at least one tile deep on the leading edges
+                ax = math.copysign(max(abs(vx) * self.LOOKAHEAD, ts), vx) if abs(vx) >= self.MIN_SPEED else 0
+                ay = math.copysign(max(abs(vy) * self.LOOKAHEAD, ts), vy) if abs(vy) >= self.MIN_SPEED else 0
+                left, right = min(ox, ox + ax), max(ox + width, ox + width + ax)
+                top, bottom = min(oy, oy + ay), max(oy + height, oy + height + ay)
+                visible = (ox // ts, oy // ts, (ox + width - 1) // ts, (oy + height - 1) // ts)
+                keys = [(session, level, z, tx, ty) for tx, ty in self._tiles(session, z, left, top, right, bottom)
+                        if not (visible[0] <= tx <= visible[2] and visible[1] <= ty <= visible[3])]
+                cx, cy = ox + width / 2, oy + height / 2
+                keys.sort(key=lambda k: math.hypot((k[3] + 0.5) * ts - cx, (k[4] + 0.5) * ts - cy))
+                wanted += keys
+
+        if self._zoom_step is not None and self._zoom_step[1] is not None:
+            factor, (wx, wy) = self._zoom_step
+            next_z = z * factor
+            next_level = session.level_for_zoom(next_z)
+            level = session.ready_level(next_level)
+            if level != next_level and self.load_level is not None:
+                self.load_level(session, next_level)
+            if next_z >= session.MIN_ZOOM and level is not None:
+                # The view after one more identical zoom step around the same anchor
+                sx, sy = (wx - session.camera_x) * z, (wy - session.camera_y) * z
+                cam_x, cam_y = wx - sx / next_z, wy - sy / next_z
+                nx, ny = int(math.floor(cam_x * next_z)), int(math.floor(cam_y * next_z))
+                keys = [(session, level, next_z, tx, ty)
+                        for tx, ty in self._tiles(session, next_z, nx, ny, nx + width, ny + height)]
+                keys.sort(key=lambda k: math.hypot((k[3] + 0.5) * ts - nx - sx, (k[4] + 0.5) * ts - ny - sy))
+                wanted += keys
+        return wanted
+
+    def _tiles(self, session, z, left, top, right, bottom):
+        """Screen tiles covering the box that hold part of the image"""
+        ts = self.renderer.tile_size
+        cols = math.ceil(session.real_width * z / ts)
+        rows = math.ceil(session.real_height * z / ts)
+        for ty in range(max(0, int(top // ts)), min(rows, int((bottom - 1) // ts) + 1)):
+            for tx in range(max(0, int(left // ts)), min(cols, int((right - 1) // ts) + 1)):
+                yield tx, ty
+
+    def _cancel_stale(self, wanted):
+        keep = set(wanted)
+        for key, future in list(self._pending.items()):
+            if key not in keep and future.cancel():
+                del self._pending[key]
+                self.cancelled += 1
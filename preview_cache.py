@@ -0,0 +1,134 @@
+import hashlib
+import os
+import platform
+import tempfile
+import threading
+
+from PIL import Image
+
+
+def default_cache_dir():
+    """Per-user cache folder following each platform's convention"""
+    override = os.environ.get("SLICER_CACHE_DIR")
+    if override:
+        return override
+    system = platform.system()
+    if system == "Windows":
+        base = os.environ.get("LOCALAPPDATA", os.path.expanduser("~"))
+        return os.path.join(base, "SlicerLab", "cache")
+    if system == "Darwin":
+        return os.path.expanduser("~/Library/Caches/SlicerLab")
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return os.path.join(base, "slicer_lab")
+
+
+class PreviewCache:
+    """On-disk store of downscaled pyramid levels, keyed by source file identity.
+
+    The key combines the absolute path, size and modification time of the
+    source, so an edited or replaced file never reuses stale levels. Levels are
+    stored as uncompressed TIFF (fast to read, supports every session mode) and
+    the least recently used files are evicted once `max_bytes` is exceeded.
+    """
+
+    # Finer levels are cheap to rebuild from these and would bloat the cache
+    MAX_LEVEL_PIXELS = 2048 * 2048
+
+    def __init__(self, directory=None, max_bytes=1024 * 1024 * 1024):
+        self.directory = directory or default_cache_dir()
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._used_bytes = None
+
+    @staticmethod
+    def source_key(path):
+        st = os.stat(path)
+        identity = f"{os.path.abspath(path)}|{st.st_size}|{st.st_mtime_ns}"
+        return hashlib.sha1(identity.encode("utf-8")).hexdigest()
+
+    def _level_path(self, key, level):
+        return os.path.join(self.directory, f"{key}_L{level}.tiff")
+
+    def load(self, key, level, size):
+        """Return the cached level, or None if it is missing or has the wrong size"""
+        path = self._level_path(key, level)
+        try:
+            with Image.open(path) as cached:
+                if cached.size != size:
+                    return None
+                cached.load()
+                image = cached.copy()
+            os.utime(path)  # mark as recently used
+            return image
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key, level, image):
+        if image.width * image.height > self.MAX_LEVEL_PIXELS:
+            return
+        target = self._level_path(key, level)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, format="TIFF")
+            # Readers never see a partially written level
+            os.replace(tmp, target)
+        except (OSError, ValueError):
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        self._account(os.path.getsize(target))
+
+    def _account(self, added):
+        with self._lock:
+            if self._used_bytes is None:
+                self._used_bytes = sum(size for _, size, _ in self._entries())
+            else:
+                self._used_bytes += added
+            if self._used_bytes > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            if not name.endswith(".tiff"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _evict(self):
+        """Delete least recently used levels until the cache fits its budget"""
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        self._used_bytes = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._used_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._used_bytes -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            for path, _, _ in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._used_bytes = 0
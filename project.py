@@ -0,0 +1,240 @@
+import json
+import os
+import platform
+import shutil
+import tempfile
+import textwrap
+import uuid
+
+import project_container
+from selection import CellSelection
+
+# 2.3: large selections are stored as a compressed bitmap (see CellSelection.encode)
+PROJECT_VERSION = "2.3"
+# Append-only log of changes made since the project file was last written (see autosave.py)
+JOURNAL_SUFFIX = ".journal"
+
+
+def journal_path(path):
+    return path + JOURNAL_SUFFIX
+
+
+def read_project(path, lazy=True):
+    """Project data from a JSON .lab or a binary container (detected by its magic bytes).
+
+    Container images are LazyEntry mappings that read their selection on
+    demand; pass lazy=False to get plain dicts for both formats.
+    """
+    if project_container.is_container(path):
+        return project_container.read(path) if lazy else project_container.unpack(path)
+    with open(path, 'r', encoding='utf-8') as file:
+        data = json.load(file)
+    return apply_journal(data, journal_path(path))
+
+
+def write_project(path, sessions, active_index=0, export_format=".png"):
+    """Write a project, as a binary container if the path ends in .labx, else as JSON"""
+    header = project_header(active_index, export_format)
+    if project_container.is_container_path(path):
+        images = [session_snapshot(session) for session in sessions]
+        atomic_write(path, project_container.pack(dict(header, images=images)))
+    else:
+        entries = [dumps_entry(session_to_dict(session)) for session in sessions]
+        atomic_write(path, dumps_project(header, entries))
+    remove_journal(path)
+
+
+def convert_project(source, target):
+    """Rewrite a project in the format implied by the target extension, keeping every key"""
+    data = read_project(source, lazy=False)
+    if project_container.is_container_path(target):
+        atomic_write(target, project_container.pack(data))
+    else:
+        atomic_write(target, json.dumps(data, indent=4))
+
+
+def project_header(active_index=0, export_format=".png"):
+    """Top-level project fields; `save_id` ties a journal to the file it extends"""
+    return {
+        "version": PROJECT_VERSION,
+        "platform": platform.system(),
+        "save_id": uuid.uuid4().hex,
+        "active_index": active_index,
+        "export_format": export_format
+    }
+
+
+def dumps_entry(entry):
+    return json.dumps(entry, indent=4)
+
+
+def dumps_project(header, entry_texts):
+    """Project JSON from a header and already serialized image entries.
+
+    The output is identical to json.dump(..., indent=4) of the whole project,
+    but unchanged entries can be serialized once and reused between saves.
+    """
+    text = json.dumps(dict(header, images=[]), indent=4)
+    head = text[:text.rindex("[]")]
+    if not entry_texts:
+        return head + "[]\n}"
+    body = ",\n".join(textwrap.indent(entry, " " * 8) for entry in entry_texts)
+    return head + "[\n" + body + "\n    ]\n}"
+
+
+def atomic_write(path, content):
+    """Replace `path` with `content` (str or bytes) so readers never see a partial file"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(prefix=".~" + os.path.basename(path), suffix=".tmp", dir=directory)
+    try:
+        if isinstance(content, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding='utf-8')
+        with f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            shutil.copymode(path, tmp)
+        except OSError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    fsync_directory(directory)
+
+
+def fsync_directory(directory):
+    """Persist a rename on POSIX filesystems (directories cannot be opened on Windows)"""
+    if os.name != "posix":
+        return
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_journal(path):
+    try:
+        os.remove(journal_path(path))
+    except FileNotFoundError:
+        pass
+
+
+def apply_journal(data, path):
+    """Replay journal records written after the project file (ignored if it belongs to another save)"""
+    if not isinstance(data, dict) or not os.path.exists(path):
+        return data
+    with open(path, 'r', encoding='utf-8') as file:
+        lines = file.read().split("\n")
+    try:
+        start = json.loads(lines[0])
+    except ValueError:
+        return data
+    if not data.get("save_id") or start.get("save_id") != data.get("save_id"):
+        return data
+
+    images = image_entries(data)
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            break  # a save interrupted mid-append; everything before it is complete
+        if "index" in record:
+            images[record["index"]] = record["entry"]
+        for key in ("active_index", "export_format"):
+            if key in record:
+                data[key] = record[key]
+    return data
+
+
+def image_entries(data):
+    """Per-image sections of a project, accepting legacy layouts and key names"""
+    if isinstance(data, list):
+        return data
+    return data.get("images", data.get("imagens", []))
+
+
+def active_index(data):
+    if isinstance(data, list):
+        return 0
+    return data.get("active_index", data.get("indice_ativo", 0))
+
+
+def export_format(data):
+    if isinstance(data, list):
+        return ".png"
+    return data.get("export_format", ".png")
+
+
+def resolve_image_path(img_data, project_path):
+    """Path of an image entry, falling back to the project folder if it was moved"""
+    path = img_data.get("path", img_data.get("caminho"))
+    if not path:
+        return None
+    if not os.path.exists(path):
+        alternative = os.path.join(os.path.dirname(project_path), os.path.basename(path))
+        if os.path.exists(alternative):
+            path = alternative
+    return path if os.path.exists(path) else None
+
+
+def apply_session_data(session, img_data):
+    """Restore grid, camera and selection of a session from its project entry"""
+    session.grid_w = img_data.get("grid_w", img_data.get("gw", 1000))
+    session.grid_h = img_data.get("grid_h", img_data.get("gh", 1000))
+    session.grid_color = img_data.get("grid_color", img_data.get("color", "#FFFF00"))
+    session.zoom_level = img_data.get("zoom_level", 1.0)
+    session.camera_x = img_data.get("camera_x", 0)
+    session.camera_y = img_data.get("camera_y", 0)
+
+    if isinstance(img_data, project_container.LazyEntry):
+        # Decompressed when the session first touches its selection
+        session.defer_selection(img_data)
+        return
+    sel_raw = img_data.get("selection", img_data.get("selecao", img_data.get("sel", [])))
+    session.selected_cells = CellSelection.decode(sel_raw)
+
+
+def session_snapshot(session):
+    """Copy of a session's saved state that stays valid while the session keeps changing.
+
+    A selection that was never read from its container is carried as its
+    compressed chunk (a StoredSelection), so saving does not decode it.
+    """
+    selection = session.deferred_selection
+    if selection is not None:
+        selection = selection.stored_selection()
+        # The save may replace the file the chunk came from
+        session.defer_selection(selection)
+    else:
+        selection = session.selected_cells.copy()
+    return {
+        "path": session.path,
+        "grid_w": session.grid_w,
+        "grid_h": session.grid_h,
+        "grid_color": session.grid_color,
+        "zoom_level": session.zoom_level,
+        "camera_x": session.camera_x,
+        "camera_y": session.camera_y,
+        "selection": selection
+    }
+
+
+def snapshot_to_dict(snapshot):
+    return dict(snapshot, selection=snapshot["selection"].encode())
+
+
+def session_to_dict(session):
+    return snapshot_to_dict(session_snapshot(session))
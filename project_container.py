@@ -0,0 +1,198 @@
+"""Binary project container (.labx).
+
+    header   magic, container version, index offset and length (HEADER struct)
+    chunks   one zlib-compressed selection bitmap per image (see CellSelection.to_bytes)
+    index    UTF-8 JSON: every project field except the selections, plus the
+             offset, length and grid of each image's selection chunk
+
+Opening a project only parses the small index; selections are decompressed
+when a session first uses them. The index keeps the original key names and
+order (including legacy ones such as `imagens`, `caminho` and `selecao`), so
+converting JSON -> container -> JSON gives back the same project.
+"""
+import json
+import os
+import struct
+import zlib
+from collections.abc import Mapping
+
+from selection import CellSelection
+
+MAGIC = b"SLABPACK"
+CONTAINER_VERSION = 1
+EXTENSION = ".labx"
+HEADER = struct.Struct("<8sHHQQ")  # magic, version, flags, index offset, index length
+
+IMAGE_KEYS = ("images", "imagens")
+SELECTION_KEYS = ("selection", "selecao", "sel")
+
+
+def is_container_path(path):
+    return path.lower().endswith(EXTENSION)
+
+
+def is_container(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+def _split_entry(entry):
+    """Entry without its selection value, the selection key and the selection itself"""
+    key = next((k for k in SELECTION_KEYS if k in entry), None)
+    if key is None:
+        return dict(entry), None, None
+    fields = dict(entry)
+    raw = fields[key]
+    fields[key] = None  # placeholder keeps the key order
+    return fields, key, raw
+
+
+def pack(data):
+    """Container bytes for project data as read from JSON (any layout) or built from sessions"""
+    if isinstance(data, list):
+        project, images_key, entries = {}, None, data
+    else:
+        images_key = next((k for k in IMAGE_KEYS if k in data), "images")
+        project = dict(data)
+        entries = project.get(images_key, [])
+        project[images_key] = None
+
+    chunks = []
+    offset = HEADER.size
+    index_entries = []
+    for entry in entries:
+        fields, key, raw = _split_entry(entry)
+        item = {"entry": fields, "selection_key": key}
+        if isinstance(raw, StoredSelection):
+            # Never decoded since it was read: copy the chunk as it is
+            chunk = raw.chunk
+            item.update(form=raw.form, cols=raw.cols, rows=raw.rows, count=raw.count, offset=offset,
+                        length=len(chunk))
+            chunks.append(chunk)
+            offset += len(chunk)
+        elif key is not None:
+            # Pair lists stay pair lists when written back to JSON
+            form = "pairs" if isinstance(raw, list) else "auto"
+            selection = CellSelection.decode(raw)
+            cols, rows = selection.bounds()
+            chunk = zlib.compress(selection.to_bytes(cols, rows))
+            item.update(form=form, cols=cols, rows=rows, count=len(selection), offset=offset, length=len(chunk))
+            chunks.append(chunk)
+            offset += len(chunk)
+        index_entries.append(item)
+
+    index = json.dumps({"project": project, "images_key": images_key, "images": index_entries},
+                       separators=(",", ":")).encode("utf-8")
+    header = HEADER.pack(MAGIC, CONTAINER_VERSION, 0, offset, len(index))
+    return b"".join([header] + chunks + [index])
+
+
+class StoredSelection:
+    """A selection chunk as stored in a container; decompressed only when it is used"""
+
+    __slots__ = ("chunk", "cols", "rows", "count", "form")
+
+    def __init__(self, chunk, cols, rows, count, form="auto"):
+        self.chunk = chunk
+        self.cols = cols
+        self.rows = rows
+        self.count = count
+        self.form = form
+
+    def stored_selection(self):
+        return self
+
+    def load_selection(self):
+        return CellSelection.from_bytes(zlib.decompress(self.chunk), self.cols, self.rows)
+
+    def encode(self):
+        return self.load_selection().encode()
+
+
+class LazyEntry(Mapping):
+    """Image entry of a container whose selection is read from disk on first access"""
+
+    def __init__(self, path, identity, item):
+        self._path = path
+        self._identity = identity
+        self._item = item
+        self._fields = item["entry"]
+        self.selection_key = item.get("selection_key")
+
+    def __getitem__(self, key):
+        if key == self.selection_key:
+            return self.load_selection()
+        return self._fields[key]
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def load_selection(self):
+        if self.selection_key is None:
+            return CellSelection()
+        return self.stored_selection().load_selection()
+
+    def stored_selection(self):
+        """The compressed selection chunk, read from disk without decompressing it"""
+        item = self._item
+        if self.selection_key is None:
+            return StoredSelection(zlib.compress(b""), 0, 0, 0)
+        with open(self._path, 'rb') as f:
+            if _identity(f) != self._identity:
+                raise OSError(f"{self._path} changed on disk since it was opened")
+            f.seek(item["offset"])
+            chunk = f.read(item["length"])
+        return StoredSelection(chunk, item["cols"], item["rows"], item.get("count", 0), item.get("form", "auto"))
+
+    def to_dict(self):
+        """Plain JSON entry, with the selection in the form it was saved in"""
+        entry = dict(self._fields)
+        if self.selection_key is not None:
+            selection = self.load_selection()
+            if self._item.get("form") == "pairs":
+                entry[self.selection_key] = [[c, r] for c, r in selection]
+            else:
+                entry[self.selection_key] = selection.encode()
+        return entry
+
+
+def _identity(f):
+    st = os.fstat(f.fileno())
+    return st.st_size, st.st_mtime_ns
+
+
+def read(path):
+    """Project data with LazyEntry images; only the header and index are read"""
+    with open(path, 'rb') as f:
+        magic, version, _, index_offset, index_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a Slicer Lab project container")
+        if version > CONTAINER_VERSION:
+            raise ValueError(f"{path} was written by a newer version (container v{version})")
+        identity = _identity(f)
+        f.seek(index_offset)
+        index = json.loads(f.read(index_length).decode("utf-8"))
+
+    entries = [LazyEntry(path, identity, item) for item in index["images"]]
+    if index["images_key"] is None:
+        return entries
+    data = index["project"]
+    data[index["images_key"]] = entries
+    return data
+
+
+def unpack(path):
+    """Fully materialized project data, equal to the JSON the container was made from"""
+    data = read(path)
+    if isinstance(data, list):
+        return [entry.to_dict() for entry in data]
+    for key in IMAGE_KEYS:
+        if key in data:
+            data[key] = [entry.to_dict() for entry in data[key]]
+    return data
@@ -0,0 +1,171 @@
+import ast
+import mmap
+import os
+import struct
+import tempfile
+
+from PIL import Image
+
+from dataset import array_layout, npy_header
+from preview_cache import PreviewCache, default_cache_dir
+
+_MAGIC = b"\x93NUMPY"
+
+
+def default_store_dir():
+    return os.path.join(default_cache_dir(), "raw")
+
+
+def store_path(source, directory=None):
+    """<directory>/<source key>.npy; the key changes whenever the source file does"""
+    return os.path.join(directory or default_store_dir(), PreviewCache.source_key(source) + ".npy")
+
+
+def _read_header(f):
+    """(header dict, data offset) of a version 1.0 .npy file"""
+    prefix = f.read(10)
+    if len(prefix) != 10 or prefix[:6] != _MAGIC or prefix[6] != 1:
+        raise ValueError("not a version 1.0 .npy file")
+    (length,) = struct.unpack("<H", prefix[8:10])
+    header = ast.literal_eval(f.read(length).decode("latin1"))
+    if not isinstance(header, dict):
+        raise ValueError("malformed .npy header")
+    return header, 10 + length
+
+
+class RawStore:
+    """Uncompressed, row-major copy of a source image in a memory-mapped file.
+
+    The source is converted once (build()) into a .npy array of shape
+    (height, width, channels) under the cache folder, keyed by the source's
+    path, size and mtime. Afterwards every crop is a strided read of the map:
+    only the pages under the box are touched, nothing is decoded, and every
+    process that opens the same store shares one copy of the pixels in the OS
+    page cache. numpy users can open it with numpy.load(path, mmap_mode="r").
+
+    read() takes no lock, so export workers and the viewport can crop it
+    concurrently. Modes that Pillow cannot store as plain samples (P, PA, 1)
+    are not supported.
+    """
+
+    # Rows converted per band while building
+    BUILD_BAND_BYTES = 64 * 1024 * 1024
+
+    def __init__(self, path, mode, size):
+        stored, descr, channels, pixel = array_layout(mode)
+        if stored != mode:
+            raise ValueError(f"mode {mode} cannot be stored raw")
+        self.path = path
+        self.mode = mode
+        self.size = size
+        self.pixel = pixel
+        self.stride = size[0] * pixel
+        with open(path, "rb") as f:
+            header, self.offset = _read_header(f)
+            if (header.get("descr") != descr or header.get("fortran_order")
+                    or tuple(header.get("shape", ())) != (size[1], size[0], channels)):
+                raise ValueError(f"{path} does not match a {mode} {size[0]}x{size[1]} source")
+            if os.fstat(f.fileno()).st_size != self.offset + self.stride * size[1]:
+                raise ValueError(f"{path} is truncated")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    @staticmethod
+    def supports(mode):
+        """True when pixels of `mode` round-trip through the store unchanged (not P, PA or 1)"""
+        return array_layout(mode)[0] == mode
+
+    @property
+    def nbytes(self):
+        return self.stride * self.size[1]
+
+    @classmethod
+    def open(cls, source, mode, size, directory=None):
+        """The store already built for `source`, or None"""
+        path = store_path(source, directory)
+        try:
+            store = cls(path, mode, size)
+        except (OSError, ValueError, SyntaxError):
+            return None
+        try:
+            os.utime(path)  # mark as recently used for prune()
+        except OSError:
+            pass
+        return store
+
+    @classmethod
+    def build(cls, session, directory=None, max_bytes=None):
+        """Convert the session's source into a store and open it.
+
+        Rows are copied band by band through session.region_reader(), so
+        streaming sources never hold more than one band; compressed ones are
+        decoded once. Older stores are pruned to fit `max_bytes` first.
+        """
+        directory = directory or default_store_dir()
+        mode, size = session.image_mode, (session.real_width, session.real_height)
+        if not cls.supports(mode):
+            raise ValueError(f"mode {mode} cannot be stored raw")
+        _, descr, channels, pixel = array_layout(mode)
+        target = store_path(session.path, directory)
+        os.makedirs(directory, exist_ok=True)
+        if max_bytes is not None:
+            prune(directory, max_bytes - size[0] * size[1] * pixel, keep=(target,))
+
+        fd, tmp = tempfile.mkstemp(suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(npy_header(descr, (size[1], size[0], channels)))
+                rows = max(1, cls.BUILD_BAND_BYTES // (size[0] * pixel))
+                with session.region_reader() as reader:
+                    for top in range(0, size[1], rows):
+                        band = reader.read((0, top, size[0], min(top + rows, size[1])))
+                        f.write(band.tobytes())
+            # Other processes never open a partially written store
+            os.replace(tmp, target)
+        except BaseException:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            raise
+        return cls(target, mode, size)
+
+    def read(self, box):
+        """The (left, upper, right, lower) box as a new image; only those rows are paged in"""
+        x0, y0, x1, y1 = box
+        if x1 <= x0 or y1 <= y0:
+            return Image.new(self.mode, (max(0, x1 - x0), max(0, y1 - y0)))
+        start = self.offset + y0 * self.stride + x0 * self.pixel
+        end = self.offset + (y1 - 1) * self.stride + x1 * self.pixel
+        return Image.frombytes(self.mode, (x1 - x0, y1 - y0), self._view[start:end], "raw", self.mode, self.stride)
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+
+
+def prune(directory, max_bytes, keep=()):
+    """Delete least recently used stores until the folder holds at most `max_bytes`"""
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return
+    for name in names:
+        path = os.path.join(directory, name)
+        if not name.endswith(".npy") or path in keep:
+            continue
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, path, st.st_size))
+    used = sum(size for _, _, size in entries)
+    for _, path, size in sorted(entries):
+        if used <= max_bytes:
+            break
+        try:
+            os.remove(path)  # processes that still map it keep their pages
+            used -= size
+        except OSError:
+            pass
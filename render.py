@@ -0,0 +1,236 @@
+import math
+from collections import OrderedDict
+
+from PIL import Image, ImageColor, ImageFilter
+
+from instrumentation import Profiler
+
+BACKGROUND = (20, 20, 20)
+SELECTION_COLOR = (0, 255, 255)
+SELECTION_FILL_ALPHA = 90
+# Grid and selections are only drawn while fewer columns than this are visible
+GRID_MAX_COLUMNS = 400
+# Dashed grid lines: pixels on, pixels off
+GRID_DASH = (2, 4)
+
+
+def viewport_origin(session):
+    """Integer screen-space position of the top-left canvas pixel for a session"""
+    z = session.zoom_level
+    return int(math.floor(session.camera_x * z)), int(math.floor(session.camera_y * z))
+
+
+def choose_level(session):
+    """(wanted, drawable) pyramid levels for the session's current zoom.
+
+    `wanted` is the ideal level; `drawable` is the finest level at or coarser
+    than it that is already in memory (None if there is none yet), so a frame
+    never has to wait for decoding.
+    """
+    wanted = session.level_for_zoom(session.zoom_level)
+    return wanted, session.ready_level(wanted)
+
+
+class TileCache:
+    """LRU cache of rendered screen tiles bounded by a memory budget in bytes"""
+
+    def __init__(self, budget_bytes=256 * 1024 * 1024):
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._tiles = OrderedDict()
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def __contains__(self, key):
+        """Membership test that does not count as a hit or miss"""
+        return key in self._tiles
+
+    @staticmethod
+    def _tile_bytes(tile):
+        # Pillow stores RGB pixels in 4 bytes
+        return tile.width * tile.height * 4
+
+    def get(self, key):
+        tile = self._tiles.get(key)
+        if tile is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return tile
+
+    def put(self, key, tile):
+        old = self._tiles.pop(key, None)
+        if old is not None:
+            self.used_bytes -= self._tile_bytes(old)
+        self._tiles[key] = tile
+        self.used_bytes += self._tile_bytes(tile)
+        while self.used_bytes > self.budget_bytes and len(self._tiles) > 1:
+            _, evicted = self._tiles.popitem(last=False)
+            self.used_bytes -= self._tile_bytes(evicted)
+
+    def clear(self):
+        self._tiles.clear()
+        self.used_bytes = 0
+
+
+class ViewportRenderer:
+    """Composes the visible part of a session from fixed-size screen tiles.
+
+    Tiles live on a screen-space grid anchored at the image origin and are keyed
+    by (session, pyramid level, zoom, tile x, tile y). Panning therefore only
+    renders the tiles of the newly exposed strip; everything else is a cache hit.
+    """
+
+    TILE_SIZE = 256
+
+    def __init__(self, cache=None, tile_size=TILE_SIZE, profiler=None):
+        self.cache = cache if cache is not None else TileCache()
+        self.tile_size = tile_size
+        # Records "tiles", "resample" and "overlays" stages when enabled
+        self.profiler = profiler if profiler is not None else Profiler()
+
+    def render(self, session, width, height, level=None, overlays=True):
+        """Return an RGB frame of the given size for the session's current camera.
+
+        `level` overrides the pyramid level picked for the zoom, e.g. to draw from
+        a coarser level that is already built while the ideal one is loading.
+        Grid lines and selections are alpha-composited into the frame unless
+        `overlays` is False.
+        """
+        frame = Image.new("RGB", (width, height), BACKGROUND)
+        z = session.zoom_level
+        if level is None:
+            level = session.level_for_zoom(z)
+        ox, oy = viewport_origin(session)
+        ts = self.tile_size
+        profiler = self.profiler
+
+        with profiler.stage("tiles"):
+            for ty in range(oy // ts, (oy + height - 1) // ts + 1):
+                for tx in range(ox // ts, (ox + width - 1) // ts + 1):
+                    key = (session, level, z, tx, ty)
+                    tile = self.cache.get(key)
+                    if tile is None:
+                        with profiler.stage("resample"):
+                            tile = self.render_tile(session, level, tx, ty)
+                        if tile is None:
+                            continue
+                        self.cache.put(key, tile)
+                    frame.paste(tile, (tx * ts - ox, ty * ts - oy))
+        if overlays:
+            with profiler.stage("overlays"):
+                self._composite_overlays(frame, session, ox, oy)
+        return frame
+
+    def render_tile(self, session, level, tx, ty, zoom=None):
+        """Resample one screen tile from a pyramid level, or None if it lies outside the image.
+
+        `zoom` defaults to the session's; the tile is not cached, so it can be
+        rendered on another thread (see prefetch.py).
+        """
+        z = session.zoom_level if zoom is None else zoom
+        ts = self.tile_size
+        scale = 2 ** level
+
+        # World-space rectangle covered by the tile, clipped to the image
+        l = max(0.0, tx * ts / z)
+        t = max(0.0, ty * ts / z)
+        r = min(float(session.real_width), (tx + 1) * ts / z)
+        b = min(float(session.real_height), (ty + 1) * ts / z)
+        if r <= l or b <= t:
+            return None
+
+        px = int(round(l * z)) - tx * ts
+        py = int(round(t * z)) - ty * ts
+        pw = int(round(r * z)) - tx * ts - px
+        ph = int(round(b * z)) - ty * ts - py
+        if pw <= 0 or ph <= 0:
+            return None
+
+        if z * scale >= 1.0:
+            resample = Image.Resampling.NEAREST
+        else:
+            resample = Image.Resampling.BILINEAR
+        source, box = session.level_view(level, (l / scale, t / scale, r / scale, b / scale))
+        view = source.resize((pw, ph), resample, box=box)
+
+        tile = Image.new("RGB", (ts, ts), BACKGROUND)
+        tile.paste(view, (px, py))
+        return tile
+
+    def _composite_overlays(self, frame, session, ox, oy):
+        """Blend selection highlights and dashed grid lines into the frame.
+
+        Selections are rasterised as a one-byte-per-cell mask scaled to the screen
+        and grid lines are pasted as precomputed dash strips, so the cost depends
+        on the frame size rather than on the number of selected cells.
+        """
+        z = session.zoom_level
+        width, height = frame.size
+        gw, gh = session.grid_w, session.grid_h
+        l, t = ox / z, oy / z
+        r, b = l + width / z, t + height / z
+        if (r - l) / gw >= GRID_MAX_COLUMNS:
+            return
+
+        sc, ec = int(l // gw), int(r // gw)
+        sr, er = int(t // gh), int(b // gh)
+        visible = list(session.selected_cells.cells_in_range(sc, sr, ec, er))
+        if visible:
+            self._composite_selection(frame, visible, (sc, sr, ec, er), (l, t, r, b), gw, gh)
+
+        color = ImageColor.getrgb(session.grid_color)[:3]
+        on, off = GRID_DASH
+        dash_v = Image.frombytes("L", (1, height), bytes(255 if y % (on + off) < on else 0 for y in range(height)))
+        dash_h = Image.frombytes("L", (width, 1), bytes(255 if x % (on + off) < on else 0 for x in range(width)))
+        for n in range(math.ceil(l / gw), ec + 1):
+            x = int((n * gw - l) * z)
+            if 0 <= x < width:
+                frame.paste(color, (x, 0, x + 1, height), dash_v)
+        for n in range(math.ceil(t / gh), er + 1):
+            y = int((n * gh - t) * z)
+            if 0 <= y < height:
+                frame.paste(color, (0, y, width, y + 1), dash_h)
+
+    @staticmethod
+    def _composite_selection(frame, visible, cell_range, world_box, gw, gh):
+        sc, sr, ec, er = cell_range
+        l, t, r, b = world_box
+        cols, rows = ec - sc + 1, er - sr + 1
+
+        # One byte per visible cell; alternating values keep borders between neighbours
+        cells = bytearray(cols * rows)
+        for c, ro in visible:
+            cells[(ro - sr) * cols + (c - sc)] = 255 if (c + ro) % 2 else 128
+        mask = Image.frombytes("L", (cols, rows), bytes(cells))
+        # Screen pixels sample the cell grid through the visible world box
+        cell_box = (l / gw - sc, t / gh - sr, r / gw - sc, b / gh - sr)
+        mask = mask.resize(frame.size, Image.Resampling.NEAREST, box=cell_box)
+
+        # Only touch the part of the frame that contains selected cells
+        bbox = mask.getbbox()
+        if not bbox:
+            return
+        x0, y0, x1, y1 = bbox
+        x0, y0 = max(0, x0 - 1), max(0, y0 - 1)
+        x1, y1 = min(frame.width, x1 + 1), min(frame.height, y1 + 1)
+        mask = mask.crop((x0, y0, x1, y1))
+
+        fill = mask.point(lambda v: SELECTION_FILL_ALPHA if v else 0)
+        frame.paste(SELECTION_COLOR, (x0, y0, x1, y1), fill)
+        border = mask.filter(ImageFilter.FIND_EDGES).point(lambda v: 255 if v else 0)
+        # Filters pass edge pixels through unchanged; cells cut by the frame get no border there
+        w, h = border.size
+        if x0 == 0:
+            border.paste(0, (0, 0, 1, h))
+        if y0 == 0:
+            border.paste(0, (0, 0, w, 1))
+        if x1 == frame.width:
+            border.paste(0, (w - 1, 0, w, h))
+        if y1 == frame.height:
+            border.paste(0, (0, h - 1, w, h))
+        frame.paste(SELECTION_COLOR, (x0, y0, x1, y1), border)
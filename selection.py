@@ -0,0 +1,203 @@
+import base64
+import zlib
+
+
+def _popcount(bits):
+    return bin(bits).count("1")
+
+
+def _set_bits(bits):
+    """Indices of the set bits of a non-negative int, lowest first"""
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+class CellSelection:
+    """Set of selected (col, row) grid cells stored as one bitmask per row.
+
+    Behaves like the set of tuples it replaces (add/remove/in/len/iteration),
+    but costs one bit per cell, answers range queries in time proportional to
+    the rows in range, and does set algebra a whole row at a time.
+    """
+
+    # Selections up to this size are written as a plain list of [col, row] pairs
+    INLINE_LIMIT = 256
+    ENCODING = "rowbits-zlib"
+
+    def __init__(self, cells=()):
+        self._rows = {}
+        self._count = 0
+        self.update(cells)
+
+    # --- set protocol ---
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __contains__(self, cell):
+        c, r = cell
+        return c >= 0 and (self._rows.get(r, 0) >> c) & 1 == 1
+
+    def __iter__(self):
+        """Cells in row-major order"""
+        for r in sorted(self._rows):
+            for c in _set_bits(self._rows[r]):
+                yield (c, r)
+
+    def __eq__(self, other):
+        if isinstance(other, CellSelection):
+            return self._rows == other._rows
+        return NotImplemented
+
+    def __repr__(self):
+        return f"CellSelection({len(self)} cells)"
+
+    def add(self, cell):
+        c, r = self._check(cell)
+        bits = self._rows.get(r, 0)
+        if not (bits >> c) & 1:
+            self._rows[r] = bits | (1 << c)
+            self._count += 1
+
+    def discard(self, cell):
+        c, r = cell
+        bits = self._rows.get(r, 0)
+        if c >= 0 and (bits >> c) & 1:
+            bits &= ~(1 << c)
+            if bits:
+                self._rows[r] = bits
+            else:
+                del self._rows[r]
+            self._count -= 1
+
+    def remove(self, cell):
+        if cell not in self:
+            raise KeyError(cell)
+        self.discard(cell)
+
+    def toggle(self, cell):
+        if cell in self:
+            self.discard(cell)
+        else:
+            self.add(cell)
+
+    def update(self, cells):
+        for cell in cells:
+            self.add(cell)
+
+    def clear(self):
+        self._rows.clear()
+        self._count = 0
+
+    def copy(self):
+        return self._from_rows(dict(self._rows))
+
+    def __or__(self, other):
+        rows = dict(self._rows)
+        for r, bits in other._rows.items():
+            rows[r] = rows.get(r, 0) | bits
+        return self._from_rows(rows)
+
+    def __and__(self, other):
+        rows = {}
+        for r, bits in self._rows.items():
+            both = bits & other._rows.get(r, 0)
+            if both:
+                rows[r] = both
+        return self._from_rows(rows)
+
+    def __sub__(self, other):
+        rows = {}
+        for r, bits in self._rows.items():
+            left = bits & ~other._rows.get(r, 0)
+            if left:
+                rows[r] = left
+        return self._from_rows(rows)
+
+    # --- range queries ---
+    def cells_in_range(self, sc, sr, ec, er):
+        """Selected cells with sc <= col <= ec and sr <= row <= er"""
+        sc = max(0, sc)
+        if ec < sc:
+            return
+        window = (1 << (ec - sc + 1)) - 1
+        if er - sr + 1 < len(self._rows):
+            rows = (r for r in range(sr, er + 1) if r in self._rows)
+        else:
+            rows = sorted(r for r in self._rows if sr <= r <= er)
+        for r in rows:
+            bits = (self._rows[r] >> sc) & window
+            for c in _set_bits(bits):
+                yield (sc + c, r)
+
+    def row_bits(self, row):
+        """Bitmask of the selected columns of one row (bit n = column n)"""
+        return self._rows.get(row, 0)
+
+    def bounds(self):
+        """(cols, rows) of the smallest grid anchored at (0, 0) that holds every selected cell"""
+        if not self._rows:
+            return 0, 0
+        return max(bits.bit_length() for bits in self._rows.values()), max(self._rows) + 1
+
+    # --- serialization ---
+    def encode(self):
+        """JSON-ready form: a list of pairs when small, else a compressed bitmap"""
+        if self._count <= self.INLINE_LIMIT:
+            return [[c, r] for c, r in self]
+        cols, rows = self.bounds()
+        return {
+            "encoding": self.ENCODING,
+            "cols": cols,
+            "rows": rows,
+            "data": base64.b64encode(zlib.compress(self.to_bytes(cols, rows))).decode("ascii")
+        }
+
+    @classmethod
+    def decode(cls, raw):
+        """Inverse of encode(); also accepts the legacy list of [col, row] pairs"""
+        if isinstance(raw, CellSelection):
+            return raw
+        if isinstance(raw, dict):
+            if raw.get("encoding") != cls.ENCODING:
+                raise ValueError(f"Unknown selection encoding: {raw.get('encoding')}")
+            data = zlib.decompress(base64.b64decode(raw["data"]))
+            return cls.from_bytes(data, raw["cols"], raw["rows"])
+        return cls(tuple(x) for x in raw)
+
+    def to_bytes(self, cols, rows):
+        """Dense row-major bitmap, ceil(cols / 8) bytes per row, LSB = lowest column"""
+        stride = (cols + 7) // 8
+        out = bytearray(stride * rows)
+        for r, bits in self._rows.items():
+            if r < rows:
+                out[r * stride:(r + 1) * stride] = (bits & ((1 << cols) - 1)).to_bytes(stride, "little")
+        return bytes(out)
+
+    @classmethod
+    def from_bytes(cls, data, cols, rows):
+        stride = (cols + 7) // 8
+        result = {}
+        for r in range(rows):
+            bits = int.from_bytes(data[r * stride:(r + 1) * stride], "little")
+            if bits:
+                result[r] = bits
+        return cls._from_rows(result)
+
+    @classmethod
+    def _from_rows(cls, rows):
+        selection = cls()
+        selection._rows = rows
+        selection._count = sum(_popcount(bits) for bits in rows.values())
+        return selection
+
+    @staticmethod
+    def _check(cell):
+        c, r = int(cell[0]), int(cell[1])
+        if c < 0 or r < 0:
+            raise ValueError(f"Cell coordinates must be non-negative: {cell}")
+        return c, r
@@ -0,0 +1,313 @@
+import math
+import os
+import threading
+
+from PIL import Image
+
+from selection import CellSelection
+from raw_store import RawStore
+from sources import RegionReader, is_loaded
+from tiff_pyramid import TiffPyramid
+from tile_stats import TileStats
+
+Image.MAX_IMAGE_PIXELS = None
+
+
+class ImageSession:
+    # Pyramid reduction stops once the longest side fits in this many pixels
+    PYRAMID_MIN_SIZE = 512
+    # Longest side of the level built by load_preview()
+    PREVIEW_MAX_SIZE = 2048
+    # libjpeg can decode directly at 1/2, 1/4 and 1/8 scale
+    JPEG_DRAFT_MAX_LEVEL = 3
+
+    def __init__(self, path, preview_cache=None):
+        self.path = path
+        self.name = os.path.basename(path)
+        
+        # Image.open only reads the header; pixels are decoded on demand
+        self.original_image = Image.open(path)
+        self.real_width, self.real_height = self.original_image.size
+        self.image_mode = self.original_image.mode
+        self.is_jpeg = self.original_image.format == "JPEG"
+        # Tiled or multi-resolution TIFFs are read tile by tile (palette images keep the flat path)
+        self.tiff = None
+        if self.original_image.format == "TIFF" and self.image_mode not in ("P", "PA"):
+            self.tiff = TiffPyramid.open(path, self.image_mode)
+        
+        # pyramid[k] is the image reduced by 2**k (level 0 is the original);
+        # levels are built lazily and stay None until then
+        self.pyramid = [None] * self._count_levels()
+        # Guards decoding and replacing original_image (level 0, RegionReader crops);
+        # each coarser level has its own build lock, so only callers that need it wait
+        self._lock = threading.RLock()
+        self._level_locks = [self._lock] + [threading.Lock() for _ in self.pyramid[1:]]
+        
+        # Optional PreviewCache that persists coarse levels between runs
+        self.preview_cache = preview_cache
+        self._cache_key = None
+        # Optional RawStore serving full-resolution crops (see open_raw_store)
+        self.raw_store = None
+        
+        self.zoom_level = 1.0
+        self.camera_x = 0
+        self.camera_y = 0
+        
+        self.grid_w = 1000
+        self.grid_h = 1000
+        self.grid_color = "#FFFF00"
+        self._selected_cells = CellSelection()
+        self._selection_source = None
+        # Per-cell statistics index (see tile_stats.py), computed on demand
+        self.tile_stats = None
+
+    @property
+    def selected_cells(self):
+        """CellSelection of the session, read on first use when deferred (see defer_selection)"""
+        if self._selection_source is not None:
+            # The source stays in place if it fails, so a later access retries
+            self._selected_cells = self._selection_source.load_selection()
+            self._selection_source = None
+        return self._selected_cells
+
+    @selected_cells.setter
+    def selected_cells(self, cells):
+        self._selection_source = None
+        self._selected_cells = cells
+
+    @property
+    def deferred_selection(self):
+        """The source of a selection that has not been read yet, or None"""
+        return self._selection_source
+
+    def defer_selection(self, source):
+        """Load the selection with `source.load_selection()` only when it is first needed"""
+        self._selection_source = source
+
+    def _count_levels(self):
+        count = 1
+        w, h = self.real_width, self.real_height
+        while max(w, h) > self.PYRAMID_MIN_SIZE:
+            w, h = (w + 1) // 2, (h + 1) // 2
+            count += 1
+        return count
+
+    def level_size(self, level):
+        scale = 2 ** level
+        return (-(-self.real_width // scale), -(-self.real_height // scale))
+
+    def get_level(self, level):
+        """Return pyramid level `level`, decoding or building it first if needed.
+
+        A built level is returned without locking, so drawing never waits for
+        a decode running on another thread.
+        """
+        image = self.pyramid[level]
+        if image is not None:
+            return image
+        with self._level_locks[level]:
+            if self.pyramid[level] is None:
+                self._build_level(level)
+            return self.pyramid[level]
+
+    def ready_level(self, level):
+        """Finest level at or coarser than `level` that can be drawn without a full decode, or None"""
+        for k in range(level, len(self.pyramid)):
+            if self.pyramid[k] is not None or (k == 0 and self.raw_store is not None):
+                return k
+            if self.tiff is not None and self.tiff.page_for(2 ** k) is not None:
+                return k
+        return None
+
+    def level_view(self, level, box):
+        """(image, box within it) to resample the float `box` of a pyramid level from.
+
+        Levels that are not built are never decoded in full: with a raw store,
+        level 0 pixels around the box are read from the map, and a tiled TIFF
+        decodes only the tiles under the box on its best-matching page.
+        """
+        if self.pyramid[level] is None:
+            if level == 0 and self.raw_store is not None:
+                return self._view_of(self.raw_store.read, self.level_size(0), (1.0, 1.0), box)
+            page = self.tiff.page_for(2 ** level) if self.tiff is not None else None
+            if page is not None:
+                width, height = self.tiff.page_size(page)
+                scale = (2 ** level * width / self.real_width, 2 ** level * height / self.real_height)
+                return self._view_of(lambda crop: self.tiff.read(crop, page), (width, height), scale, box)
+        return self.get_level(level), box
+
+    @staticmethod
+    def _view_of(read, size, scale, box):
+        """Read the integer pixels around `box` (scaled by `scale`) and the box relative to them"""
+        l, t, r, b = box[0] * scale[0], box[1] * scale[1], box[2] * scale[0], box[3] * scale[1]
+        x0, y0 = int(l), int(t)
+        x1, y1 = min(size[0], math.ceil(r)), min(size[1], math.ceil(b))
+        return read((x0, y0, x1, y1)), (l - x0, t - y0, r - x0, b - y0)
+
+    def load_preview(self):
+        """Build the levels needed to show the whole image (safe to call from a worker).
+
+        Returns the preview level; release_levels(level) drops the finer ones
+        decoded on the way, for an image that is not on screen.
+        """
+        level = 0
+        while level + 1 < len(self.pyramid) and max(self.level_size(level)) > self.PREVIEW_MAX_SIZE:
+            level += 1
+        self.get_level(level)
+        self.get_level(len(self.pyramid) - 1)
+        return level
+
+    def release_levels(self, finest):
+        """Drop the built levels finer than `finest`, releasing the decoded source with level 0"""
+        with self._lock:
+            for k in range(min(finest, len(self.pyramid))):
+                self.pyramid[k] = None
+            self.release_source()
+
+    def get_tile_stats(self):
+        """Per-cell statistics for the current grid, recomputed when the grid changed"""
+        stats = self.tile_stats
+        if stats is None or not stats.matches(self):
+            stats = self.tile_stats = TileStats.compute(self)
+        return stats
+
+    def release_source(self):
+        """Drop decoded full-resolution pixels (e.g. after an export) unless level 0 is in use"""
+        with self._lock:
+            if self.pyramid[0] is None:
+                self.original_image = Image.open(self.path)
+
+    def region_reader(self):
+        """RegionReader over the source that shares this session's decode lock (never taken for built levels)"""
+        return RegionReader(self.path, self.original_image, lock=self._lock, store=self.raw_store, tiff=self.tiff)
+
+    def open_raw_store(self, directory=None, build=False, max_bytes=None):
+        """Serve full-resolution crops from the raw store of the source, converting it first if `build`.
+
+        Returns the store, or None when there is none (or the mode cannot be
+        stored). Safe to call from a worker; the source decoded for the
+        conversion is released afterwards.
+        """
+        if self.raw_store is None:
+            store = RawStore.open(self.path, self.image_mode, (self.real_width, self.real_height), directory)
+            if store is None and build and RawStore.supports(self.image_mode):
+                was_loaded = is_loaded(self.original_image)
+                store = RawStore.build(self, directory, max_bytes)
+                if not was_loaded:
+                    self.release_source()
+            self.raw_store = store
+        return self.raw_store
+
+    def _build_level(self, level):
+        if level == 0:
+            if self.raw_store is not None and not is_loaded(self.original_image):
+                self.pyramid[0] = self.raw_store.read((0, 0, self.real_width, self.real_height))
+                return
+            self.original_image.load()
+            self.pyramid[0] = self.original_image
+            return
+
+        cached = self._load_cached(level)
+        if cached is not None:
+            self.pyramid[level] = cached
+            return
+
+        page = self.tiff.page_for(2 ** level, max_oversample=2 ** level) if self.tiff is not None else None
+        if page and self.pyramid[0] is None:
+            # Resample the closest finer page stored in the file instead of reducing level 0
+            image = self.tiff.read((0, 0) + self.tiff.page_size(page), page)
+            size = self.level_size(level)
+            if image.size != size:
+                image = image.resize(size, Image.Resampling.BOX)
+            self.pyramid[level] = image
+            self._store_cached(level, image)
+            return
+
+        if self.is_jpeg and level <= self.JPEG_DRAFT_MAX_LEVEL and self.pyramid[0] is None:
+            # DCT-scaled decoding: libjpeg produces the reduced level directly
+            size = self.level_size(level)
+            image = Image.open(self.path)
+            image.draft(image.mode, size)
+            image.load()
+            if image.size != size:
+                image = image.resize(size, Image.Resampling.BOX)
+            self.pyramid[level] = image
+            self._store_cached(level, image)
+            return
+
+        # Reduce from the nearest finer level that exists, is cached or can be drafted
+        finer = level - 1
+        while finer > 0 and self.pyramid[finer] is None:
+            if self.is_jpeg and finer <= self.JPEG_DRAFT_MAX_LEVEL and self.pyramid[0] is None:
+                break
+            cached = self._load_cached(finer)
+            if cached is not None:
+                self.pyramid[finer] = cached
+                break
+            finer -= 1
+        image = self.get_level(finer)
+        for k in range(finer + 1, level + 1):
+            image = self._reduce_half(image)
+            self.pyramid[k] = image
+            self._store_cached(k, image)
+
+    def _load_cached(self, level):
+        if self.preview_cache is None:
+            return None
+        if self._cache_key is None:
+            try:
+                self._cache_key = self.preview_cache.source_key(self.path)
+            except OSError:
+                self.preview_cache = None
+                return None
+        return self.preview_cache.load(self._cache_key, level, self.level_size(level))
+
+    def _store_cached(self, level, image):
+        if self.preview_cache is not None and self._cache_key is not None:
+            self.preview_cache.store(self._cache_key, level, image)
+
+    @staticmethod
+    def _reduce_half(image):
+        """Halve an image with a 2x2 box filter (output size is rounded up)"""
+        if image.mode == "P":
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        elif image.mode == "1":
+            image = image.convert("L")
+        try:
+            return image.reduce(2)
+        except ValueError:
+            # Modes without a native reduce (e.g. I;16) fall back to resize
+            size = ((image.width + 1) // 2, (image.height + 1) // 2)
+            return image.resize(size, Image.Resampling.BOX)
+
+    # --- camera (screen-space deltas, shared by the GUI and headless benchmarks) ---
+    MIN_ZOOM = 0.001
+
+    def pan(self, dx, dy):
+        """Move the camera so the image follows a screen-space drag of (dx, dy) pixels"""
+        self.camera_x -= dx / self.zoom_level
+        self.camera_y -= dy / self.zoom_level
+
+    def zoom_at(self, factor, sx, sy):
+        """Scale the zoom keeping the world point under screen position (sx, sy) fixed"""
+        new_zoom = self.zoom_level * factor
+        if new_zoom < self.MIN_ZOOM:
+            return False
+        wx = self.camera_x + sx / self.zoom_level
+        wy = self.camera_y + sy / self.zoom_level
+        self.zoom_level = new_zoom
+        self.camera_x = wx - sx / new_zoom
+        self.camera_y = wy - sy / new_zoom
+        return True
+
+    def zoom_to_fit(self, width, height, margin=0.9):
+        self.zoom_level = min(width / self.real_width, height / self.real_height) * margin
+        self.camera_x = 0
+        self.camera_y = 0
+
+    def level_for_zoom(self, zoom):
+        """Index of the coarsest pyramid level that still has at least one pixel per screen pixel"""
+        level = 0
+        while level + 1 < len(self.pyramid) and zoom <= 0.5 ** (level + 1):
+            level += 1
+        return level
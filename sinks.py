@@ -0,0 +1,189 @@
+import io
+import os
+import sqlite3
+import tarfile
+import threading
+import time
+import zipfile
+
+# Single-file export targets: (label, extension). Tiles go to one file per tile otherwise.
+CONTAINER_FORMATS = [
+    ("ZIP", ".zip"),
+    ("TAR", ".tar"),
+    ("MBTiles", ".mbtiles"),
+]
+
+
+def container_path(out_dir, base_name, container):
+    """<out_dir>/<image stem><container extension>"""
+    return os.path.join(out_dir, os.path.splitext(base_name)[0] + container)
+
+
+def open_sink(path, container, metadata=None):
+    sinks = {".zip": ZipSink, ".tar": TarSink, ".mbtiles": MBTilesSink}
+    if container not in sinks:
+        raise ValueError(f"unsupported container '{container}'")
+    return sinks[container](path, metadata or {})
+
+
+class TileSink:
+    """Streams encoded tiles into one container file.
+
+    The container is built under <path>.part and renamed over `path` by
+    close(), so readers never see a half-written archive. add() and link()
+    are called from encoder threads; writes are serialized here.
+    """
+
+    def __init__(self, path, metadata):
+        self.path = path
+        self.part_path = path + ".part"
+        self.metadata = metadata
+        self._lock = threading.Lock()
+
+    def add(self, filename, cell, data):
+        raise NotImplementedError
+
+    def link(self, filename, cell, original):
+        """Store `filename` as a reference to the already added `original`; False if the container cannot"""
+        return False
+
+    def close(self):
+        os.replace(self.part_path, self.path)
+
+    def discard(self):
+        try:
+            os.remove(self.part_path)
+        except FileNotFoundError:
+            pass
+
+
+class ZipSink(TileSink):
+    """Uncompressed zip: tiles are already compressed and members stay seekable"""
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        self._zip = zipfile.ZipFile(self.part_path, "w", zipfile.ZIP_STORED, allowZip64=True)
+        self._date_time = time.localtime()[:6]
+
+    def add(self, filename, cell, data):
+        info = zipfile.ZipInfo(filename, self._date_time)
+        info.compress_type = zipfile.ZIP_STORED
+        with self._lock:
+            self._zip.writestr(info, data)
+
+    def link(self, filename, cell, original):
+        # Members cannot share data: store the original's encoded bytes again, without re-encoding
+        with self._lock:
+            data = self._zip.read(original)
+        self.add(filename, cell, data)
+        return True
+
+    def close(self):
+        self._zip.close()
+        super().close()
+
+    def discard(self):
+        self._zip.close()
+        super().discard()
+
+
+class TarSink(TileSink):
+    """Plain ustar/pax stream; duplicates become hardlink members"""
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        self._file = open(self.part_path, "wb", buffering=1024 * 1024)
+        self._tar = tarfile.open(fileobj=self._file, mode="w", format=tarfile.PAX_FORMAT)
+        self._mtime = int(time.time())
+
+    def add(self, filename, cell, data):
+        info = tarfile.TarInfo(filename)
+        info.size = len(data)
+        info.mtime = self._mtime
+        with self._lock:
+            self._tar.addfile(info, io.BytesIO(data))
+
+    def link(self, filename, cell, original):
+        info = tarfile.TarInfo(filename)
+        info.type = tarfile.LNKTYPE
+        info.linkname = original
+        info.mtime = self._mtime
+        with self._lock:
+            self._tar.addfile(info)
+        return True
+
+    def close(self):
+        self._tar.close()
+        self._file.close()
+        super().close()
+
+    def discard(self):
+        self._tar.close()
+        self._file.close()
+        super().discard()
+
+
+class MBTilesSink(TileSink):
+    """MBTiles-style SQLite store keyed by (row, col) of the slicing grid.
+
+    Uses the deduplicating MBTiles layout: `images` holds each distinct tile
+    once and `map` points every (tile_row, tile_column) at it, with the
+    exported _R###_C### filename in `name`. The standard `tiles` view is
+    provided; zoom_level is always 0 and rows are grid rows (not flipped as
+    in TMS). Inserts are batched BATCH_SIZE tiles per transaction.
+    """
+
+    BATCH_SIZE = 256
+
+    def __init__(self, path, metadata):
+        super().__init__(path, metadata)
+        self.discard()
+        self._db = sqlite3.connect(self.part_path, check_same_thread=False)
+        self._db.executescript("""
+            PRAGMA journal_mode = OFF;
+            PRAGMA synchronous = OFF;
+            CREATE TABLE metadata (name TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+            CREATE TABLE map (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER,
+                              tile_id TEXT, name TEXT,
+                              PRIMARY KEY (zoom_level, tile_column, tile_row));
+            CREATE VIEW tiles AS
+                SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column,
+                       map.tile_row AS tile_row, images.tile_data AS tile_data
+                FROM map JOIN images ON images.tile_id = map.tile_id;
+        """)
+        self._db.executemany("INSERT INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in metadata.items()])
+        self._db.commit()
+        self._images = []
+        self._map = []
+
+    def add(self, filename, cell, data):
+        with self._lock:
+            self._images.append((filename, data))
+            self._map.append((cell[0], cell[1], filename, filename))
+            if len(self._map) >= self.BATCH_SIZE:
+                self._flush()
+
+    def link(self, filename, cell, original):
+        with self._lock:
+            self._map.append((cell[0], cell[1], original, filename))
+            if len(self._map) >= self.BATCH_SIZE:
+                self._flush()
+        return True
+
+    def _flush(self):
+        with self._db:
+            self._db.executemany("INSERT OR REPLACE INTO images VALUES (?, ?)", self._images)
+            self._db.executemany("INSERT OR REPLACE INTO map VALUES (0, ?, ?, ?, ?)", self._map)
+        self._images, self._map = [], []
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        self._db.close()
+        super().close()
+
+    def discard(self):
+        if getattr(self, "_db", None) is not None:
+            self._db.close()
+        super().discard()
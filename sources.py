@@ -0,0 +1,127 @@
+import threading
+
+from PIL import Image
+
+Image.MAX_IMAGE_PIXELS = None
+
+
+def is_loaded(image):
+    """True once Pillow has decoded the pixels of a lazily opened image"""
+    return not getattr(image, "tile", None)
+
+
+class RegionReader:
+    """Reads rectangular regions of an image file, decoding only what the layout requires.
+
+    Uncompressed layouts (BMP, PPM/PGM, uncompressed TIFF strips and tiles) are
+    read straight from their byte offsets, so a band of rows costs only those
+    rows. Compressed single-stream formats (PNG, JPEG, LZW/Deflate TIFF) cannot
+    be entered mid-stream; for those the whole image is decoded on first use.
+    An image that is already decoded is simply cropped. Pass the owner's `lock`
+    when the image object is shared with other threads that may decode it.
+    With a RawStore of the source (see raw_store.py) every region is read from
+    the store instead, whatever the source format; with a TiffPyramid (see
+    tiff_pyramid.py) only the compressed tiles under a region are decoded.
+    """
+
+    def __init__(self, path, image=None, lock=None, store=None, tiff=None):
+        self.path = path
+        self.image = image if image is not None else Image.open(path)
+        self.mode = self.image.mode
+        self.size = self.image.size
+        self.store = store
+        self.tiff = tiff
+        self._lock = lock if lock is not None else threading.Lock()
+        self._fp = None
+        with self._lock:
+            # Reading the header seeks the shared file, which must not happen in the middle of a decode
+            self._layout = None if is_loaded(self.image) or store is not None else self._raw_layout(self.image)
+        if self._layout is not None or is_loaded(self.image) or (tiff is not None and not tiff.pages[0].tiled):
+            self.tiff = None  # raw offsets or decoded pixels are cheaper; stripped pages gain nothing
+
+    @property
+    def streaming(self):
+        """True when regions are decoded without loading the whole image"""
+        return self._layout is not None or self.store is not None or self.tiff is not None
+
+    def close(self):
+        if self._fp:
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def read(self, box):
+        """Decode the (left, upper, right, lower) box of the source image"""
+        if self.store is not None:
+            return self.store.read(box)
+        if self.tiff is not None:
+            return self.tiff.read(box)
+        if self._layout is None:
+            if is_loaded(self.image):
+                return self.image.crop(box)
+            with self._lock:
+                # crop() decodes the full image once; later crops reuse it
+                return self.image.crop(box)
+        return self._read_raw(box)
+
+    @staticmethod
+    def _raw_layout(image):
+        """Describe the byte layout of an uncompressed image, or None if it is not one"""
+        tiles = getattr(image, "tile", None)
+        if not tiles or image.mode in ("P", "PA", "1"):
+            return None
+        try:
+            if image.getexif().get(0x0112, 1) != 1:
+                return None  # Pillow would transpose the pixels on load
+        except Exception:
+            return None
+
+        layout = []
+        seen = set()
+        for codec, extents, offset, args in tiles:
+            if codec != "raw":
+                return None
+            if isinstance(args, str):
+                args = (args,)
+            rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+            x0, y0, x1, y1 = extents
+            if extents in seen:
+                return None  # planar TIFF: one tile per band over the same area
+            seen.add(extents)
+            if not stride:
+                try:
+                    stride = len(Image.new(image.mode, (x1 - x0, 1)).tobytes("raw", rawmode))
+                except Exception:
+                    return None
+            layout.append((extents, offset, rawmode, stride, ystep))
+        return layout
+
+    def _read_raw(self, box):
+        bx0, by0, bx1, by1 = box
+        region = Image.new(self.mode, (bx1 - bx0, by1 - by0))
+        with self._lock:
+            if self._fp is None:
+                self._fp = open(self.path, "rb")
+            for (tx0, ty0, tx1, ty1), offset, rawmode, stride, ystep in self._layout:
+                ry0, ry1 = max(ty0, by0), min(ty1, by1)
+                cx0, cx1 = max(tx0, bx0), min(tx1, bx1)
+                if ry1 <= ry0 or cx1 <= cx0:
+                    continue
+                rows = ry1 - ry0
+                if ystep < 0:
+                    # Bottom-up storage (BMP): the wanted rows are still contiguous
+                    first = ty1 - ry1
+                else:
+                    first = ry0 - ty0
+                self._fp.seek(offset + first * stride)
+                data = self._fp.read(rows * stride)
+                piece = Image.frombytes(self.mode, (tx1 - tx0, rows), data, "raw", rawmode, stride, ystep)
+                if cx0 != tx0 or cx1 != tx1:
+                    piece = piece.crop((cx0 - tx0, 0, cx1 - tx0, rows))
+                region.paste(piece, (cx0 - bx0, ry0 - by0))
+        return region
@@ -0,0 +1,30 @@
+"""BatchExport scheduling tests."""
+from PIL import Image
+
+from batch import BatchExport
+from exporter import ExportJob
+from session import ImageSession
+
+
+def make_job(tmp_path, name):
+    Image.new("RGB", (200, 100), (0, 128, 255)).save(tmp_path / name)
+    session = ImageSession(str(tmp_path / name))
+    session.grid_w = session.grid_h = 100
+    return ExportJob(session, str(tmp_path), ".png", workers=1)
+
+
+def test_prepare_runs_in_the_job_slot(tmp_path):
+    narrowed, failing = make_job(tmp_path, "a.png"), make_job(tmp_path, "b.png")
+
+    def prepare(job):
+        if job is failing:
+            raise OSError("source unreadable")
+        job.keep_cells([(1, 0)])
+
+    batch = BatchExport([narrowed, failing], 1, max_images=1, workers=1, prepare=prepare)
+    batch.run()
+
+    assert narrowed.total == 1 and narrowed.saved == 1 and (tmp_path / "a_R000_C001.png").exists()
+    assert not (tmp_path / "a_R000_C000.png").exists()
+    assert failing.error == "source unreadable" and failing.finished and failing.saved == 0
+    assert batch.images_done == 2
@@ -0,0 +1,84 @@
+"""DatasetExport tests: the .npy layout that training pipelines read."""
+import ast
+import json
+import struct
+
+import pytest
+from PIL import Image
+
+from dataset import DatasetExport, npy_header, window_count
+from session import ImageSession
+
+
+def read_npy(path):
+    """(header dict, data bytes) of a version 1.0 .npy file"""
+    raw = path.read_bytes()
+    assert raw[:8] == b"\x93NUMPY\x01\x00"
+    (length,) = struct.unpack("<H", raw[8:10])
+    assert (10 + length) % 64 == 0 and raw[10 + length - 1:10 + length] == b"\n"
+    return ast.literal_eval(raw[10:10 + length].decode("latin1")), raw[10 + length:]
+
+
+def export(tmp_path, image, grid, **kwargs):
+    source = tmp_path / "scan.png"
+    image.save(source)
+    session = ImageSession(str(source))
+    session.grid_w, session.grid_h = grid
+    job = DatasetExport(session, str(tmp_path), **kwargs)
+    job.run()
+    assert job.error is None
+    return job
+
+
+def test_npy_header():
+    header = npy_header("|u1", (3, 4, 5, 3))
+    assert header.startswith(b"\x93NUMPY\x01\x00") and len(header) % 64 == 0
+    assert ast.literal_eval(header[10:].decode("latin1")) == {"descr": "|u1", "fortran_order": False,
+                                                             "shape": (3, 4, 5, 3)}
+
+
+def test_window_count():
+    assert window_count(100, 100, 50) == 1
+    assert window_count(250, 100, 100) == 3
+    assert window_count(250, 100, 50) == 4
+    assert window_count(311, 50, 64) == 5  # gaps between windows
+
+
+def test_windows_follow_the_stride_and_pad_the_edges(tmp_path):
+    image = Image.linear_gradient("L").resize((70, 50))
+    job = export(tmp_path, image, (40, 30), stride=(20, 20))
+
+    header, data = read_npy(tmp_path / "scan.npy")
+    assert header == {"descr": "|u1", "fortran_order": False, "shape": (6, 30, 40, 1)}
+    index_header, index = read_npy(tmp_path / "scan_index.npy")
+    assert index_header["shape"] == (6, 2) and index_header["descr"] == "<i4"
+    slots = [struct.unpack_from("<ii", index, 8 * i) for i in range(6)]
+    assert slots == [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)]
+
+    for i, (row, col) in enumerate(slots):
+        expected = Image.new("L", (40, 30))
+        expected.paste(image.crop((col * 20, row * 20, col * 20 + 40, row * 20 + 30)))
+        assert data[i * 1200:(i + 1) * 1200] == expected.tobytes(), (row, col)
+
+    meta = json.loads((tmp_path / "scan_dataset.json").read_text())
+    assert meta["shape"] == [6, 30, 40, 1] and meta["stride"] == [20, 20] and meta["dtype"] == "|u1"
+    assert job.done == job.total == 6
+
+
+def test_selected_cells_with_the_grid_stride(tmp_path):
+    image = Image.effect_noise((64, 64), 50).convert("RGB")
+    export(tmp_path, image, (32, 32), cells=[(1, 1), (0, 1)])
+
+    header, data = read_npy(tmp_path / "scan.npy")
+    assert header["shape"] == (2, 32, 32, 3)
+    assert data == image.crop((0, 32, 32, 64)).tobytes() + image.crop((32, 32, 64, 64)).tobytes()
+
+
+def test_loads_with_numpy(tmp_path):
+    numpy = pytest.importorskip("numpy")
+    image = Image.effect_noise((50, 40), 50).convert("I").point(lambda v: v * 200).convert("I;16")
+    export(tmp_path, image, (25, 20))
+
+    array = numpy.load(tmp_path / "scan.npy", mmap_mode="r")
+    assert array.shape == (4, 20, 25, 1) and array.dtype == numpy.uint16
+    assert array[3, :, :, 0].tobytes() == image.crop((25, 20, 50, 40)).tobytes()
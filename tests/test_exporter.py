@@ -0,0 +1,166 @@
+"""ExportJob tests on small synthetic images."""
+import os
+import zipfile
+
+from PIL import Image
+
+from export_manifest import ExportManifest, manifest_path, tile_digest
+from exporter import ExportJob
+from session import ImageSession
+
+GRID = 100
+
+
+def make_source(path, colour=(0, 128, 255)):
+    """A 4x1 grid of identical cells, so every tile after the first is a duplicate"""
+    Image.new("RGB", (4 * GRID, GRID), colour).save(path)
+
+
+def export(source, out_dir, **kwargs):
+    os.makedirs(out_dir, exist_ok=True)
+    session = ImageSession(str(source))
+    session.grid_w = session.grid_h = GRID
+    job = ExportJob(session, str(out_dir), ".png", workers=1, **kwargs)
+    job.run()
+    assert job.error is None and not job.errors
+    return job
+
+
+def tile_pixels(out_dir):
+    pixels = {}
+    for name in sorted(os.listdir(out_dir)):
+        if name.endswith(".png"):
+            with Image.open(os.path.join(out_dir, name)) as tile:
+                pixels[name] = tile.getpixel((GRID // 2, GRID // 2))
+    return pixels
+
+
+def test_tile_digest_depends_on_pixels_mode_and_size():
+    tile = Image.new("RGB", (8, 8), (1, 2, 3))
+    assert tile_digest(tile) == tile_digest(tile.copy())
+    assert tile_digest(tile) != tile_digest(Image.new("RGB", (8, 8), (1, 2, 4)))
+    assert tile_digest(tile) != tile_digest(Image.new("RGB", (4, 16), (1, 2, 3)))
+    assert tile_digest(Image.new("L", (8, 8))) != tile_digest(Image.new("P", (8, 8)))
+
+
+def test_hardlink_dedup_encodes_each_distinct_tile_once(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    job = export(source, out_dir, dedup="hardlink")
+
+    assert job.saved == 4 and job.duplicates == 3 and job.stage_stats["encode"][1] == 1
+    inodes = {os.stat(out_dir / f"scan_R000_C{c:03d}.png").st_ino for c in range(4)}
+    assert len(inodes) == 1
+
+
+def test_manifest_dedup_lists_duplicates_instead_of_writing_them(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    job = export(source, out_dir, dedup="manifest")
+
+    assert sorted(n for n in os.listdir(out_dir) if n.endswith(".png")) == ["scan_R000_C000.png"]
+    manifest = ExportManifest.load(manifest_path(str(out_dir), job.session.name))
+    assert manifest.duplicates == {f"scan_R000_C{c:03d}.png": "scan_R000_C000.png" for c in (1, 2, 3)}
+
+
+def test_incremental_export_skips_intact_tiles(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    Image.linear_gradient("L").resize((4 * GRID, GRID)).save(source)
+    export(source, out_dir)
+    os.remove(out_dir / "scan_R000_C002.png")
+
+    again = export(source, out_dir)
+    assert (again.saved, again.up_to_date) == (1, 3)
+    assert export(source, out_dir, incremental=False).saved == 4
+
+
+def test_incremental_export_resumes_from_the_journal(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    Image.linear_gradient("L").resize((4 * GRID, GRID)).save(source)
+    first = export(source, out_dir)
+    path = manifest_path(str(out_dir), first.session.name)
+    records = ExportManifest.load(path).tiles
+
+    # An export killed after two tiles: the saved manifest is empty, the journal lists them
+    interrupted = ExportManifest(first.session.name, ".png", (GRID, GRID), first.manifest.source,
+                                 profile=first.profile)
+    interrupted.begin(path)
+    for name in ("scan_R000_C000.png", "scan_R000_C001.png"):
+        interrupted.keep_tile(name, records[name])
+    interrupted._journal.close()
+    os.remove(out_dir / "scan_R000_C003.png")
+
+    resumed = export(source, out_dir)
+    assert (resumed.saved, resumed.up_to_date) == (2, 2)
+    assert not os.path.exists(path + ".journal")
+
+
+def test_reexport_does_not_write_through_hardlinks(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    first = export(source, out_dir, dedup="hardlink")
+    assert first.duplicates == 3
+    before = tile_pixels(out_dir)
+
+    # Change one cell only; its tile was a hardlink to the first one
+    with Image.open(source) as im:
+        im.load()
+    im.paste((200, 0, 0), (2 * GRID, 0, 3 * GRID, GRID))
+    im.save(source)
+    export(source, out_dir, dedup="hardlink")
+
+    after = tile_pixels(out_dir)
+    changed = [name for name in after if after[name] != before[name]]
+    assert len(changed) == 1 and after[changed[0]] == (200, 0, 0)
+
+
+def test_reexport_keeps_untouched_tiles_and_manifest_in_sync(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    export(source, out_dir, dedup="hardlink")
+    before = {name: (out_dir / name).read_bytes() for name in os.listdir(out_dir) if name.endswith(".png")}
+
+    with Image.open(source) as im:
+        im.load()
+    im.paste((200, 0, 0), (0, 0, GRID, GRID))
+    im.save(source)
+    job = export(source, out_dir, dedup="hardlink")
+
+    after = {name: (out_dir / name).read_bytes() for name in before}
+    assert sum(after[name] != before[name] for name in before) == 1
+    manifest = ExportManifest.load(manifest_path(str(out_dir), job.session.name))
+    assert sorted(manifest.tiles) == sorted(before)
+    assert all(manifest.intact(str(out_dir), name) for name in manifest.tiles)
+    assert manifest.drop_stale(str(out_dir)) == []
+
+
+def test_cancelled_container_export_keeps_previous_container(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    export(source, out_dir, container=".zip")
+    container = out_dir / "scan.zip"
+    manifest = out_dir / "scan_manifest.json"
+    before = container.read_bytes(), manifest.read_bytes()
+
+    make_source(source, colour=(200, 0, 0))
+    os.makedirs(out_dir, exist_ok=True)
+    session = ImageSession(str(source))
+    session.grid_w = session.grid_h = GRID
+    job = ExportJob(session, str(out_dir), ".png", workers=1, container=".zip")
+    job.cancel()
+    job.run()
+
+    assert job.cancelled and job.error is None
+    assert (container.read_bytes(), manifest.read_bytes()) == before
+    assert sorted(os.listdir(out_dir)) == ["scan.zip", "scan_manifest.json"]
+
+
+def test_zip_container_keeps_deduplicated_tiles(tmp_path):
+    source, out_dir = tmp_path / "scan.png", tmp_path / "out"
+    make_source(source)
+    job = export(source, out_dir, dedup="hardlink", container=".zip")
+
+    with zipfile.ZipFile(out_dir / "scan.zip") as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+    assert len(members) == 4 and len(set(members.values())) == 1
+    assert job.duplicates == 3
@@ -0,0 +1,90 @@
+"""Project file tests: .labx containers and autosave."""
+import json
+
+from PIL import Image
+
+import project
+from autosave import ProjectAutosaver
+from selection import CellSelection
+from session import ImageSession
+
+
+def make_sessions(tmp_path, count=3):
+    sessions = []
+    for i in range(count):
+        path = tmp_path / f"img{i}.png"
+        Image.new("RGB", (800, 600)).save(path)
+        session = ImageSession(str(path))
+        session.grid_w = session.grid_h = 10
+        session.selected_cells = CellSelection((c, r) for r in range(i, 40) for c in range(0, 80, i + 1))
+        sessions.append(session)
+    return sessions
+
+
+def reopen(path):
+    sessions = []
+    for img_data in project.image_entries(project.read_project(path)):
+        session = ImageSession(img_data["path"])
+        project.apply_session_data(session, img_data)
+        sessions.append(session)
+    return sessions
+
+
+def test_autosave_keeps_untouched_container_selections_compressed(tmp_path, monkeypatch):
+    original = make_sessions(tmp_path)
+    path = str(tmp_path / "project.labx")
+    project.write_project(path, original)
+    sessions = reopen(path)
+
+    decoded = []
+    from_bytes = CellSelection.from_bytes.__func__
+    monkeypatch.setattr(CellSelection, "from_bytes",
+                        classmethod(lambda cls, *args: decoded.append(args) or from_bytes(cls, *args)))
+    sessions[1].selected_cells.add((0, 0))
+    saver = ProjectAutosaver()
+    saver.save(path, sessions, 0, ".png", dirty=set(sessions))
+    assert saver.wait(5) and saver.last_error is None
+    assert len(decoded) == 1  # only the selection that was edited
+    assert sessions[0].deferred_selection is not None and sessions[2].deferred_selection is not None
+
+    # The deferred selections no longer depend on the file the save replaced
+    assert set(sessions[0].selected_cells) == set(original[0].selected_cells)
+    saved = reopen(path)
+    assert set(saved[1].selected_cells) == set(original[1].selected_cells) | {(0, 0)}
+    assert set(saved[2].selected_cells) == set(original[2].selected_cells)
+
+
+def test_labx_round_trip_keeps_every_key(tmp_path):
+    big = CellSelection((c, r) for r in range(50) for c in range(0, 100, 3))
+    data = {
+        "version": "2.3",
+        "active_index": 1,
+        "export_format": ".webp",
+        "imagens": [
+            {"caminho": "/data/a.png", "gw": 256, "gh": 128, "selecao": [[1, 2], [3, 4]], "extra": {"note": "x"}},
+            {"path": "/data/b.png", "grid_w": 64, "grid_h": 64, "selection": big.encode()},
+            {"path": "/data/c.png", "grid_w": 10, "grid_h": 10},
+        ],
+    }
+    source, packed, back = tmp_path / "a.lab", tmp_path / "a.labx", tmp_path / "b.lab"
+    source.write_text(json.dumps(data))
+    project.convert_project(str(source), str(packed))
+    project.convert_project(str(packed), str(back))
+
+    assert json.loads(back.read_text()) == data
+    entries = project.image_entries(project.read_project(str(packed)))
+    assert entries[0]["gw"] == 256 and set(entries[0].load_selection()) == {(1, 2), (3, 4)}
+    assert entries[1].load_selection() == big
+
+
+def test_labx_selections_are_read_on_first_use(tmp_path):
+    sessions = make_sessions(tmp_path)
+    path = str(tmp_path / "project.labx")
+    project.write_project(path, sessions, active_index=2, export_format=".tiff")
+    data = project.read_project(path)
+    assert project.active_index(data) == 2 and project.export_format(data) == ".tiff"
+
+    reopened = reopen(path)
+    assert all(session.deferred_selection is not None for session in reopened)
+    assert [set(s.selected_cells) for s in reopened] == [set(s.selected_cells) for s in sessions]
+    assert reopened[0].deferred_selection is None
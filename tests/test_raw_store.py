@@ -0,0 +1,66 @@
+"""RawStore tests: conversion, crops and pruning."""
+import os
+
+import pytest
+from PIL import Image
+
+from raw_store import RawStore, prune, store_path
+from session import ImageSession
+
+
+def source_image(mode):
+    base = Image.effect_noise((90, 70), 60)
+    if mode == "I;16":
+        return base.convert("I").point(lambda v: v * 250).convert("I;16")
+    return base.convert(mode)
+
+
+@pytest.mark.parametrize("mode", ["L", "LA", "RGB", "RGBA", "I;16", "F"])
+def test_crops_match_the_source(tmp_path, mode):
+    image = source_image(mode)
+    source = tmp_path / ("scan.tiff" if mode == "F" else "scan.png")
+    image.save(source)
+    session = ImageSession(str(source))
+
+    store = RawStore.build(session, str(tmp_path / "raw"))
+    try:
+        assert os.path.getsize(store.path) == store.offset + store.nbytes
+        for box in [(0, 0, 90, 70), (13, 7, 61, 45), (89, 69, 90, 70)]:
+            assert store.read(box).tobytes() == image.crop(box).tobytes()
+        assert store.read((5, 5, 5, 9)).size == (0, 4)
+    finally:
+        store.close()
+
+    reopened = RawStore.open(str(source), session.image_mode, image.size, str(tmp_path / "raw"))
+    assert reopened is not None
+    reopened.close()
+
+
+def test_palette_and_bilevel_modes_are_not_stored(tmp_path):
+    assert not RawStore.supports("P") and not RawStore.supports("1")
+    source = tmp_path / "scan.png"
+    source_image("L").convert("P").save(source)
+    with pytest.raises(ValueError):
+        RawStore.build(ImageSession(str(source)), str(tmp_path / "raw"))
+
+
+def test_truncated_or_mismatched_stores_are_ignored(tmp_path):
+    source = tmp_path / "scan.png"
+    source_image("RGB").save(source)
+    directory = str(tmp_path / "raw")
+    RawStore.build(ImageSession(str(source)), directory).close()
+
+    assert RawStore.open(str(source), "L", (90, 70), directory) is None
+    path = store_path(str(source), directory)
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 1)
+    assert RawStore.open(str(source), "RGB", (90, 70), directory) is None
+
+
+def test_prune_deletes_least_recently_used(tmp_path):
+    for i, name in enumerate(["old.npy", "mid.npy", "new.npy"]):
+        (tmp_path / name).write_bytes(bytes(100))
+        os.utime(tmp_path / name, (i, i))
+    # Kept stores are neither counted nor deleted
+    prune(str(tmp_path), 150, keep=(str(tmp_path / "old.npy"),))
+    assert sorted(os.listdir(tmp_path)) == ["new.npy", "old.npy"]
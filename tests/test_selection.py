@@ -0,0 +1,59 @@
+"""CellSelection tests, including the rowbits-zlib format other tools read."""
+import base64
+import json
+import zlib
+
+import pytest
+
+from selection import CellSelection
+
+
+def test_behaves_like_a_set_of_cells():
+    selection = CellSelection([(3, 1), (0, 0), (70, 1)])
+    selection.add((3, 1))
+    selection.toggle((0, 0))
+    selection.discard((5, 5))
+    assert len(selection) == 2 and (70, 1) in selection and (0, 0) not in selection
+    assert list(selection) == [(3, 1), (70, 1)]
+    with pytest.raises(KeyError):
+        selection.remove((1, 1))
+
+    other = CellSelection([(3, 1), (4, 2)])
+    assert set(selection | other) == {(3, 1), (70, 1), (4, 2)}
+    assert set(selection & other) == {(3, 1)}
+    assert set(selection - other) == {(70, 1)}
+    assert list(CellSelection((c, r) for r in range(5) for c in range(5)).cells_in_range(1, 2, 2, 3)) == \
+        [(1, 2), (2, 2), (1, 3), (2, 3)]
+
+
+def test_small_selections_encode_as_pairs():
+    selection = CellSelection([(2, 0), (1, 4)])
+    assert selection.encode() == [[2, 0], [1, 4]]
+    assert CellSelection.decode([[2, 0], [1, 4]]) == selection
+
+
+def test_rowbits_zlib_round_trip():
+    cells = {(c, r) for r in range(0, 300, 3) for c in range(r % 7, 200, 5)}
+    selection = CellSelection(cells)
+    raw = json.loads(json.dumps(selection.encode()))
+
+    assert raw["encoding"] == "rowbits-zlib"
+    assert (raw["cols"], raw["rows"]) == selection.bounds()
+    assert set(CellSelection.decode(raw)) == cells
+
+
+def test_rowbits_layout():
+    # ceil(cols / 8) bytes per row, least significant bit = lowest column
+    selection = CellSelection([(0, 0), (9, 0), (1, 2)] + [(c, 3) for c in range(300)])
+    selection.discard((0, 3))
+    raw = selection.encode()
+    data = zlib.decompress(base64.b64decode(raw["data"]))
+    stride = (raw["cols"] + 7) // 8
+    assert (raw["cols"], raw["rows"]) == (300, 4) and len(data) == stride * 4
+    assert data[:2] == bytes([0b1, 0b10]) and data[stride:2 * stride] == bytes(stride)
+    assert data[2 * stride] == 0b10
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(ValueError):
+        CellSelection.decode({"encoding": "rle", "data": ""})
@@ -0,0 +1,36 @@
+"""ImageSession pyramid tests."""
+import threading
+
+from PIL import Image
+
+from session import ImageSession
+
+
+def make_session(tmp_path, size=(3000, 2000)):
+    path = tmp_path / "scan.png"
+    Image.new("RGB", size, (10, 20, 30)).save(path)
+    return ImageSession(str(path))
+
+
+def test_built_levels_do_not_wait_for_a_source_decode(tmp_path):
+    session = make_session(tmp_path)
+    preview = session.get_level(2)
+    decoding, release = threading.Event(), threading.Event()
+
+    def decode():
+        with session._lock:  # held for the whole decode, as level 0 and RegionReader do
+            decoding.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=decode)
+    thread.start()
+    decoding.wait()
+    try:
+        result = []
+        reader = threading.Thread(target=lambda: result.append(session.level_view(2, (0, 0, 10, 10))))
+        reader.start()
+        reader.join(1)
+        assert result and result[0][0] is preview
+    finally:
+        release.set()
+        thread.join()
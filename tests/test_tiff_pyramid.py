@@ -0,0 +1,84 @@
+"""TiffPyramid tests on tiled and multi-resolution TIFFs."""
+import struct
+import zlib
+
+from PIL import Image
+
+from session import ImageSession
+from tiff_pyramid import TiffPyramid
+
+TILE = 32
+
+
+def write_tiled_tiff(path, image):
+    """An RGB TIFF with deflate-compressed TILE x TILE tiles (Pillow only writes strips)"""
+    across, down = -(-image.width // TILE), -(-image.height // TILE)
+    chunks = []
+    for ty in range(down):
+        for tx in range(across):
+            tile = Image.new("RGB", (TILE, TILE))
+            tile.paste(image.crop((tx * TILE, ty * TILE, (tx + 1) * TILE, (ty + 1) * TILE)))
+            chunks.append(zlib.compress(tile.tobytes()))
+
+    offsets, data = [], b""
+    for chunk in chunks:
+        offsets.append(8 + len(data))
+        data += chunk + b"\0" * (len(chunk) % 2)
+    extra_offset = 8 + len(data)
+    extra = b"".join(struct.pack("<H", 8) for _ in range(3)) + b"\0\0"
+    offsets_at = extra_offset + len(extra)
+    extra += struct.pack(f"<{len(chunks)}I", *offsets)
+    counts_at = extra_offset + len(extra)
+    extra += struct.pack(f"<{len(chunks)}I", *(len(c) for c in chunks))
+
+    entries = [(256, 4, 1, image.width), (257, 4, 1, image.height), (258, 3, 3, extra_offset), (259, 3, 1, 8),
+               (262, 3, 1, 2), (277, 3, 1, 3), (284, 3, 1, 1), (322, 3, 1, TILE), (323, 3, 1, TILE),
+               (324, 4, len(chunks), offsets_at), (325, 4, len(chunks), counts_at)]
+    ifd_offset = extra_offset + len(extra)
+    ifd = struct.pack("<H", len(entries))
+    for tag, kind, count, value in entries:
+        if kind == 3 and count == 1:
+            ifd += struct.pack("<HHIHH", tag, kind, count, value, 0)
+        else:
+            ifd += struct.pack("<HHII", tag, kind, count, value)
+    ifd += b"\0\0\0\0"
+    path.write_bytes(b"II" + struct.pack("<HI", 42, ifd_offset) + data + extra + ifd)
+
+
+def test_tiled_region_reads(tmp_path):
+    image = Image.effect_noise((100, 70), 60).convert("RGB")
+    path = tmp_path / "tiled.tif"
+    write_tiled_tiff(path, image)
+    with Image.open(path) as check:
+        assert check.convert("RGB").tobytes() == image.tobytes()
+
+    pyramid = TiffPyramid.open(str(path), "RGB")
+    assert pyramid is not None and len(pyramid.pages) == 1 and pyramid.pages[0].tiled
+    for box in [(0, 0, 100, 70), (31, 31, 33, 33), (40, 10, 99, 69), (96, 64, 100, 70)]:
+        assert pyramid.read(box).tobytes() == image.crop(box).tobytes(), box
+    pyramid.close()
+
+    session = ImageSession(str(path))
+    assert session.tiff is not None
+    with session.region_reader() as reader:
+        assert reader.streaming and reader.read((20, 20, 70, 50)).tobytes() == image.crop((20, 20, 70, 50)).tobytes()
+
+
+def test_reduced_pages_serve_coarse_levels(tmp_path):
+    image = Image.effect_noise((400, 200), 60).convert("RGB")
+    reduced = [image.resize((200, 100)), image.resize((100, 50)), Image.new("RGB", (60, 60))]
+    path = tmp_path / "pyramid.tif"
+    image.save(path, compression="tiff_deflate", save_all=True, append_images=reduced)
+
+    pyramid = TiffPyramid.open(str(path), "RGB")
+    assert [pyramid.page_size(i) for i in range(len(pyramid.pages))] == [(400, 200), (200, 100), (100, 50)]
+    assert pyramid.page_for(1) == 0 and pyramid.page_for(2) == 1 and pyramid.page_for(5) == 2
+    assert pyramid.page_for(64) is None
+    assert pyramid.read((10, 10, 60, 40), 1).tobytes() == reduced[0].crop((10, 10, 60, 40)).tobytes()
+    pyramid.close()
+
+
+def test_flat_tiffs_are_left_to_pillow(tmp_path):
+    path = tmp_path / "flat.tif"
+    Image.new("RGB", (64, 64)).save(path, compression="tiff_deflate")
+    assert TiffPyramid.open(str(path), "RGB") is None
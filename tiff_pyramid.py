@@ -0,0 +1,303 @@
+import io
+import math
+import struct
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+# TIFF field types: (bytes per value, struct code)
+_TYPES = {1: (1, "B"), 2: (1, "B"), 3: (2, "H"), 4: (4, "I"), 5: (8, "II"), 6: (1, "b"), 7: (1, "B"),
+          8: (2, "h"), 9: (4, "i"), 10: (8, "ii"), 11: (4, "f"), 12: (8, "d"), 13: (4, "I"),
+          16: (8, "Q"), 17: (8, "q"), 18: (8, "Q")}
+
+NEW_SUBFILE_TYPE = 254
+IMAGE_WIDTH, IMAGE_LENGTH = 256, 257
+COMPRESSION = 259
+STRIP_OFFSETS, ROWS_PER_STRIP, STRIP_BYTE_COUNTS = 273, 278, 279
+ORIENTATION = 274
+SAMPLES_PER_PIXEL = 277
+PLANAR_CONFIGURATION = 284
+TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS = 322, 323, 324, 325
+SUB_IFDS = 330
+
+# Tags that describe how to decode a chunk; copied into the one-chunk TIFF handed to Pillow
+_DECODE_TAGS = (258, COMPRESSION, 262, 266, SAMPLES_PER_PIXEL, PLANAR_CONFIGURATION, 317, 320,
+                338, 339, 340, 341, 347, 529, 530, 531, 532)
+# Most IFDs followed, against malformed chains that loop
+_MAX_IFDS = 1024
+
+
+class _Page:
+    """One IFD of the file: its size and how its pixels are cut into chunks (tiles or strips)"""
+
+    def __init__(self, order, tags):
+        self.tags = tags
+
+        def read_values(tag, default=None):
+            return _values(order, tags, tag, default)
+
+        self.width = read_values(IMAGE_WIDTH)[0]
+        self.height = read_values(IMAGE_LENGTH)[0]
+        self.tiled = TILE_WIDTH in tags
+        if self.tiled:
+            self.chunk_w = read_values(TILE_WIDTH)[0]
+            self.chunk_h = read_values(TILE_LENGTH)[0]
+            self.offsets = read_values(TILE_OFFSETS)
+            self.counts = read_values(TILE_BYTE_COUNTS)
+        else:
+            self.chunk_w = self.width
+            self.chunk_h = min(read_values(ROWS_PER_STRIP, (self.height,))[0], self.height)
+            self.offsets = read_values(STRIP_OFFSETS)
+            self.counts = read_values(STRIP_BYTE_COUNTS)
+        self.across = math.ceil(self.width / self.chunk_w)
+        self.down = math.ceil(self.height / self.chunk_h)
+        self.reduced = bool(read_values(NEW_SUBFILE_TYPE, (0,))[0] & 1)
+        self.decodable = (
+            self.width > 0 and self.height > 0 and self.chunk_w > 0 and self.chunk_h > 0
+            and len(self.offsets) >= self.across * self.down and len(self.counts) == len(self.offsets)
+            and read_values(COMPRESSION, (1,))[0] != 6  # old-style JPEG needs the whole file
+            and (read_values(PLANAR_CONFIGURATION, (1,))[0] == 1 or read_values(SAMPLES_PER_PIXEL, (1,))[0] == 1)
+            and read_values(ORIENTATION, (1,))[0] == 1)
+        self.factor = (1.0, 1.0)  # source pixels per page pixel, set by TiffPyramid
+
+
+class TiffPyramid:
+    """Region access to tiled and multi-resolution TIFF (and BigTIFF) files.
+
+    Pillow decodes a compressed TIFF as a single stream, so a crop costs the
+    whole image. Here the IFDs are parsed directly: the full-resolution page
+    and every reduced-resolution copy of it (pages of the main chain or
+    SubIFDs with the same aspect ratio, as written by vips, OME-TIFF and
+    slide scanners) become `pages`, ordered from finest to coarsest. read()
+    decodes only the tiles (or strips) that intersect a box: each one is
+    wrapped in a one-chunk TIFF that Pillow decodes with the same
+    compression, predictor and JPEG tables. Recently decoded chunks are kept
+    up to CACHE_BYTES, since neighbouring viewport tiles and export bands
+    share them.
+    """
+
+    CACHE_BYTES = 64 * 1024 * 1024
+    # A reduced page may differ from the exact ratio by this much (sizes are rounded per level)
+    ASPECT_TOLERANCE = 0.02
+
+    def __init__(self, path, pages, byte_order, mode):
+        self.path = path
+        self.pages = pages
+        self.mode = mode
+        self._order = byte_order
+        self._fp = None
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    @classmethod
+    def open(cls, path, mode):
+        """The pyramid of a TIFF whose full-resolution page is tiled or has reduced copies, else None"""
+        try:
+            with open(path, "rb") as f:
+                order, ifds = _read_ifds(f)
+        except (OSError, ValueError, struct.error):
+            return None
+        pages = []
+        for tags in ifds:
+            try:
+                pages.append(_Page(order, tags))
+            except (KeyError, IndexError, struct.error):
+                continue
+        if not pages or not pages[0].decodable:
+            return None
+        full = pages[0]
+        levels = [full]
+        for page in pages[1:]:
+            if not page.decodable or page.width >= full.width or page.height >= full.height:
+                continue
+            fx, fy = full.width / page.width, full.height / page.height
+            if abs(fx - fy) / fx > cls.ASPECT_TOLERANCE:
+                continue  # label, macro or thumbnail with a different crop
+            if any(_tags_differ(page, full, tag) for tag in (SAMPLES_PER_PIXEL, 258, 262, 339)):
+                continue
+            page.factor = (fx, fy)
+            levels.append(page)
+        if not full.tiled and len(levels) == 1:
+            return None  # a flat raster: the regular loader handles it
+        levels.sort(key=lambda page: page.factor[0])
+        return cls(path, levels, order, mode)
+
+    def page_for(self, scale, max_oversample=4):
+        """Index of the coarsest page with at least one pixel per `scale` source pixels.
+
+        Pages more than `max_oversample` times finer than needed are not
+        worth reading for a reduced view; None then.
+        """
+        best = None
+        for i, page in enumerate(self.pages):
+            if page.factor[0] <= scale * 1.01:
+                best = i
+        if best is None or self.pages[best].factor[0] * max_oversample < scale:
+            return None
+        return best
+
+    def page_size(self, index):
+        page = self.pages[index]
+        return page.width, page.height
+
+    def read(self, box, index=0):
+        """Decode the (left, upper, right, lower) box of page `index` from the chunks it touches"""
+        page = self.pages[index]
+        x0, y0, x1, y1 = box
+        region = Image.new(self.mode, (max(0, x1 - x0), max(0, y1 - y0)))
+        if x1 <= x0 or y1 <= y0:
+            return region
+        for row in range(y0 // page.chunk_h, min(page.down, -(-y1 // page.chunk_h))):
+            for col in range(x0 // page.chunk_w, min(page.across, -(-x1 // page.chunk_w))):
+                chunk = self._chunk(index, row * page.across + col)
+                cx, cy = col * page.chunk_w, row * page.chunk_h
+                crop = (max(x0, cx) - cx, max(y0, cy) - cy,
+                        min(x1, cx + chunk.width) - cx, min(y1, cy + chunk.height) - cy)
+                if crop[2] > crop[0] and crop[3] > crop[1]:
+                    region.paste(chunk.crop(crop), (cx + crop[0] - x0, cy + crop[1] - y0))
+        return region
+
+    def close(self):
+        with self._lock:
+            if self._fp:
+                self._fp.close()
+                self._fp = None
+            self._cache.clear()
+            self._cached_bytes = 0
+
+    def _chunk(self, index, number):
+        key = (index, number)
+        with self._lock:
+            chunk = self._cache.get(key)
+            if chunk is not None:
+                self._cache.move_to_end(key)
+                return chunk
+            page = self.pages[index]
+            if self._fp is None:
+                self._fp = open(self.path, "rb")
+            self._fp.seek(page.offsets[number])
+            data = self._fp.read(page.counts[number])
+        chunk = self._decode(page, number, data)
+        with self._lock:
+            self._cache[key] = chunk
+            self._cached_bytes += chunk.width * chunk.height * 4
+            while self._cached_bytes > self.CACHE_BYTES and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached_bytes -= evicted.width * evicted.height * 4
+        return chunk
+
+    def _decode(self, page, number, data):
+        height = page.chunk_h
+        if not page.tiled:
+            # The last strip only holds the remaining rows
+            height = min(page.chunk_h, page.height - (number // page.across) * page.chunk_h)
+        blob = _single_chunk_tiff(self._order, page.tags, page.chunk_w, height, data)
+        with Image.open(io.BytesIO(blob)) as image:
+            image.load()
+            if image.mode != self.mode:
+                return image.convert(self.mode)
+            return image.copy()
+
+
+def _tags_differ(page, other, tag):
+    return page.tags.get(tag, (None, 0, b""))[2] != other.tags.get(tag, (None, 0, b""))[2]
+
+
+def _values(order, tags, tag, default=None):
+    if tag not in tags:
+        if default is None:
+            raise KeyError(tag)
+        return default
+    kind, count, raw = tags[tag]
+    size, code = _TYPES[kind]
+    return struct.unpack(f"{order}{count * len(code)}{code[0]}", raw[:size * count])
+
+
+def _read_ifds(f):
+    """(byte order, [tags of every IFD]) for the main chain and its SubIFDs; tags map to (type, count, raw bytes)"""
+    head = f.read(16)
+    order = {b"II": "<", b"MM": ">"}.get(head[:2])
+    if order is None:
+        raise ValueError("not a TIFF file")
+    (version,) = struct.unpack(order + "H", head[2:4])
+    if version == 42:
+        big = False
+        (first,) = struct.unpack(order + "I", head[4:8])
+    elif version == 43:
+        big = True
+        (first,) = struct.unpack(order + "Q", head[8:16])
+    else:
+        raise ValueError("not a TIFF file")
+
+    ifds, seen = [], set()
+    pending = [first]
+    while pending and len(ifds) < _MAX_IFDS:
+        offset = pending.pop(0)
+        chain = []
+        while offset and offset not in seen and len(ifds) + len(chain) < _MAX_IFDS:
+            seen.add(offset)
+            tags, offset = _read_ifd(f, order, big, offset)
+            chain.append(tags)
+            if SUB_IFDS in tags:
+                pending.extend(_values(order, tags, SUB_IFDS))
+        ifds.extend(chain)
+    return order, ifds
+
+
+def _read_ifd(f, order, big, offset):
+    f.seek(offset)
+    if big:
+        (count,) = struct.unpack(order + "Q", f.read(8))
+        entry, inline, fmt = 20, 8, order + "HHQ"
+    else:
+        (count,) = struct.unpack(order + "H", f.read(2))
+        entry, inline, fmt = 12, 4, order + "HHI"
+    data = f.read(count * entry + inline)
+    tags = {}
+    for i in range(count):
+        raw = data[i * entry:(i + 1) * entry]
+        tag, kind, n = struct.unpack(fmt, raw[:entry - inline])
+        if kind not in _TYPES:
+            continue
+        length = _TYPES[kind][0] * n
+        value = raw[entry - inline:]
+        if length > inline:
+            (where,) = struct.unpack(order + ("Q" if big else "I"), value)
+            here = f.tell()
+            f.seek(where)
+            value = f.read(length)
+            f.seek(here)
+        tags[tag] = (kind, n, value[:length])
+    (next_offset,) = struct.unpack(order + ("Q" if big else "I"), data[count * entry:])
+    return tags, next_offset
+
+
+def _single_chunk_tiff(order, tags, width, height, data):
+    """A classic TIFF holding one strip of `width` x `height` pixels encoded like the source chunk"""
+    entries = []
+    for tag in _DECODE_TAGS:
+        if tag in tags and tags[tag][0] < 16:  # 64-bit types only exist in BigTIFF
+            entries.append((tag,) + tags[tag])
+    for tag, value in ((IMAGE_WIDTH, width), (IMAGE_LENGTH, height), (STRIP_OFFSETS, 8),
+                       (ROWS_PER_STRIP, height), (STRIP_BYTE_COUNTS, len(data))):
+        entries.append((tag, 4, 1, struct.pack(order + "I", value)))
+    entries.sort()
+
+    body = data + b"\0" * (len(data) % 2)
+    ifd_offset = 8 + len(body)
+    extra_offset = ifd_offset + 2 + 12 * len(entries) + 4
+    ifd, extra = [struct.pack(order + "H", len(entries))], []
+    for tag, kind, count, raw in entries:
+        if len(raw) <= 4:
+            value = raw.ljust(4, b"\0")
+        else:
+            value = struct.pack(order + "I", extra_offset)
+            padded = raw + b"\0" * (len(raw) % 2)
+            extra.append(padded)
+            extra_offset += len(padded)
+        ifd.append(struct.pack(order + "HHI", tag, kind, count) + value)
+    ifd.append(b"\0\0\0\0")
+    header = (b"II" if order == "<" else b"MM") + struct.pack(order + "HI", 42, ifd_offset)
+    return header + body + b"".join(ifd) + b"".join(extra)
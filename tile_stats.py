@@ -0,0 +1,164 @@
+from array import array
+from collections import namedtuple
+
+from PIL import Image, ImageChops, ImageMath
+
+from exporter import grid_size
+
+# Statistics are sampled from the coarsest level with at least this many pixels per cell side
+MIN_CELL_PIXELS = 8
+# Luminance distance (0-255) within which a pixel counts as background
+BACKGROUND_TOLERANCE = 16
+# Cells whose non-background fraction is below this are considered empty
+MIN_COVERAGE = 0.02
+
+CellStats = namedtuple("CellStats", "mean variance coverage")
+
+
+def stats_level(session, grid_w, grid_h):
+    """Coarsest pyramid level that still resolves every cell into MIN_CELL_PIXELS pixels"""
+    level = 0
+    while (level + 1 < len(session.pyramid)
+           and min(grid_w, grid_h) / 2 ** (level + 1) >= MIN_CELL_PIXELS):
+        level += 1
+    return level
+
+
+def _luminance(image):
+    """8-bit luminance of a pyramid level and its alpha channel (None when opaque)"""
+    alpha = image.getchannel("A") if image.mode in ("RGBA", "LA", "PA") else None
+    if image.mode.startswith("I;16"):
+        gray = image.convert("I").convert("F").point(lambda v: v / 257.0).convert("L")
+    elif image.mode in ("I", "F"):
+        lo, hi = image.getextrema()
+        scale = 255.0 / ((hi - lo) or 1)
+        gray = image.convert("F").point(lambda v: (v - lo) * scale).convert("L")
+    else:
+        gray = image.convert("L")
+    return gray, alpha
+
+
+def estimate_background(gray, alpha=None):
+    """Most common luminance of the opaque pixels (the background on sparse slides).
+
+    The histogram is smoothed over a few levels so noise or JPEG ringing around
+    a flat background does not split its peak.
+    """
+    hist = gray.histogram(alpha.point(lambda a: 255 if a else 0) if alpha else None)
+    return max(range(256), key=lambda v: (sum(hist[max(0, v - 2):v + 3]), hist[v]))
+
+
+def _cell_means(image, cols, rows, cell_w, cell_h):
+    """Box-average an F image to one pixel per grid cell.
+
+    The image is resized in up to four pieces (whole cells, last column, last
+    row, corner) so cells cut by the image edge average only their own pixels.
+    """
+    out = Image.new("F", (cols, rows))
+    full_c = min(cols, int(image.width / cell_w))
+    full_r = min(rows, int(image.height / cell_h))
+    xs = [(0, full_c, 0.0, min(full_c * cell_w, image.width)), (full_c, cols - full_c, full_c * cell_w, image.width)]
+    ys = [(0, full_r, 0.0, min(full_r * cell_h, image.height)), (full_r, rows - full_r, full_r * cell_h, image.height)]
+    for c0, n, x0, x1 in xs:
+        for r0, m, y0, y1 in ys:
+            if n > 0 and m > 0 and x1 > x0 and y1 > y0:
+                piece = image.resize((n, m), Image.Resampling.BOX, box=(x0, y0, x1, y1))
+                out.paste(piece, (c0, r0))
+    return out
+
+
+def _floats(image):
+    values = array("f")
+    values.frombytes(image.tobytes())
+    return values
+
+
+class TileStats:
+    """Per-cell statistics of a session for one grid: mean and variance of
+    luminance (0-255) and the fraction of non-background pixels.
+
+    Computed in a handful of whole-image Pillow operations on a coarse pyramid
+    level, so building the index costs about as much as one preview redraw.
+    """
+
+    def __init__(self, grid_w, grid_h, cols, rows, level, background, mean, variance, coverage):
+        self.grid_w = grid_w
+        self.grid_h = grid_h
+        self.cols = cols
+        self.rows = rows
+        self.level = level
+        self.background = background
+        self.mean = mean
+        self.variance = variance
+        self.coverage = coverage
+
+    @classmethod
+    def compute(cls, session, grid_w=None, grid_h=None, background=None, tolerance=BACKGROUND_TOLERANCE):
+        grid_w = grid_w or session.grid_w
+        grid_h = grid_h or session.grid_h
+        cols, rows = grid_size(session.real_width, session.real_height, grid_w, grid_h)
+        level = stats_level(session, grid_w, grid_h)
+        scale = 2 ** level
+
+        gray, alpha = _luminance(session.get_level(level))
+        if background is None:
+            background = estimate_background(gray, alpha)
+        lut = [255 if abs(v - background) > tolerance else 0 for v in range(256)]
+        foreground = gray.point(lut)
+        if alpha is not None:
+            # Fully transparent pixels are background whatever their color
+            foreground = ImageChops.darker(foreground, alpha.point(lambda a: 255 if a else 0))
+
+        values = gray.convert("F")
+        squares = ImageMath.lambda_eval(lambda args: args["v"] * args["v"], v=values)
+        cell_w, cell_h = grid_w / scale, grid_h / scale
+        mean = _floats(_cell_means(values, cols, rows, cell_w, cell_h))
+        mean_sq = _floats(_cell_means(squares, cols, rows, cell_w, cell_h))
+        coverage = _floats(_cell_means(foreground.convert("F"), cols, rows, cell_w, cell_h))
+        variance = array("f", (max(0.0, sq - m * m) for m, sq in zip(mean, mean_sq)))
+        coverage = array("f", (v / 255.0 for v in coverage))
+        return cls(grid_w, grid_h, cols, rows, level, background, mean, variance, coverage)
+
+    def matches(self, session):
+        """True while the session still uses the grid these statistics were computed for"""
+        return (self.grid_w, self.grid_h) == (session.grid_w, session.grid_h)
+
+    def __len__(self):
+        return self.cols * self.rows
+
+    def __getitem__(self, cell):
+        c, r = cell
+        if not (0 <= c < self.cols and 0 <= r < self.rows):
+            raise KeyError(cell)
+        i = r * self.cols + c
+        return CellStats(self.mean[i], self.variance[i], self.coverage[i])
+
+    def items(self):
+        """(cell, CellStats) pairs in row-major order"""
+        for r in range(self.rows):
+            for c in range(self.cols):
+                i = r * self.cols + c
+                yield (c, r), CellStats(self.mean[i], self.variance[i], self.coverage[i])
+
+    def cells_where(self, predicate):
+        """Cells whose CellStats satisfy `predicate`, e.g. lambda s: s.variance > 50"""
+        return [cell for cell, stats in self.items() if predicate(stats)]
+
+    def non_empty_cells(self, min_coverage=MIN_COVERAGE):
+        return self.cells_where(lambda s: s.coverage >= min_coverage)
+
+    def empty_count(self, min_coverage=MIN_COVERAGE):
+        return sum(1 for v in self.coverage if v < min_coverage)
+
+    def select_where(self, selection, predicate):
+        """Add matching cells to a CellSelection; returns how many were added"""
+        before = len(selection)
+        selection.update(self.cells_where(predicate))
+        return len(selection) - before
+
+    def deselect_where(self, selection, predicate):
+        """Remove matching cells from a CellSelection; returns how many were removed"""
+        before = len(selection)
+        for cell in self.cells_where(predicate):
+            selection.discard(cell)
+        return before - len(selection)